@@ -0,0 +1,391 @@
+import argparse
+import csv
+import os
+import time
+from enum import Enum, unique
+from typing import TYPE_CHECKING, Dict, Final, List, Optional, Tuple
+
+import numpy as np
+
+from .atomic import write_atomic
+from .geometry import LinkKind, NetworkGeometry, NodeKind
+from .inp_reader import read_geometry
+from .inpx import read_overlay
+from .overlay import OVERLAY_TYPES, OverlayStore, OverlayType
+
+if TYPE_CHECKING:
+    from .tasks import BackgroundTask
+
+# Attribution of overlay elements to the junctions supplying them, either the
+# nearest junction or the junction end of the nearest pipe. Both searches run
+# on KD-trees over the network arrays, so every element costs one vectorized
+# query instead of a loop over the nodes.
+
+
+@unique
+class AssignmentMode(str, Enum):
+    JUNCTION = "Nearest junction"
+    PIPE = "Nearest pipe"
+
+
+# Nearest samples checked per element in the pipe mode before falling back to
+# a radius search
+_CANDIDATES: Final = 8
+
+
+def _kd_tree(points: np.ndarray):
+    # SciPy is installed with WNTR and, like WNTR, only imported when needed
+    from scipy.spatial import cKDTree  # type: ignore
+
+    return cKDTree(points)
+
+
+def nearest_junctions(geometry: NetworkGeometry, points: np.ndarray) -> np.ndarray:
+    # Node index of the nearest junction of every point, -1 without junctions
+    junctions = np.flatnonzero(geometry.node_kinds == NodeKind.JUNCTION)
+    if len(junctions) == 0 or len(points) == 0:
+        return np.full(len(points), -1, dtype=np.intp)
+    (_, nearest) = _kd_tree(geometry.node_coords[junctions]).query(points, workers=-1)
+    return junctions[nearest]
+
+
+def _pipe_segments(
+    geometry: NetworkGeometry,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Straight pieces of all pipes including their vertices: start and end
+    # points, the pipe of every piece and its distance from the pipe start
+    pipes = np.flatnonzero(geometry.link_kinds == LinkKind.PIPE)
+    first_vertex = geometry.vertex_offsets[pipes]
+    vertices = geometry.vertex_offsets[pipes + 1] - first_vertex
+    # Every pipe is the polyline start node, vertices, end node
+    point_start = np.zeros(len(pipes) + 1, dtype=np.intp)
+    np.cumsum(vertices + 2, out=point_start[1:])
+    coords = np.empty((point_start[-1], 2), dtype=np.float64)
+    coords[point_start[:-1]] = geometry.node_coords[geometry.link_nodes[pipes, 0]]
+    coords[point_start[1:] - 1] = geometry.node_coords[geometry.link_nodes[pipes, 1]]
+    vertex_pipe = np.repeat(np.arange(len(pipes)), vertices)
+    within = np.arange(len(vertex_pipe)) - np.repeat(
+        np.cumsum(vertices) - vertices, vertices
+    )
+    coords[point_start[vertex_pipe] + 1 + within] = geometry.vertex_coords[
+        first_vertex[vertex_pipe] + within
+    ]
+
+    starts = np.delete(np.arange(len(coords)), point_start[1:] - 1)
+    segment_pipe = np.repeat(np.arange(len(pipes)), vertices + 1)
+    lengths = np.hypot(*(coords[starts + 1] - coords[starts]).T)
+    # Distance along the pipe to the start of every segment
+    before = np.cumsum(lengths) - lengths
+    before -= before[np.searchsorted(segment_pipe, segment_pipe)]
+    return (coords[starts], coords[starts + 1], pipes[segment_pipe], before)
+
+
+def _project(
+    points: np.ndarray, a: np.ndarray, b: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Distances of the points to the segments a-b and the segment parameters
+    # of the closest points
+    d = b - a
+    length2 = (d * d).sum(axis=1)
+    t = ((points - a) * d).sum(axis=1) / np.where(length2 > 0.0, length2, 1.0)
+    np.clip(t, 0.0, 1.0, out=t)
+    closest = a + t[:, np.newaxis] * d
+    return (np.hypot(*(points - closest).T), t)
+
+
+def nearest_pipe_junctions(
+    geometry: NetworkGeometry,
+    points: np.ndarray,
+    task: Optional["BackgroundTask"] = None,
+) -> np.ndarray:
+    # Node index of the pipe end closer along the nearest pipe to every
+    # point. Ends that are tanks or reservoirs give way to the other end; -1
+    # where neither is a junction.
+    result = np.full(len(points), -1, dtype=np.intp)
+    (a, b, segment_link, before) = _pipe_segments(geometry)
+    if len(a) == 0 or len(points) == 0:
+        return result
+    lengths = np.hypot(*(b - a).T)
+    link_lengths = np.bincount(
+        segment_link, lengths, minlength=len(geometry.link_kinds)
+    )
+
+    # The tree holds sample points at most `piece` apart along every segment,
+    # so a segment is never more than piece / 2 closer than its nearest
+    # sample. Long outliers are split instead of widening every search.
+    piece = max(float(np.median(lengths)), lengths.sum() / (4 * len(lengths))) or 1.0
+    pieces = np.maximum(1, np.ceil(lengths / piece)).astype(np.intp)
+    sample_segment = np.repeat(np.arange(len(a)), pieces)
+    sample_t = (
+        np.arange(len(sample_segment))
+        - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        + 0.5
+    ) / pieces[sample_segment]
+    samples = a[sample_segment] + sample_t[:, np.newaxis] * (
+        b[sample_segment] - a[sample_segment]
+    )
+    tree = _kd_tree(samples)
+    if task:
+        task.check_cancelled()
+        task.report_progress(0.4, "Searching nearest pipes")
+
+    k = min(_CANDIDATES, len(samples))
+    (sample_distances, nearest) = tree.query(points, k=k, workers=-1)
+    nearest = nearest.reshape(len(points), k)
+    candidates = sample_segment[nearest]
+    (distances, ts) = _project(
+        np.repeat(points, k, axis=0), a[candidates.ravel()], b[candidates.ravel()]
+    )
+    best = distances.reshape(-1, k).argmin(axis=1)
+    rows = np.arange(len(points))
+    segment = candidates[rows, best]
+    t = ts.reshape(-1, k)[rows, best]
+    distance = distances.reshape(-1, k)[rows, best]
+
+    # Exact unless a segment without a sample among the candidates could
+    # still be closer
+    limit = distance + piece / 2
+    unsure = np.flatnonzero(sample_distances.reshape(len(points), k)[:, -1] < limit)
+    if len(unsure) and k < len(samples):
+        if task:
+            task.check_cancelled()
+        for (i, found) in zip(
+            unsure.tolist(), tree.query_ball_point(points[unsure], limit[unsure])
+        ):
+            segments = np.unique(sample_segment[found])
+            (d, ts) = _project(
+                np.broadcast_to(points[i], (len(segments), 2)),
+                a[segments],
+                b[segments],
+            )
+            j = int(d.argmin())
+            (segment[i], t[i]) = (segments[j], ts[j])
+
+    link = segment_link[segment]
+    along = before[segment] + t * lengths[segment]
+    ends = geometry.link_nodes[link]
+    closer = np.where(along * 2 <= link_lengths[link], 0, 1)
+    near = ends[rows, closer]
+    far = ends[rows, 1 - closer]
+    junction = geometry.node_kinds == NodeKind.JUNCTION
+    result[:] = np.where(junction[near], near, np.where(junction[far], far, -1))
+    return result
+
+
+def assign(
+    geometry: NetworkGeometry,
+    store: OverlayStore,
+    mode: AssignmentMode = AssignmentMode.JUNCTION,
+    task: Optional["BackgroundTask"] = None,
+) -> np.ndarray:
+    # Node index assigned to every overlay element, -1 for none
+    if task:
+        task.report_progress(0.1, "Building search tree")
+    points = store.points()
+    if mode == AssignmentMode.PIPE:
+        return nearest_pipe_junctions(geometry, points, task)
+    return nearest_junctions(geometry, points)
+
+
+def junction_counts(
+    geometry: NetworkGeometry, store: OverlayStore, nodes: np.ndarray
+) -> np.ndarray:
+    # Elements per node (rows) and overlay type (columns)
+    types = len(OVERLAY_TYPES)
+    valid = nodes >= 0
+    counts = np.bincount(
+        nodes[valid] * types + store.types[valid],
+        minlength=len(geometry.node_names) * types,
+    )
+    return counts.reshape(-1, types)
+
+
+def write_counts(filename: str, geometry: NetworkGeometry, counts: np.ndarray) -> None:
+    junctions = np.flatnonzero(geometry.node_kinds == NodeKind.JUNCTION)
+    totals = counts.sum(axis=1)
+    with open(filename, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Junction"] + [t.value for t in OVERLAY_TYPES] + ["Total"])
+        for (node, row, total) in zip(
+            junctions.tolist(), counts[junctions].tolist(), totals[junctions].tolist()
+        ):
+            writer.writerow([geometry.node_names[node]] + row + [total])
+
+
+def _demand_patterns(source: str) -> Dict[bytes, Optional[bytes]]:
+    # Junctions with entries in [DEMANDS] and the pattern of their first one
+    patterns: Dict[bytes, Optional[bytes]] = {}
+    section = b""
+    with open(source, "rb") as src:
+        for line in src:
+            tokens = line.split(b";", 1)[0].split()
+            if tokens and tokens[0].startswith(b"["):
+                section = tokens[0].upper()
+            elif section == b"[DEMANDS]" and len(tokens) > 1:
+                patterns.setdefault(tokens[0], tokens[2] if len(tokens) > 2 else None)
+    return patterns
+
+
+def write_demands(
+    source: str,
+    destination: str,
+    geometry: NetworkGeometry,
+    counts: np.ndarray,
+    demands: Dict[OverlayType, float],
+    replace: bool = False,
+) -> int:
+    # Copies the INP file with the base demand of the junctions in
+    # [JUNCTIONS] raised by, or with `replace` set to, the demand of their
+    # elements. EPANET ignores that base demand for junctions with entries in
+    # [DEMANDS], so these get another entry there instead, with the pattern of
+    # their first one. With `replace` it takes the place of their entries.
+    # Returns the number of junctions changed.
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        raise ValueError("The INP file cannot be overwritten!")
+    per_type = np.array([demands.get(t, 0.0) for t in OVERLAY_TYPES])
+    added = counts @ per_type
+    node_index = {name: i for (i, name) in enumerate(geometry.node_names)}
+
+    categories: Dict[bytes, bytes] = {}
+    patterns = _demand_patterns(source)
+    for (name, pattern) in patterns.items():
+        node = node_index.get(name.decode("utf-8", "replace"))
+        if node is not None and (replace or added[node] != 0.0):
+            fields = [name, f"{added[node]:.6g}".encode("ascii")]
+            if pattern is not None:
+                fields.append(pattern)
+            categories[name] = b"\t".join(fields) + b"\t;Overlay elements"
+    changed = len(categories)
+
+    def write(dst) -> None:
+        nonlocal changed
+        ending = b"\n"
+        # Blank lines at the end of [DEMANDS] stay after the added entries
+        held: List[bytes] = []
+
+        def add_categories() -> None:
+            for line in categories.values():
+                dst.write(line + ending)
+            categories.clear()
+
+        with open(source, "rb") as src:
+            section = b""
+            for line in src:
+                ending = line[len(line.rstrip(b"\r\n")) :] or ending
+                comment = line.find(b";")
+                data = line if comment < 0 else line[:comment]
+                tokens = data.split()
+                if tokens and tokens[0].startswith(b"["):
+                    if section == b"[DEMANDS]":
+                        add_categories()
+                    section = tokens[0].upper()
+                elif section == b"[DEMANDS]":
+                    if not line.strip():
+                        held.append(line)
+                        continue
+                    if replace and tokens and tokens[0] in categories:
+                        continue
+                elif section == b"[JUNCTIONS]" and tokens:
+                    node = node_index.get(tokens[0].decode("utf-8", "replace"))
+                    if (
+                        node is not None
+                        and (replace or added[node] != 0.0)
+                        and tokens[0] not in patterns
+                    ):
+                        old = float(tokens[2]) if len(tokens) > 2 else 0.0
+                        demand = added[node] + (0.0 if replace else old)
+                        fields = [
+                            tokens[0],
+                            tokens[1] if len(tokens) > 1 else b"0",
+                            f"{demand:.6g}".encode("ascii"),
+                        ] + tokens[3:]
+                        rest = line[comment:].rstrip(b"\r\n") if comment >= 0 else b""
+                        line = b"\t".join(fields) + (b"\t" + rest if rest else b"")
+                        line += ending
+                        changed += 1
+                for blank in held:
+                    dst.write(blank)
+                held.clear()
+                dst.write(line)
+            if categories and section == b"[DEMANDS]" and not line.endswith(b"\n"):
+                dst.write(ending)
+            add_categories()
+            for blank in held:
+                dst.write(blank)
+
+    write_atomic(destination, write)
+    return changed
+
+
+def _demand(value: str) -> Tuple[OverlayType, float]:
+    (name, _, demand) = value.partition("=")
+    try:
+        return (OverlayType(name), float(demand))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"expected TYPE=DEMAND with TYPE one of "
+            f"{', '.join(t.value for t in OverlayType)}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m annotator.assignment",
+        description="Assign overlay elements to the nearest junction of the "
+        "network and count them per junction and type.",
+    )
+    parser.add_argument("inp")
+    parser.add_argument("overlay")
+    parser.add_argument("-o", "--output", help="CSV file of the counts")
+    parser.add_argument(
+        "--pipes",
+        action="store_true",
+        help="assign to the closer end of the nearest pipe instead",
+    )
+    parser.add_argument(
+        "--demand",
+        type=_demand,
+        action="append",
+        default=[],
+        metavar="TYPE=DEMAND",
+        help="base demand of one element of the type, e.g. House=0.02",
+    )
+    parser.add_argument(
+        "--inp-output", help="copy of the INP file with the demands added"
+    )
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="replace the base demands instead of adding to them",
+    )
+    args = parser.parse_args()
+    if not args.output and not args.inp_output:
+        parser.error("either --output or --inp-output is required")
+
+    start = time.perf_counter()
+    geometry = read_geometry(args.inp)
+    (_, store) = read_overlay(args.overlay)
+    store = store or OverlayStore()
+    loaded = time.perf_counter()
+    mode = AssignmentMode.PIPE if args.pipes else AssignmentMode.JUNCTION
+    nodes = assign(geometry, store, mode)
+    counts = junction_counts(geometry, store, nodes)
+    assigned = time.perf_counter()
+    print(
+        f"{int((nodes >= 0).sum())} of {len(store)} elements assigned to "
+        f"{int((counts.sum(axis=1) > 0).sum())} junctions "
+        f"({mode.value.lower()}) in {assigned - loaded:.2f} s, "
+        f"loading took {loaded - start:.2f} s"
+    )
+    if args.output:
+        write_counts(args.output, geometry, counts)
+        print(f"Counts written to {args.output}")
+    if args.inp_output:
+        changed = write_demands(
+            args.inp, args.inp_output, geometry, counts, dict(args.demand), args.replace
+        )
+        print(f"{changed} junction demands written to {args.inp_output}")
+
+
+if __name__ == "__main__":
+    main()
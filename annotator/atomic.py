@@ -0,0 +1,38 @@
+import os
+import stat
+import tempfile
+from typing import BinaryIO, Callable
+
+
+def _umask() -> int:
+    # Setting the umask is the only portable way to read it. It is done once
+    # at import, as changing it while other threads create files would give
+    # their files the wrong permissions.
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+
+_UMASK = _umask()
+
+
+def write_atomic(filename: str, write: Callable[[BinaryIO], None]) -> None:
+    # Writes through `write` to a temporary file that then replaces
+    # `filename`, so readers see either the old or the new file, never a
+    # partial one. The file keeps the permissions of the one it replaces, or
+    # gets those of a file created with open().
+    directory = os.path.dirname(os.path.abspath(filename))
+    try:
+        mode = stat.S_IMODE(os.stat(filename).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    (fd, temp) = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.chmod(temp, mode)
+        os.replace(temp, filename)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
@@ -0,0 +1,56 @@
+import time
+from typing import Tuple
+
+
+class DrawStats:
+    def __init__(self):
+        self.primitives: int = 0
+        self.fills: int = 0
+        self.strokes: int = 0
+        self.source_changes: int = 0
+        self.seconds: float = 0.0
+
+    @property
+    def draw_calls(self) -> int:
+        return self.fills + self.strokes + self.source_changes
+
+    def __str__(self) -> str:
+        return (
+            f"{self.primitives} primitives, {self.draw_calls} draw calls "
+            f"({self.fills} fills, {self.strokes} strokes, "
+            f"{self.source_changes} colour changes) in {self.seconds * 1000:.1f} ms"
+        )
+
+
+def compare_draw_modes(
+    net,
+    area: Tuple[int, int, int, int],
+    scale: float,
+    offset_x: float,
+    offset_y: float,
+) -> Tuple[DrawStats, DrawStats]:
+    # Renders the network and overlay inside `area` once per primitive and
+    # once batched per style and returns the statistics of both passes.
+    # pycairo is only needed here, the statistics themselves are used by
+    # code that runs without it
+    import cairo
+
+    (x, y, width, height) = area
+    batched = net.batched
+    results = []
+    try:
+        for mode in (False, True):
+            net.batched = mode
+            stats = DrawStats()
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+            ctx = cairo.Context(surface)
+            ctx.translate(-x, -y)
+            start = time.perf_counter()
+            net.draw_network(ctx, scale, offset_x, offset_y, stats)
+            net.draw_overlay(ctx, scale, offset_x, offset_y, stats)
+            surface.flush()
+            stats.seconds = time.perf_counter() - start
+            results.append(stats)
+    finally:
+        net.batched = batched
+    return (results[0], results[1])
@@ -1,16 +1,38 @@
-import json
 import math
+import time
 
 import cairo
 import gi  # type: ignore
 
 gi.require_version("Gtk", "3.0")
 from enum import Enum, unique
-from typing import Optional
+from typing import Callable, Dict, Final, Iterator, List, Optional, Tuple
 
-from gi.repository import Gdk, GdkPixbuf, GLib, Gtk  # type: ignore
+import numpy as np
+from gi.repository import Gdk, GLib, GObject, Gtk  # type: ignore
 
-from .network import Network, OverlayElement, OverlayType
+from .assignment import AssignmentMode, assign, junction_counts, write_counts
+from .draw_stats import DrawStats, compare_draw_modes
+from .geometry_cache import GeometryCache
+from .image_pyramid import ImagePyramid
+from .importer import ImportOptions, ImportResult, read_points
+from .inpx import Alignment, read_overlay, write_overlay
+from .journal import (
+    Action,
+    EditHistory,
+    Journal,
+    align_action,
+    insert_action,
+    place_action,
+    remove_action,
+    session_path,
+)
+from .layer_cache import LayerCache, Rect, clip_rect, contains, make_rect
+from .network import Network
+from .overlay import OverlayStore, OverlayType
+from .profiler import RenderProfiler
+from .status_bar import StatusBar
+from .tasks import BackgroundTask
 
 
 @unique
@@ -21,22 +43,52 @@ class Layer(str, Enum):
 
 
 class DrawingArea(Gtk.ScrolledWindow):
+    __gsignals__ = {
+        "network-loaded": (GObject.SignalFlags.RUN_FIRST, None, ()),
+        "history-changed": (GObject.SignalFlags.RUN_FIRST, None, ()),
+        "zoom-changed": (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
+    # Pixels around an element centre touched by its marker and selection ring
+    DAMAGE_MARGIN: Final = 10
+    # Edits of more elements repaint their bounding box as one rectangle
+    MAX_DAMAGE_RECTS: Final = 64
+    # Delay before the profiler HUD is repainted after a partial redraw
+    HUD_REFRESH_MS: Final = 250
+    # Zoom factor of one scroll wheel step with Ctrl held, and the zoom range
+    ZOOM_STEP: Final = 1.1
+    MIN_ZOOM: Final = 0.05
+    MAX_ZOOM: Final = 20.0
+    # Time without scrolling after which a zoom is rendered in full quality
+    SETTLE_MS: Final = 150
+    # Time spent per idle callback on progressive rendering, and the number of
+    # primitives drawn between checks of the deadline
+    FRAME_BUDGET: Final = 0.008
+    PROGRESSIVE_CHUNK: Final = 2048
+    # Level of detail of the network preview shown until the full rendering
+    # is ready, coarser than Network.LOD_CELL_PIXELS
+    PREVIEW_CELL_PIXELS: Final = 12
+
     def __init__(
         self,
         window: Gtk.Window,
+        status_bar: StatusBar,
         *args,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
         self.set_policy(Gtk.PolicyType.ALWAYS, Gtk.PolicyType.ALWAYS)
         self.window = window
+        self.status_bar = status_bar
 
         self._current_layer: Layer = Layer.BACKGROUND
         self._overlay_type: OverlayType = OverlayType.HOUSE
         self._ratio_image: float = 1.0
         self._ratio_network: float = 1.0
-        self._original_image: Optional[GdkPixbuf.Pixbuf] = None
-        self._displayed_image: Optional[GdkPixbuf.Pixbuf] = None
+        self._image: Optional[ImagePyramid] = None
+        self._image_task: Optional[BackgroundTask] = None
+        self._net_task: Optional[BackgroundTask] = None
+        self._import_task: Optional[BackgroundTask] = None
+        self._geometry_cache = GeometryCache()
         self._offset_x_image: int = 0
         self._offset_y_image: int = 0
         self._mouse_pressed_x: int = -1
@@ -44,16 +96,44 @@ class DrawingArea(Gtk.ScrolledWindow):
         self._net: Optional[Network] = None
         self._offset_x_net: int = 0
         self._offset_y_net: int = 0
+        self._batched_rendering: bool = True
+        self._progressive: bool = False
+        self._progressive_source: Optional[int] = None
+        self._layer_caches: Dict[Layer, LayerCache] = {
+            layer: LayerCache() for layer in Layer
+        }
+        # Ids of the selected overlay elements
+        self._selection: np.ndarray = np.empty(0, dtype=np.int64)
+        # x1, y1, x2, y2 of the rectangle being dragged with Shift held
+        self._rubber_band: Optional[Tuple[int, int, int, int]] = None
+        self._moving_selection: bool = False
+        self._drag_x: int = 0
+        self._drag_y: int = 0
+        self._history: Optional[EditHistory] = None
+        self._profiler = RenderProfiler()
+        # While a layer is dragged or zoomed, its last rendering is moved and
+        # scaled instead of being re-rendered for every frame
+        self._transformed: Tuple[Layer, ...] = ()
+        self._interaction_start: Optional[Alignment] = None
+        self._drag_origin: Tuple[int, int] = (0, 0)
+        self._settle_source: Optional[int] = None
+        self._hud_refresh: Optional[int] = None
 
         self.area = Gtk.DrawingArea()
         self.area.set_events(Gdk.EventMask.ALL_EVENTS_MASK)
         self.area.connect("draw", self.on_draw)
         self.area.connect("button-press-event", self.on_drawing_area_mouse_press)
         self.area.connect("button-release-event", self.on_drawing_area_mouse_release)
+        self.area.connect("motion-notify-event", self.on_drawing_area_mouse_move)
+        self.area.connect("key-press-event", self.on_drawing_area_key_press)
+        self.area.connect("scroll-event", self.on_drawing_area_scroll)
+        self.area.set_can_focus(True)
 
         self._viewport = Gtk.Viewport()
         self._viewport.add(self.area)
         self.add(self._viewport)
+        self.get_hadjustment().connect("value-changed", self._on_scrolled)
+        self.get_vadjustment().connect("value-changed", self._on_scrolled)
 
     @property
     def current_layer(self) -> Layer:
@@ -61,7 +141,9 @@ class DrawingArea(Gtk.ScrolledWindow):
 
     @current_layer.setter
     def current_layer(self, value: Layer) -> None:
+        self._end_interaction()
         self._current_layer = value
+        self.area.queue_draw()
 
     @property
     def ratio_image(self) -> float:
@@ -79,146 +161,426 @@ class DrawingArea(Gtk.ScrolledWindow):
     def overlay_type(self, value: OverlayType):
         self._overlay_type = value
 
+    @property
+    def batched_rendering(self) -> bool:
+        return self._batched_rendering
+
+    @batched_rendering.setter
+    def batched_rendering(self, value: bool) -> None:
+        self._batched_rendering = value
+        if self._net:
+            self._net.batched = value
+            self._layer_caches[Layer.NETWORK].invalidate()
+            self._layer_caches[Layer.OVERLAY].invalidate()
+            self.area.queue_draw()
+
+    @property
+    def progressive_rendering(self) -> bool:
+        return self._progressive
+
+    @progressive_rendering.setter
+    def progressive_rendering(self, value: bool) -> None:
+        self._progressive = value
+        if not value:
+            for cache in self._layer_caches.values():
+                cache.cancel()
+            if self._progressive_source is not None:
+                GLib.source_remove(self._progressive_source)
+                self._progressive_source = None
+        self.area.queue_draw()
+
+    @property
+    def profiling(self) -> bool:
+        return self._profiler.enabled
+
+    @profiling.setter
+    def profiling(self, value: bool) -> None:
+        self._profiler.enabled = value
+        self._profiler.reset()
+        if not value and self._hud_refresh is not None:
+            GLib.source_remove(self._hud_refresh)
+            self._hud_refresh = None
+        self.area.queue_draw()
+
+    def save_render_trace(self, filename: str) -> None:
+        try:
+            self._profiler.save_trace(filename)
+        except OSError as e:
+            self._show_error(f"Unable to save the render trace: {e}")
+
+    def can_undo(self) -> bool:
+        return self._history is not None and self._history.can_undo()
+
+    def can_redo(self) -> bool:
+        return self._history is not None and self._history.can_redo()
+
+    def undo(self) -> None:
+        self._end_interaction()
+        if self._history and self._history.undo():
+            self._on_history_applied()
+
+    def redo(self) -> None:
+        self._end_interaction()
+        if self._history and self._history.redo():
+            self._on_history_applied()
+
+    def _on_history_applied(self) -> None:
+        # Ids may have been reused, so the selection is dropped
+        self._clear_selection()
+        self._layer_caches[Layer.OVERLAY].invalidate()
+        self.area.queue_draw()
+        self.emit("history-changed")
+
+    def _push(self, action: Action) -> None:
+        if self._history:
+            self._history.push(action)
+            self.emit("history-changed")
+
+    def _push_alignment(self, old: Alignment) -> None:
+        new = self._alignment()
+        if new != old:
+            self._push(align_action(old, new))
+
     def net_loaded(self) -> bool:
         return self._net is not None
 
     def bg_loaded(self) -> bool:
-        return self._original_image is not None
+        return self._image is not None
 
     def load_bg_from_file(self, filename: str) -> None:
-        try:
-            self._original_image = GdkPixbuf.Pixbuf.new_from_file(filename)
-            self._displayed_image = GdkPixbuf.Pixbuf.new_from_file(filename)
-            self._scale_image()
-            self.area.queue_draw()
-        except GLib.Error:
-            self._original_image = None
-            self._displayed_image = None
-            dialog = Gtk.MessageDialog(
-                transient_for=self.window,
-                message_type=Gtk.MessageType.ERROR,
-                buttons=Gtk.ButtonsType.CANCEL,
-                text="Unable to load image!",
-            )
-            dialog.run()
-            dialog.destroy()
+        # A newer choice supersedes a load that is still in progress
+        if self._image_task:
+            self._image_task.cancel()
+        self._image_task = BackgroundTask(
+            lambda task: ImagePyramid.from_file(filename, task),
+            self._on_bg_loaded,
+            self._on_bg_error,
+        )
+        self.status_bar.track(self._image_task, "Loading background image")
+        self._image_task.start()
+
+    def _on_bg_loaded(self, image: ImagePyramid) -> None:
+        self._image_task = None
+        self._image = image
+        self._layer_caches[Layer.BACKGROUND].invalidate()
+        self.area.queue_draw()
+
+    def _on_bg_error(self, error: Exception) -> None:
+        self._image_task = None
+        self._image = None
+        self._layer_caches[Layer.BACKGROUND].invalidate()
+        self.area.queue_draw()
+        self._show_error("Unable to load image!")
 
     def load_inp_from_file(self, filename: str) -> None:
+        if self._net_task:
+            self._net_task.cancel()
+        self._net_task = BackgroundTask(
+            lambda task: self._parse_network(filename, task),
+            self._on_inp_loaded,
+            self._on_inp_error,
+        )
+        self.status_bar.track(self._net_task, "Loading INP file")
+        self._net_task.start()
+
+    def _parse_network(self, filename: str, task: BackgroundTask) -> Network:
+        # Runs in a worker thread, the network is only swapped in once it is
+        # completely built
+        net = Network(self)
+        net.batched = self._batched_rendering
+        if not net.load_network(filename, task, self._geometry_cache):
+            raise Exception("Inappropriate size of network!")
+        # Only what drawing needs stays in memory for the whole session
+        net.release_model()
+        return net
+
+    def _on_inp_loaded(self, net: Network) -> None:
+        self._net_task = None
+        self._clear_selection()
+        self._net = net
+        self._layer_caches[Layer.NETWORK].invalidate()
+        self._layer_caches[Layer.OVERLAY].invalidate()
+        # Annotations that were never saved are journaled next to the cache
+        self._new_history()
+        self._start_journal(session_path(net.filename), None)  # type: ignore
+        self.area.queue_draw()
+        self.emit("network-loaded")
+        self.emit("history-changed")
+
+    def _new_history(self) -> None:
+        if self._history and self._history.journal:
+            # A journal left behind keeps its edits available for recovery
+            self._history.journal.close()
+        self._history = EditHistory(
+            self._net, self._alignment, self._apply_alignment  # type: ignore
+        )
+        self._history.on_journal_error = self._on_journal_error
+
+    def _start_journal(self, path: str, base: Optional[str]) -> None:
+        # `base` is the file the current overlay was read from, None when the
+        # overlay only exists in memory
+        journal = Journal(path)
+        recovered = False
+        if journal.pending() and self._ask(
+            "Recover unsaved annotations?",
+            "The overlay has edits from a previous session that were not saved.",
+        ):
+            alignment = self._alignment()
+            elements = self._net.elements  # type: ignore
+            try:
+                (recovered_alignment, recovered_elements, actions) = journal.recover()
+                self._apply_alignment(recovered_alignment)
+                self._net.elements = recovered_elements  # type: ignore
+                self._history.replay(actions)  # type: ignore
+                self._layer_caches[Layer.OVERLAY].invalidate()
+                recovered = True
+            except Exception as e:
+                self._apply_alignment(alignment)
+                self._net.elements = elements  # type: ignore
+                self._show_error(f"Unable to recover the annotations: {e}")
         try:
-            self._net = Network(self)
-            if not self._net.load_network(filename):
-                raise Exception("Inappropriate size of network!")
-            self.area.queue_draw()
-        except Exception as e:
-            self._net = None
-            dialog = Gtk.MessageDialog(
-                transient_for=self.window,
-                message_type=Gtk.MessageType.ERROR,
-                buttons=Gtk.ButtonsType.CANCEL,
-                text=str(e),
-            )
-            dialog.run()
-            dialog.destroy()
+            if recovered or (base is None and len(self._net.elements)):  # type: ignore
+                journal.compact(self._alignment(), self._net.elements)  # type: ignore
+            else:
+                journal.start(self._alignment(), base)
+        except OSError as e:
+            self._on_journal_error(e)
+            return
+        self._history.journal = journal  # type: ignore
+
+    def _on_journal_error(self, error: Exception) -> None:
+        self._show_error(f"Autosave is disabled: {error}")
+
+    def _ask(self, text: str, secondary: str) -> bool:
+        dialog = Gtk.MessageDialog(
+            transient_for=self.window,
+            message_type=Gtk.MessageType.QUESTION,
+            buttons=Gtk.ButtonsType.YES_NO,
+            text=text,
+        )
+        dialog.format_secondary_text(secondary)
+        response = dialog.run()
+        dialog.destroy()
+        return response == Gtk.ResponseType.YES
+
+    def _show_error(self, text: str) -> None:
+        dialog = Gtk.MessageDialog(
+            transient_for=self.window,
+            message_type=Gtk.MessageType.ERROR,
+            buttons=Gtk.ButtonsType.CANCEL,
+            text=text,
+        )
+        dialog.run()
+        dialog.destroy()
+
+    def _on_inp_error(self, error: Exception) -> None:
+        self._net_task = None
+        self._show_error(str(error))
 
     def load_overlay_from_file(self, filename: str) -> None:
         if self._net:
             try:
-                with open(filename, "r", encoding="utf-8") as f:
-                    content = json.load(f)
-                    if not isinstance(content, dict):
-                        raise Exception("Invalid file format!")
-                    if "offset_img_x" in content:
-                        self._offset_x_image = float(content["offset_img_x"])
-                    if "offset_img_y" in content:
-                        self._offset_y_image = float(content["offset_img_y"])
-                    if "scale_img" in content:
-                        self._ratio_image = float(content["scale_img"])
-                    if "offset_net_x" in content:
-                        self._offset_x_net = float(content["offset_net_x"])
-                    if "offset_net_y" in content:
-                        self._offset_y_net = float(content["offset_net_y"])
-                    if "scale_net" in content:
-                        self._ratio_network = float(content["scale_net"])
-                    if "elements" in content and isinstance(content["elements"], list):
-                        elements = []
-                        for e in content["elements"]:
-                            if "x" in e and "y" in e and "type" in e:
-                                elements.append(
-                                    OverlayElement(
-                                        float(e["x"]),
-                                        float(e["y"]),
-                                        OverlayType(e["type"]),
-                                    )
-                                )
-                        self._net.elements = elements
-                    self.area.queue_draw()
-            except Exception as e:
-                dialog = Gtk.MessageDialog(
-                    transient_for=self.window,
-                    message_type=Gtk.MessageType.ERROR,
-                    buttons=Gtk.ButtonsType.CANCEL,
-                    text=str(e),
+                (alignment, elements) = read_overlay(filename)
+                self._apply_alignment(alignment)
+                if elements is not None:
+                    self._clear_selection()
+                    self._net.elements = elements
+                    self._layer_caches[Layer.OVERLAY].invalidate()
+                self._new_history()
+                self._start_journal(
+                    filename, filename if elements is not None else None
                 )
-                dialog.run()
-                dialog.destroy()
+                self.area.queue_draw()
+                self.emit("history-changed")
+            except Exception as e:
+                self._show_error(str(e))
 
-    def save_overlay_to_file(self, filename: str) -> None:
+    def save_overlay_to_file(self, filename: str, binary: bool = False) -> None:
         if self._net:
             try:
-                with open(filename, "w", encoding="utf-8") as f:
-                    json.dump(
-                        {
-                            "offset_img_x": self._offset_x_image,
-                            "offset_img_y": self._offset_y_image,
-                            "scale_img": self._ratio_image,
-                            "offset_net_x": self._offset_x_net,
-                            "offset_net_y": self._offset_y_net,
-                            "scale_net": self._ratio_network,
-                            "elements": [e.__dict__ for e in self._net.elements],
-                        },
-                        f,
-                        ensure_ascii=False,
-                    )
+                write_overlay(filename, self._alignment(), self._net.elements, binary)
+                self._restart_journal(filename)
             except Exception as e:
-                dialog = Gtk.MessageDialog(
-                    transient_for=self.window,
-                    message_type=Gtk.MessageType.ERROR,
-                    buttons=Gtk.ButtonsType.CANCEL,
-                    text=str(e),
-                )
-                dialog.run()
-                dialog.destroy()
-
-    def _scale_image(self) -> None:
-        if self._displayed_image:
-            self._displayed_image = self._original_image.scale_simple(  # type: ignore
-                self._original_image.get_width() * self._ratio_image,  # type: ignore
-                self._original_image.get_height() * self._ratio_image,  # type: ignore
-                2,
+                self._show_error(str(e))
+
+    def _restart_journal(self, filename: str) -> None:
+        # After saving, only edits made since then need to be journaled
+        history = self._history
+        if history is None:
+            return
+        if history.journal:
+            history.journal.close()
+            if history.journal.path != filename:
+                history.journal.discard()
+        history.journal = None
+        journal = Journal(filename)
+        try:
+            journal.start(self._alignment(), filename)
+        except OSError as e:
+            self._on_journal_error(e)
+            return
+        history.journal = journal
+
+    def import_buildings(self, filename: str, screen_coordinates: bool) -> None:
+        # Points are read in a worker thread and appended in one go
+        if not self._net:
+            return
+        net = self._net
+        transform = net.screen_to_net if screen_coordinates else None
+        if self._import_task:
+            self._import_task.cancel()
+        self._import_task = BackgroundTask(
+            lambda task: read_points(filename, ImportOptions(), transform, task),
+            lambda result: self._on_import_done(net, result),
+            self._on_import_error,
+        )
+        self.status_bar.track(self._import_task, "Importing buildings")
+        self._import_task.start()
+
+    def _on_import_done(self, net: Network, result: ImportResult) -> None:
+        self._import_task = None
+        if net is not self._net:
+            # Another network was loaded in the meantime
+            return
+        (store, skipped) = result
+        self._clear_selection()
+        net.extend_elements(store.xs, store.ys, store.types)
+        self._layer_caches[Layer.OVERLAY].invalidate()
+        # The undo history cannot hold an import of this size, the journal
+        # continues from a snapshot including it instead
+        history = self._history
+        if history:
+            history.clear()
+            if history.journal:
+                try:
+                    history.journal.compact(self._alignment(), net.elements)
+                except OSError as e:
+                    history.journal.close()
+                    history.journal = None
+                    self._on_journal_error(e)
+        self.area.queue_draw()
+        self.emit("history-changed")
+        dialog = Gtk.MessageDialog(
+            transient_for=self.window,
+            message_type=Gtk.MessageType.INFO,
+            buttons=Gtk.ButtonsType.OK,
+            text=f"{len(store)} buildings imported",
+        )
+        if skipped:
+            dialog.format_secondary_text(
+                f"{skipped} records without valid coordinates or type were skipped."
             )
+        dialog.run()
+        dialog.destroy()
+
+    def _on_import_error(self, error: Exception) -> None:
+        self._import_task = None
+        self._show_error(f"Unable to import the buildings: {error}")
+
+    def export_junction_counts(self, filename: str, mode: AssignmentMode) -> None:
+        if not self._net:
+            return
+        net = self._net
+        store = net.elements
+        # The worker gets a copy, so the overlay stays editable meanwhile
+        snapshot = OverlayStore.from_arrays(
+            store.xs.copy(), store.ys.copy(), store.types.copy()
+        )
+
+        def work(task: BackgroundTask) -> None:
+            # The geometry was released after loading and is read again here
+            geometry = net.geometry
+            if geometry is None:
+                return
+            nodes = assign(geometry, snapshot, mode, task)
+            task.check_cancelled()
+            task.report_progress(0.9, "Writing counts")
+            write_counts(filename, geometry, junction_counts(geometry, snapshot, nodes))
+
+        task = BackgroundTask(
+            work,
+            lambda _: net.release_model(),
+            lambda e: self._show_error(f"Unable to export the junction counts: {e}"),
+        )
+        self.status_bar.track(task, "Assigning overlay elements to junctions")
+        task.start()
+
+    def _alignment(self) -> Alignment:
+        return {
+            "offset_img_x": self._offset_x_image,
+            "offset_img_y": self._offset_y_image,
+            "scale_img": self._ratio_image,
+            "offset_net_x": self._offset_x_net,
+            "offset_net_y": self._offset_y_net,
+            "scale_net": self._ratio_network,
+        }
+
+    def _apply_alignment(self, alignment: Alignment) -> None:
+        if "offset_img_x" in alignment:
+            self._offset_x_image = alignment["offset_img_x"]
+        if "offset_img_y" in alignment:
+            self._offset_y_image = alignment["offset_img_y"]
+        if "scale_img" in alignment:
+            self._ratio_image = alignment["scale_img"]
+        if "offset_net_x" in alignment:
+            self._offset_x_net = alignment["offset_net_x"]
+        if "offset_net_y" in alignment:
+            self._offset_y_net = alignment["offset_net_y"]
+        if "scale_net" in alignment:
+            self._ratio_network = alignment["scale_net"]
+
+    def draw_statistics(self) -> str:
+        if not self._net:
+            return "No network loaded."
+        visible = (
+            int(self.get_hadjustment().get_value()),
+            int(self.get_vadjustment().get_value()),
+            max(1, int(self.get_hadjustment().get_page_size())),
+            max(1, int(self.get_vadjustment().get_page_size())),
+        )
+        (single, batched) = compare_draw_modes(
+            self._net,
+            visible,
+            self._ratio_network,
+            self._offset_x_net,
+            self._offset_y_net,
+        )
+        reduction = single.draw_calls / max(1, batched.draw_calls)
+        return (
+            f"Per primitive: {single}\n"
+            f"Batched: {batched}\n"
+            f"Draw calls reduced {reduction:.0f}x"
+        )
 
     def on_zoom(self, ratio) -> None:
+        self._end_interaction()
+        # A zoom of 0 maps the whole layer to a point and cannot be saved
+        ratio = min(self.MAX_ZOOM, max(self.MIN_ZOOM, ratio))
+        alignment = self._alignment()
         if self._current_layer == Layer.BACKGROUND:
             self._ratio_image = ratio
-            self._scale_image()
             self.area.queue_draw()
         elif (
             self._current_layer == Layer.NETWORK or self._current_layer == Layer.OVERLAY
         ):
             self._ratio_network = ratio
             self.area.queue_draw()
+        self._push_alignment(alignment)
 
     def on_drawing_area_mouse_press(self, widget, event) -> None:
         (x, y) = int(event.x), int(event.y)
-        if self._current_layer == Layer.BACKGROUND and self._displayed_image:
+        if self._current_layer == Layer.BACKGROUND and self._image:
+            (w, h) = self._image.get_size(self._ratio_image)
             if (
                 x >= self._offset_x_image
-                and x <= self._displayed_image.get_width() + self._offset_x_image
+                and x <= w + self._offset_x_image
                 and y >= self._offset_y_image
-                and y <= self._displayed_image.get_height() + self._offset_y_image
+                and y <= h + self._offset_y_image
             ):
                 self._mouse_pressed_x = x
                 self._mouse_pressed_y = y
+                self._begin_interaction((Layer.BACKGROUND,))
+                self._drag_origin = (self._offset_x_image, self._offset_y_image)
         elif self._current_layer == Layer.NETWORK and self._net:
             (w, h) = self._net.get_dimensions(
                 self._ratio_network, self._offset_x_net, self._offset_y_net
@@ -231,35 +593,271 @@ class DrawingArea(Gtk.ScrolledWindow):
             ):
                 self._mouse_pressed_x = x
                 self._mouse_pressed_y = y
+                self._begin_interaction((Layer.NETWORK, Layer.OVERLAY))
+                self._drag_origin = (self._offset_x_net, self._offset_y_net)
         elif self._current_layer == Layer.OVERLAY and self._net:
-            self._net.add_overlay_element(
+            self.area.grab_focus()
+            self._mouse_pressed_x = x
+            self._mouse_pressed_y = y
+            self._drag_x = x
+            self._drag_y = y
+            if event.state & Gdk.ModifierType.SHIFT_MASK:
+                self._rubber_band = (x, y, x, y)
+                return
+            hit = self._net.hit_test(
+                x, y, self._ratio_network, self._offset_x_net, self._offset_y_net
+            )
+            if hit >= 0:
+                # Dragging a selected element moves the whole selection
+                if hit not in self._selection:
+                    damage = self._element_rects(self._selection)
+                    self._selection = np.array([hit], dtype=np.int64)
+                    self._damage(damage + self._element_rects(self._selection))
+                self._moving_selection = True
+                return
+            self._clear_selection()
+            self._mouse_pressed_x = -1
+            self._mouse_pressed_y = -1
+            element = self._net.add_overlay_element(
                 int((x - self._offset_x_net) / self._ratio_network),
                 int((y - self._offset_y_net) / self._ratio_network),
                 self._overlay_type,
             )
-            self.area.queue_draw()
+            store = self._net.elements
+            self._push(
+                insert_action(
+                    [
+                        (
+                            element,
+                            float(store.xs[element]),
+                            float(store.ys[element]),
+                            int(store.types[element]),
+                        )
+                    ]
+                )
+            )
+            self._damage(self._element_rects(np.array([element], dtype=np.int64)), True)
+
+    def on_drawing_area_mouse_move(self, widget, event) -> None:
+        if self._transformed and self._mouse_pressed_x >= 0:
+            self._drag_layer(int(event.x), int(event.y))
+            return
+        if self._rubber_band is None and not self._moving_selection:
+            return
+        damage = self._interaction_rects()
+        (self._drag_x, self._drag_y) = int(event.x), int(event.y)
+        if self._rubber_band is not None:
+            (x1, y1, _, _) = self._rubber_band
+            self._rubber_band = (x1, y1, self._drag_x, self._drag_y)
+        self._damage(damage + self._interaction_rects())
+
+    def on_drawing_area_key_press(self, widget, event) -> bool:
+        if self._current_layer != Layer.OVERLAY or not self._net:
+            return False
+        if event.keyval in (Gdk.KEY_Delete, Gdk.KEY_BackSpace):
+            if len(self._selection):
+                damage = self._element_rects(self._selection)
+                self._push(remove_action(self._net.remove_elements(self._selection)))
+                self._selection = np.empty(0, dtype=np.int64)
+                self._damage(damage, True)
+            return True
+        if event.keyval == Gdk.KEY_Escape:
+            self._clear_selection()
+            return True
+        return False
+
+    def _clear_selection(self) -> None:
+        damage = self._element_rects(self._selection) + self._interaction_rects()
+        self._selection = np.empty(0, dtype=np.int64)
+        self._rubber_band = None
+        self._moving_selection = False
+        self._damage(damage)
+
+    def _element_rects(
+        self, ids: np.ndarray, dx: float = 0.0, dy: float = 0.0
+    ) -> List[Rect]:
+        # Screen rectangles covering the given elements, shifted by dx, dy
+        if not self._net or len(ids) == 0:
+            return []
+        points = self._net.element_positions(
+            ids, self._ratio_network, self._offset_x_net + dx, self._offset_y_net + dy
+        )
+        m = self.DAMAGE_MARGIN
+        if len(points) > self.MAX_DAMAGE_RECTS:
+            (x1, y1) = points.min(axis=0).tolist()
+            (x2, y2) = points.max(axis=0).tolist()
+            return [make_rect(x1 - m, y1 - m, x2 - x1 + 2 * m, y2 - y1 + 2 * m)]
+        return [make_rect(x - m, y - m, 2 * m, 2 * m) for (x, y) in points.tolist()]
+
+    def _interaction_rects(self) -> List[Rect]:
+        # What the rubber band or the dragged selection currently covers
+        if self._rubber_band is not None:
+            (x1, y1, x2, y2) = self._rubber_band
+            return [
+                make_rect(
+                    min(x1, x2) - 1, min(y1, y2) - 1, abs(x2 - x1) + 2, abs(y2 - y1) + 2
+                )
+            ]
+        if self._moving_selection:
+            return self._element_rects(
+                self._selection,
+                self._drag_x - self._mouse_pressed_x,
+                self._drag_y - self._mouse_pressed_y,
+            )
+        return []
+
+    def _damage(self, rects: List[Rect], overlay_changed: bool = False) -> None:
+        # Repaints only the given rectangles; when the overlay itself changed
+        # they are also re-rendered into its cached surface
+        if overlay_changed and self._net:
+            net = self._net
+            key = (self._ratio_network, self._offset_x_net, self._offset_y_net)
+            for rect in rects:
+                self._layer_caches[Layer.OVERLAY].update(
+                    key, rect, lambda c: net.draw_overlay(c, *key)
+                )
+        for rect in rects:
+            self.area.queue_draw_area(*rect)
+
+    def _begin_interaction(self, layers: Tuple[Layer, ...]) -> None:
+        if self._interaction_start is None:
+            self._interaction_start = self._alignment()
+        self._transformed = layers
+        # Progressive renderings of the old view would not be shown anymore
+        for layer in layers:
+            self._layer_caches[layer].cancel()
+
+    def _end_interaction(self) -> None:
+        # Renders the layers in full quality again and records the change
+        if self._settle_source is not None:
+            GLib.source_remove(self._settle_source)
+            self._settle_source = None
+        start = self._interaction_start
+        if start is None:
+            return
+        self._interaction_start = None
+        self._transformed = ()
+        self.area.queue_draw()
+        self._push_alignment(start)
+
+    def _settle(self) -> bool:
+        self._settle_source = None
+        self._end_interaction()
+        return False
+
+    def _drag_layer(self, x: int, y: int) -> None:
+        # Motion events arrive at most once per frame and redraws are queued
+        # for the next frame, so dragging costs one blit per frame
+        offset_x = self._drag_origin[0] + x - self._mouse_pressed_x
+        offset_y = self._drag_origin[1] + y - self._mouse_pressed_y
+        if self._transformed == (Layer.BACKGROUND,):
+            (self._offset_x_image, self._offset_y_image) = (offset_x, offset_y)
+        else:
+            (self._offset_x_net, self._offset_y_net) = (offset_x, offset_y)
+        self.area.queue_draw()
+
+    def on_drawing_area_scroll(self, widget, event) -> bool:
+        # Ctrl + scroll wheel zooms the current layer around the cursor,
+        # anything else scrolls the view
+        if not event.state & Gdk.ModifierType.CONTROL_MASK:
+            return False
+        if self._mouse_pressed_x >= 0:
+            return True
+        if event.direction == Gdk.ScrollDirection.UP:
+            steps = -1.0
+        elif event.direction == Gdk.ScrollDirection.DOWN:
+            steps = 1.0
+        elif event.direction == Gdk.ScrollDirection.SMOOTH:
+            steps = event.get_scroll_deltas()[2]
+        else:
+            return False
+        factor = self.ZOOM_STEP**-steps
+        (x, y) = (event.x, event.y)
+        if self._current_layer == Layer.BACKGROUND:
+            if not self._image:
+                return True
+            ratio = min(self.MAX_ZOOM, max(self.MIN_ZOOM, self._ratio_image * factor))
+            factor = ratio / self._ratio_image
+            self._begin_interaction((Layer.BACKGROUND,))
+            self._ratio_image = ratio
+            self._offset_x_image = round(x - (x - self._offset_x_image) * factor)
+            self._offset_y_image = round(y - (y - self._offset_y_image) * factor)
+        else:
+            if not self._net:
+                return True
+            ratio = min(self.MAX_ZOOM, max(self.MIN_ZOOM, self._ratio_network * factor))
+            factor = ratio / self._ratio_network
+            self._begin_interaction((Layer.NETWORK, Layer.OVERLAY))
+            self._ratio_network = ratio
+            self._offset_x_net = round(x - (x - self._offset_x_net) * factor)
+            self._offset_y_net = round(y - (y - self._offset_y_net) * factor)
+        # Scroll events may come faster than frames, they only queue a redraw
+        if self._settle_source is not None:
+            GLib.source_remove(self._settle_source)
+        self._settle_source = GLib.timeout_add(self.SETTLE_MS, self._settle)
+        self.area.queue_draw()
+        self.emit("zoom-changed")
+        return True
 
     def on_drawing_area_mouse_release(self, widget, event) -> None:
         if self._mouse_pressed_x < 0 or self._mouse_pressed_y < 0:
             return
         (x, y) = int(event.x), int(event.y)
-        if self._current_layer == Layer.BACKGROUND and self._displayed_image:
-            self._offset_x_image += x - self._mouse_pressed_x
-            self._offset_y_image += y - self._mouse_pressed_y
-            self.area.queue_draw()
-        elif self._current_layer == Layer.NETWORK and self._net:
-            self._offset_x_net += x - self._mouse_pressed_x
-            self._offset_y_net += y - self._mouse_pressed_y
-            self.area.queue_draw()
+        if self._transformed:
+            self._drag_layer(x, y)
+            self._end_interaction()
+        elif self._current_layer == Layer.OVERLAY and self._net:
+            damage = self._interaction_rects()
+            if self._rubber_band is not None:
+                (x1, y1, _, _) = self._rubber_band
+                self._rubber_band = None
+                self._selection = self._net.find_elements(
+                    (x1, y1, x, y),
+                    self._ratio_network,
+                    self._offset_x_net,
+                    self._offset_y_net,
+                )
+                self._damage(damage + self._element_rects(self._selection))
+            elif self._moving_selection:
+                self._moving_selection = False
+                (dx, dy) = (x - self._mouse_pressed_x, y - self._mouse_pressed_y)
+                if dx or dy:
+                    damage += self._element_rects(self._selection)
+                    store = self._net.elements
+                    old_xs = store.xs[self._selection]
+                    old_ys = store.ys[self._selection]
+                    self._net.move_elements(
+                        self._selection, dx, dy, self._ratio_network
+                    )
+                    self._push(
+                        place_action(
+                            self._selection,
+                            old_xs,
+                            old_ys,
+                            store.xs[self._selection],
+                            store.ys[self._selection],
+                        )
+                    )
+                    damage += self._element_rects(self._selection)
+                    self._damage(damage, True)
         self._mouse_pressed_x = -1
         self._mouse_pressed_y = -1
 
     def on_draw(self, drawable, ctx) -> None:
+        profiler = self._profiler
+        if profiler.enabled:
+            clip = clip_rect(ctx)
+            hud = self._hud_rect()
+            # Repaints of the HUD alone would only measure themselves
+            if not contains(hud, clip):
+                profiler.begin_frame()
+
         height = 0
         width = 0
-        if self._displayed_image:
-            height = self._displayed_image.get_height() + self._offset_y_image
-            width = self._displayed_image.get_width() + self._offset_x_image
+        if self._image:
+            (w, h) = self._image.get_size(self._ratio_image)
+            height = h + self._offset_y_image
+            width = w + self._offset_x_image
         if self._net:
             (w, h) = self._net.get_dimensions(
                 self._ratio_network, self._offset_x_net, self._offset_y_net
@@ -269,16 +867,149 @@ class DrawingArea(Gtk.ScrolledWindow):
 
         drawable.set_size_request(width, height)
 
-        if self._displayed_image:
-            Gdk.cairo_set_source_pixbuf(
-                ctx, self._displayed_image, self._offset_x_image, self._offset_y_image
+        if self._image:
+            stats = profiler.begin_layer()
+            self._paint_layer(
+                ctx,
+                Layer.BACKGROUND,
+                (self._ratio_image, self._offset_x_image, self._offset_y_image),
+                make_rect(
+                    self._offset_x_image,
+                    self._offset_y_image,
+                    *self._image.get_size(self._ratio_image),
+                ),
+                lambda c: self._draw_background(c, stats),
             )
-            ctx.paint()
+            profiler.end_layer(Layer.BACKGROUND.value, stats)
 
         if self._net:
-            self._net.draw(
+            net = self._net
+            key = (self._ratio_network, self._offset_x_net, self._offset_y_net)
+            chunk = self.PROGRESSIVE_CHUNK
+            stats = profiler.begin_layer()
+            pending = self._paint_layer(
+                ctx,
+                Layer.NETWORK,
+                key,
+                self._network_bounds(),
+                lambda c: net.draw_network(c, *key, stats),
+                lambda c: net.network_steps(c, *key, chunk=chunk),
+                lambda c: net.draw_network(
+                    c, *key, stats, cell_pixels=self.PREVIEW_CELL_PIXELS
+                ),
+            )
+            profiler.end_layer(Layer.NETWORK.value, stats)
+            stats = profiler.begin_layer()
+            pending |= self._paint_layer(
                 ctx,
-                self._ratio_network,
-                self._offset_x_net,
-                self._offset_y_net,
+                Layer.OVERLAY,
+                key,
+                (0, 0, width, height),
+                lambda c: net.draw_overlay(c, *key, stats),
+                lambda c: net.overlay_steps(c, *key, chunk=chunk),
             )
+            profiler.end_layer(Layer.OVERLAY.value, stats)
+            if pending and self._progressive_source is None:
+                self._progressive_source = GLib.idle_add(self._run_progressive)
+            if self._current_layer == Layer.OVERLAY:
+                self._draw_selection(ctx)
+
+        if profiler.enabled:
+            profiler.end_frame(clip)
+            profiler.draw_hud(ctx, hud[0], hud[1])
+            if not contains(clip, hud) and self._hud_refresh is None:
+                self._hud_refresh = GLib.timeout_add(
+                    self.HUD_REFRESH_MS, self._refresh_hud
+                )
+
+    def _paint_layer(
+        self,
+        ctx,
+        layer: Layer,
+        key: Tuple[float, float, float],
+        bounds: Rect,
+        render: Callable[[cairo.Context], None],
+        steps: Optional[Callable[[cairo.Context], Iterator[None]]] = None,
+        preview: Optional[Callable[[cairo.Context], None]] = None,
+    ) -> bool:
+        # Returns True while the layer is still being rendered progressively
+        cache = self._layer_caches[layer]
+        if layer in self._transformed and cache.paint_transformed(ctx, key):
+            return False
+        if self._progressive and steps is not None:
+            return cache.paint_progressive(ctx, key, bounds, steps, preview)
+        cache.paint(ctx, key, bounds, render)
+        return False
+
+    def _run_progressive(self) -> bool:
+        # Idle callback advancing the unfinished layers for at most one frame
+        # budget. Redraws and input events have a higher priority, so a view
+        # change replaces the jobs before more time is spent on them.
+        deadline = time.perf_counter() + self.FRAME_BUDGET
+        pending = False
+        for layer in (Layer.NETWORK, Layer.OVERLAY):
+            cache = self._layer_caches[layer]
+            if not cache.pending():
+                continue
+            if time.perf_counter() >= deadline or cache.step(deadline):
+                pending = True
+            else:
+                self.area.queue_draw()
+        if not pending:
+            self._progressive_source = None
+        return pending
+
+    def _hud_rect(self) -> Rect:
+        return self._profiler.hud_rect(
+            int(self.get_hadjustment().get_value()),
+            int(self.get_vadjustment().get_value()),
+        )
+
+    def _refresh_hud(self) -> bool:
+        self._hud_refresh = None
+        self.area.queue_draw_area(*self._hud_rect())
+        return False
+
+    def _on_scrolled(self, adjustment) -> None:
+        # The HUD stays in the corner, scrolled pixels would carry it along
+        if self._profiler.enabled:
+            self.area.queue_draw()
+
+    def _draw_background(self, ctx, stats: Optional[DrawStats] = None) -> None:
+        self._image.draw(  # type: ignore
+            ctx, self._ratio_image, self._offset_x_image, self._offset_y_image, stats
+        )
+
+    def _draw_selection(self, ctx) -> None:
+        # Drawn on top of the cached layers as it changes with every mouse move
+        (dx, dy) = (0, 0)
+        if self._moving_selection:
+            dx = self._drag_x - self._mouse_pressed_x
+            dy = self._drag_y - self._mouse_pressed_y
+        self._net.draw_selection(  # type: ignore
+            ctx,
+            self._selection,
+            self._ratio_network,
+            self._offset_x_net,
+            self._offset_y_net,
+            dx,
+            dy,
+        )
+        if self._rubber_band is not None:
+            (x1, y1, x2, y2) = self._rubber_band
+            ctx.rectangle(min(x1, x2), min(y1, y2), abs(x2 - x1), abs(y2 - y1))
+            ctx.set_source_rgba(0.2, 0.4, 1.0, 0.2)
+            ctx.fill_preserve()
+            ctx.set_source_rgb(0.2, 0.4, 1.0)
+            ctx.set_line_width(1)
+            ctx.stroke()
+
+    def _network_bounds(self) -> Rect:
+        (w, h) = self._net.get_dimensions(  # type: ignore
+            self._ratio_network, self._offset_x_net, self._offset_y_net
+        )
+        # Node markers reach beyond the network extents by their radius
+        margin = 6
+        x = self._offset_x_net - margin
+        y = self._offset_y_net - margin
+        return make_rect(x, y, w + margin - x, h + margin - y)
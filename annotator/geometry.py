@@ -0,0 +1,103 @@
+from enum import IntEnum, unique
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+@unique
+class NodeKind(IntEnum):
+    JUNCTION = 0
+    RESERVOIR = 1
+    TANK = 2
+
+
+@unique
+class LinkKind(IntEnum):
+    PIPE = 0
+    PUMP = 1
+    VALVE = 2
+
+
+# Geometry of a water network stored as flat arrays: node coordinates, link
+# end points (as node indices) and the intermediate link vertices, where the
+# vertices of link i are vertex_coords[vertex_offsets[i]:vertex_offsets[i + 1]].
+class NetworkGeometry:
+    def __init__(
+        self,
+        node_names: List[str],
+        node_kinds: np.ndarray,
+        node_coords: np.ndarray,
+        link_names: List[str],
+        link_kinds: np.ndarray,
+        link_nodes: np.ndarray,
+        vertex_offsets: Optional[np.ndarray] = None,
+        vertex_coords: Optional[np.ndarray] = None,
+    ):
+        self.node_names = node_names
+        self.node_kinds = np.asarray(node_kinds, dtype=np.uint8)
+        self.node_coords = np.asarray(node_coords, dtype=np.float64).reshape(-1, 2)
+        self.link_names = link_names
+        self.link_kinds = np.asarray(link_kinds, dtype=np.uint8)
+        self.link_nodes = np.asarray(link_nodes, dtype=np.intp).reshape(-1, 2)
+        if vertex_offsets is None:
+            vertex_offsets = np.zeros(len(self.link_nodes) + 1, dtype=np.intp)
+        if vertex_coords is None:
+            vertex_coords = np.empty((0, 2), dtype=np.float64)
+        self.vertex_offsets = np.asarray(vertex_offsets, dtype=np.intp)
+        self.vertex_coords = np.asarray(vertex_coords, dtype=np.float64).reshape(-1, 2)
+        self._bounds: Optional[Tuple[float, float, float, float]] = None
+
+    @property
+    def pipe_nodes(self) -> np.ndarray:
+        return self.link_nodes[self.link_kinds == LinkKind.PIPE]
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float]:
+        # min_x, min_y, max_x, max_y over all nodes
+        if self._bounds is None:
+            if len(self.node_coords) == 0:
+                self._bounds = (0.0, 0.0, 0.0, 0.0)
+            else:
+                (min_x, min_y) = self.node_coords.min(axis=0).tolist()
+                (max_x, max_y) = self.node_coords.max(axis=0).tolist()
+                self._bounds = (min_x, min_y, max_x, max_y)
+        return self._bounds
+
+    def export(self, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> None:
+        arrays["node_names"] = _pack_names(self.node_names)
+        arrays["node_kinds"] = self.node_kinds
+        arrays["node_coords"] = self.node_coords
+        arrays["link_names"] = _pack_names(self.link_names)
+        arrays["link_kinds"] = self.link_kinds
+        arrays["link_nodes"] = self.link_nodes
+        arrays["vertex_offsets"] = self.vertex_offsets
+        arrays["vertex_coords"] = self.vertex_coords
+        meta["bounds"] = list(self.bounds)
+
+    @classmethod
+    def restore(
+        cls, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]
+    ) -> "NetworkGeometry":
+        geometry = cls(
+            _unpack_names(arrays["node_names"]),
+            arrays["node_kinds"],
+            arrays["node_coords"],
+            _unpack_names(arrays["link_names"]),
+            arrays["link_kinds"],
+            arrays["link_nodes"],
+            arrays["vertex_offsets"],
+            arrays["vertex_coords"],
+        )
+        geometry._bounds = tuple(meta["bounds"])  # type: ignore
+        return geometry
+
+
+# EPANET IDs cannot contain whitespace, so names are stored newline separated
+def _pack_names(names: List[str]) -> np.ndarray:
+    return np.frombuffer("\n".join(names).encode("utf-8"), dtype=np.uint8)
+
+
+def _unpack_names(packed: np.ndarray) -> List[str]:
+    if len(packed) == 0:
+        return []
+    return packed.tobytes().decode("utf-8").split("\n")
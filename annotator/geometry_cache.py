@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import struct
+from typing import Any, Dict, Final, Optional, Tuple
+
+import numpy as np
+
+from .atomic import write_atomic
+from .geometry import NetworkGeometry
+from .lod import LevelsOfDetail
+
+_MAGIC: Final = b"EAGEOM\0\0"
+# magic, format version, JSON header size, start of the array data
+_HEADER: Final = struct.Struct("<8sIIQ")
+_ALIGNMENT: Final = 64
+
+
+def cache_root() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "epanet-annotator")
+
+
+def default_cache_dir() -> str:
+    return os.path.join(cache_root(), "geometry")
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+# Persistent cache of the geometry and detail levels extracted from INP
+# files. Every entry is one file: a JSON header describing the arrays followed
+# by the raw, aligned array data, which is memory mapped on load. Entries are
+# keyed by the path of the INP file and validated against its size, mtime and
+# a hash of sampled content; the least recently used entries are evicted once
+# the cache grows beyond `max_bytes`.
+class GeometryCache:
+    VERSION: Final = 1
+    DEFAULT_MAX_BYTES: Final = 1 << 30
+    # The content hash covers this many evenly spaced blocks of the file
+    HASH_BLOCKS: Final = 16
+    HASH_BLOCK_SIZE: Final = 1 << 16
+
+    def __init__(
+        self, directory: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def _entry_path(self, filename: str) -> str:
+        name = hashlib.blake2b(
+            os.path.abspath(filename).encode("utf-8"), digest_size=16
+        ).hexdigest()
+        return os.path.join(self.directory, name + ".geom")
+
+    def _file_key(self, filename: str) -> Dict[str, Any]:
+        stat = os.stat(filename)
+        digest = hashlib.blake2b(digest_size=16)
+        with open(filename, "rb") as f:
+            step = max(self.HASH_BLOCK_SIZE, stat.st_size // self.HASH_BLOCKS)
+            for offset in range(0, stat.st_size, step):
+                f.seek(offset)
+                digest.update(f.read(self.HASH_BLOCK_SIZE))
+            # The tail is where appended edits end up
+            f.seek(max(0, stat.st_size - self.HASH_BLOCK_SIZE))
+            digest.update(f.read(self.HASH_BLOCK_SIZE))
+        return {
+            "path": os.path.abspath(filename),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": digest.hexdigest(),
+        }
+
+    def load(self, filename: str) -> Optional[Tuple[NetworkGeometry, LevelsOfDetail]]:
+        path = self._entry_path(filename)
+        try:
+            with open(path, "rb") as f:
+                (magic, version, header_size, start) = _HEADER.unpack(
+                    f.read(_HEADER.size)
+                )
+                if magic != _MAGIC or version != self.VERSION:
+                    return None
+                header = json.loads(f.read(header_size).decode("utf-8"))
+            if header["key"] != self._file_key(filename):
+                return None
+            data = np.memmap(path, dtype=np.uint8, mode="r")
+            arrays = {}
+            for (name, (dtype, shape, offset)) in header["arrays"].items():
+                count = int(np.prod(shape))
+                arrays[name] = np.frombuffer(
+                    data, dtype=np.dtype(dtype), count=count, offset=start + offset
+                ).reshape(shape)
+            meta = header["meta"]
+            result = (
+                NetworkGeometry.restore(arrays, meta),
+                LevelsOfDetail.restore(arrays, meta),
+            )
+            # The modification time of an entry marks its last use
+            os.utime(path)
+            return result
+        except (OSError, ValueError, KeyError, struct.error):
+            return None
+
+    def store(
+        self, filename: str, geometry: NetworkGeometry, lod: LevelsOfDetail
+    ) -> None:
+        arrays: Dict[str, np.ndarray] = {}
+        meta: Dict[str, Any] = {}
+        geometry.export(arrays, meta)
+        lod.export(arrays, meta)
+
+        layout = {}
+        offset = 0
+        for (name, array) in arrays.items():
+            layout[name] = [array.dtype.str, list(array.shape), offset]
+            offset = _align(offset + array.nbytes)
+        header = {"key": self._file_key(filename), "meta": meta, "arrays": layout}
+        encoded = json.dumps(header).encode("utf-8")
+        # Array offsets are relative to the data section following the header
+        start = _align(_HEADER.size + len(encoded))
+
+        def write(f) -> None:
+            f.write(_HEADER.pack(_MAGIC, self.VERSION, len(encoded), start))
+            f.write(encoded)
+            for (name, array) in arrays.items():
+                f.seek(start + layout[name][2])
+                f.write(np.ascontiguousarray(array).tobytes())
+            # Empty arrays at the end lie beyond the last write, the file has
+            # to cover them to be mapped
+            f.truncate(start + offset)
+
+        os.makedirs(self.directory, exist_ok=True)
+        write_atomic(self._entry_path(filename), write)
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".geom"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, name) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
@@ -0,0 +1,291 @@
+import math
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import cairo
+import numpy as np
+
+from .geometry_cache import GeometryCache
+from .inpx import Alignment, read_overlay
+from .network import Network
+from .png_writer import PngWriter
+
+if TYPE_CHECKING:
+    from .image_pyramid import SharedLevels
+
+# Rendering without any GTK widgets: the layers are drawn with the same code
+# as in the drawing area, but onto a cairo surface of the chosen format.
+
+FORMATS = (".png", ".pdf", ".svg")
+
+
+class RenderJob(NamedTuple):
+    inp: str
+    output: str
+    overlay: Optional[str] = None
+    background: Optional[str] = None
+    # Multiplies the zoom of all layers, e.g. 2 for twice the resolution
+    scale: float = 1.0
+
+    @classmethod
+    def from_dict(cls, job: Dict[str, Any]) -> "RenderJob":
+        return cls(
+            inp=job["inp"],
+            output=job["output"],
+            overlay=job.get("overlay"),
+            background=job.get("background"),
+            scale=float(job.get("scale", 1.0)),
+        )
+
+
+class RenderResult(NamedTuple):
+    job: RenderJob
+    width: int
+    height: int
+    elements: int
+    seconds: float
+
+
+class Scene:
+    def __init__(
+        self,
+        job: RenderJob,
+        cache: Optional[GeometryCache] = None,
+        background: Optional["SharedLevels"] = None,
+    ):
+        self.net = Network()
+        if not self.net.load_network(job.inp, cache=cache):
+            raise Exception(f"{job.inp}: Inappropriate size of network!")
+        alignment: Alignment = {}
+        if job.overlay:
+            (alignment, elements) = read_overlay(job.overlay)
+            if elements is not None:
+                self.net.elements = elements
+        self.image = None
+        if background is not None:
+            from .image_pyramid import SharedPyramid
+
+            self.image = SharedPyramid(background)
+        elif job.background:
+            # Only imported when needed, the image pyramid pulls in GdkPixbuf
+            from .image_pyramid import ImagePyramid
+
+            self.image = ImagePyramid.from_file(job.background)
+
+        s = job.scale
+        self.ratio_image = alignment.get("scale_img", 1.0) * s
+        self.offset_x_image = alignment.get("offset_img_x", 0.0) * s
+        self.offset_y_image = alignment.get("offset_img_y", 0.0) * s
+        self.ratio_network = alignment.get("scale_net", 1.0) * s
+        self.offset_x_net = alignment.get("offset_net_x", 0.0) * s
+        self.offset_y_net = alignment.get("offset_net_y", 0.0) * s
+
+    def size(self) -> Tuple[int, int]:
+        # Same extent as the drawing area
+        (width, height) = self.net.get_dimensions(
+            self.ratio_network, self.offset_x_net, self.offset_y_net
+        )
+        if self.image:
+            (w, h) = self.image.get_size(self.ratio_image)
+            width = max(width, int(w + self.offset_x_image))
+            height = max(height, int(h + self.offset_y_image))
+        return (width, height)
+
+    def draw(self, ctx) -> None:
+        if self.image:
+            self.image.draw(
+                ctx, self.ratio_image, self.offset_x_image, self.offset_y_image
+            )
+        self.net.draw(ctx, self.ratio_network, self.offset_x_net, self.offset_y_net)
+
+
+def _create_surface(filename: str, width: int, height: int):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".png":
+        return cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    if extension == ".pdf":
+        return cairo.PDFSurface(filename, width, height)
+    if extension == ".svg":
+        return cairo.SVGSurface(filename, width, height)
+    raise ValueError(f"Unsupported output format {extension}!")
+
+
+def _rgb_pixels(surface, width: int, height: int) -> np.ndarray:
+    # Packed RGB rows of an opaque image surface
+    surface.flush()
+    pixels = np.ndarray(
+        (height, surface.get_stride() // 4, 4),
+        dtype=np.uint8,
+        buffer=surface.get_data(),
+    )
+    # Cairo stores native endian xRGB words
+    channels = [2, 1, 0] if sys.byteorder == "little" else [1, 2, 3]
+    return pixels[:, :width, channels]
+
+
+def _write_png(surface, filename: str, dpi: Optional[float]) -> None:
+    if not dpi:
+        surface.write_to_png(filename)
+        return
+    # Cairo cannot store the resolution, the pHYs chunk needs our own writer
+    (width, height) = (surface.get_width(), surface.get_height())
+    with open(filename, "wb") as f:
+        writer = PngWriter(f, width, height, dpi)
+        writer.write_rows(_rgb_pixels(surface, width, height))
+        writer.close()
+
+
+def render(
+    job: RenderJob,
+    cache: Optional[GeometryCache] = None,
+    dpi: Optional[float] = None,
+) -> RenderResult:
+    start = time.perf_counter()
+    scene = Scene(job, cache)
+    (width, height) = scene.size()
+    surface = _create_surface(job.output, width, height)
+    ctx = cairo.Context(surface)
+    if isinstance(surface, cairo.ImageSurface):
+        # Raster exports get an opaque background like the window
+        ctx.set_source_rgb(1.0, 1.0, 1.0)
+        ctx.paint()
+    scene.draw(ctx)
+    if isinstance(surface, cairo.ImageSurface):
+        _write_png(surface, job.output, dpi)
+    surface.finish()
+    return RenderResult(
+        job, width, height, len(scene.net.elements), time.perf_counter() - start
+    )
+
+
+def _render_worker(job: RenderJob, dpi: Optional[float] = None) -> RenderResult:
+    # Every worker process shares the on-disk geometry cache
+    return render(job, GeometryCache(), dpi)
+
+
+def render_batch(
+    jobs: List[RenderJob],
+    workers: Optional[int] = None,
+    dpi: Optional[float] = None,
+) -> Iterator[Tuple[RenderJob, Optional[RenderResult], Optional[Exception]]]:
+    # Yields every job as it finishes, with either its result or its error
+    if workers == 1:
+        for job in jobs:
+            try:
+                yield (job, _render_worker(job, dpi), None)
+            except Exception as e:
+                yield (job, None, e)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_render_worker, job, dpi): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                yield (futures[future], future.result(), None)
+            except Exception as e:
+                yield (futures[future], None, e)
+
+
+# Scene of the tiled export loaded once in every worker process
+_worker_scene: Optional[Scene] = None
+
+
+def _init_tile_worker(job: RenderJob, background: Optional["SharedLevels"]) -> None:
+    global _worker_scene
+    _worker_scene = Scene(job, GeometryCache(), background)
+
+
+def _render_tile(x: int, y: int, width: int, height: int) -> bytes:
+    # Returns the tile as packed RGB rows. The clip limits drawing to the
+    # primitives, overlay elements and background tiles touching the tile.
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+    ctx = cairo.Context(surface)
+    ctx.translate(-x, -y)
+    ctx.rectangle(x, y, width, height)
+    ctx.clip()
+    ctx.set_source_rgb(1.0, 1.0, 1.0)
+    ctx.paint()
+    _worker_scene.draw(ctx)  # type: ignore
+    return _rgb_pixels(surface, width, height).tobytes()
+
+
+def render_tiled(
+    job: RenderJob,
+    tile_size: int = 1024,
+    workers: Optional[int] = None,
+    dpi: Optional[float] = None,
+) -> RenderResult:
+    # Renders a PNG of any size: tiles are drawn in parallel by a pool of
+    # processes and written out one strip of tiles at a time, so memory use
+    # only depends on the width of the image, not on its height.
+    if os.path.splitext(job.output)[1].lower() != ".png":
+        raise ValueError("Tiled rendering only supports PNG output!")
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory:
+        scene = Scene(job, GeometryCache())
+        (width, height) = scene.size()
+        elements = len(scene.net.elements)
+        background = None
+        if scene.image:
+            # Decoded once here, the workers map the pixels read-only
+            background = scene.image.share(os.path.join(directory, "background"))
+        del scene
+        _render_tiles(job, width, height, background, tile_size, workers, dpi)
+    return RenderResult(job, width, height, elements, time.perf_counter() - start)
+
+
+def _render_tiles(
+    job: RenderJob,
+    width: int,
+    height: int,
+    background: Optional["SharedLevels"],
+    tile_size: int,
+    workers: Optional[int],
+    dpi: Optional[float],
+) -> None:
+    workers = workers or os.cpu_count() or 1
+    columns = [(x, min(tile_size, width - x)) for x in range(0, width, tile_size)]
+    rows = [(y, min(tile_size, height - y)) for y in range(0, height, tile_size)]
+    # Enough strips in flight to keep every worker busy
+    ahead = math.ceil(workers / max(1, len(columns))) + 1
+
+    with open(job.output, "wb") as f, ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_tile_worker,
+        initargs=(job, background),
+    ) as executor:
+        writer = PngWriter(f, width, height, dpi)
+        strips: Deque[List[Future]] = deque()
+        submitted = 0
+        for (_, strip_height) in rows:
+            while submitted < len(rows) and len(strips) < ahead:
+                y = rows[submitted][0]
+                strips.append(
+                    [
+                        executor.submit(_render_tile, x, y, w, rows[submitted][1])
+                        for (x, w) in columns
+                    ]
+                )
+                submitted += 1
+            tiles = [
+                np.frombuffer(future.result(), dtype=np.uint8).reshape(
+                    strip_height, w, 3
+                )
+                for (future, (_, w)) in zip(strips.popleft(), columns)
+            ]
+            writer.write_rows(np.concatenate(tiles, axis=1))
+        writer.close()
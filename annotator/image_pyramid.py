@@ -0,0 +1,236 @@
+import math
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from typing import IO, Final, List, NamedTuple, Optional, Tuple, Union
+
+import cairo
+import gi  # type: ignore
+import numpy as np
+
+gi.require_version("Gdk", "3.0")
+from gi.repository import Gdk, GdkPixbuf, GLib  # type: ignore
+
+from .draw_stats import DrawStats
+from .geometry_cache import cache_root
+from .tasks import BackgroundTask
+
+
+class SharedLevels(NamedTuple):
+    # Levels of a pyramid written to `filename` as cairo ARGB32 pixels, one
+    # row after the other, level after level
+    filename: str
+    sizes: List[Tuple[int, int]]
+    offsets: List[int]
+
+
+# Mipmap pyramid of a background image. Every level halves the resolution of
+# the previous one and is drawn through fixed-size tiles, so painting at any
+# zoom only scales the tiles intersecting the clip region. The levels are
+# converted to cairo pixels once and kept in an unlinked file mapped into
+# memory: decoding still needs the whole image once, but afterwards only the
+# pages of the tiles drawn and the cached tiles take up memory.
+class ImagePyramid:
+    TILE_SIZE: Final = 512
+    MIN_LEVEL_SIZE: Final = 256
+    # Upper bound of tiles kept as cairo surfaces (4 bytes per pixel each)
+    MAX_CACHED_TILES: Final = 96
+
+    # Share of the loading progress spent on decoding the file
+    DECODE_PROGRESS: Final = 0.8
+    READ_CHUNK: Final = 1 << 20
+
+    def __init__(self, pixbuf: GdkPixbuf.Pixbuf, task: Optional[BackgroundTask] = None):
+        (w, h) = (pixbuf.get_width(), pixbuf.get_height())
+        sizes = [(w, h)]
+        while max(w, h) > self.MIN_LEVEL_SIZE:
+            (w, h) = (max(1, w // 2), max(1, h // 2))
+            sizes.append((w, h))
+        offsets = [0]
+        for (w, h) in sizes:
+            offsets.append(offsets[-1] + w * h * 4)
+
+        os.makedirs(cache_root(), exist_ok=True)
+        self._file = tempfile.TemporaryFile(dir=cache_root(), suffix=".pyramid")
+        self._file.truncate(offsets.pop())
+        for (level, (w, h)) in enumerate(sizes):
+            if task:
+                task.check_cancelled()
+                done = 1.0 - w * h / (sizes[0][0] * sizes[0][1])
+                task.report_progress(
+                    self.DECODE_PROGRESS + (1.0 - self.DECODE_PROGRESS) * done,
+                    "Building image pyramid",
+                )
+            if level:
+                pixbuf = pixbuf.scale_simple(w, h, GdkPixbuf.InterpType.BILINEAR)
+            self._write_level(pixbuf, offsets[level])
+        self._map(self._file, sizes, offsets)
+
+    def _write_level(self, pixbuf: GdkPixbuf.Pixbuf, offset: int) -> None:
+        # Converted tile by tile, so no second copy of the whole level is made
+        (w, h) = (pixbuf.get_width(), pixbuf.get_height())
+        rows = np.memmap(
+            self._file, dtype=np.uint32, mode="r+", offset=offset, shape=(h, w)
+        )
+        tile = self.TILE_SIZE
+        for y in range(0, h, tile):
+            for x in range(0, w, tile):
+                sub = pixbuf.new_subpixbuf(x, y, min(tile, w - x), min(tile, h - y))
+                surface = Gdk.cairo_surface_create_from_pixbuf(sub, 1, None)
+                (sw, sh) = (surface.get_width(), surface.get_height())
+                target = rows[y : y + sh, x : x + sw]
+                target[:] = np.ndarray(
+                    (sh, surface.get_stride() // 4),
+                    dtype=np.uint32,
+                    buffer=surface.get_data(),
+                )[:, :sw]
+                if surface.get_format() == cairo.FORMAT_RGB24:
+                    # The unused byte of opaque pixels becomes their alpha
+                    target |= 0xFF000000
+        rows.flush()
+
+    def _map(
+        self,
+        source: Union[str, IO[bytes]],
+        sizes: List[Tuple[int, int]],
+        offsets: List[int],
+    ) -> None:
+        # A fresh read-only mapping: pages written while building are not
+        # counted against the process until their tiles are drawn again
+        (self.width, self.height) = sizes[0]
+        self._sizes = sizes
+        self._offsets = offsets
+        pixels = np.memmap(source, dtype=np.uint32, mode="r")
+        self._pixels: List[np.ndarray] = [
+            pixels[offset // 4 : offset // 4 + w * h].reshape(h, w)
+            for ((w, h), offset) in zip(sizes, offsets)
+        ]
+        self._tiles: "OrderedDict[Tuple[int, int, int], cairo.ImageSurface]" = (
+            OrderedDict()
+        )
+
+    @classmethod
+    def from_file(
+        cls, filename: str, task: Optional[BackgroundTask] = None
+    ) -> "ImagePyramid":
+        # The file is fed to the decoder in chunks so loading can report its
+        # progress and be abandoned when run as a background task
+        size = max(1, os.path.getsize(filename))
+        loader = GdkPixbuf.PixbufLoader()
+        try:
+            with open(filename, "rb") as f:
+                read = 0
+                while True:
+                    chunk = f.read(cls.READ_CHUNK)
+                    if not chunk:
+                        break
+                    if task:
+                        task.check_cancelled()
+                    loader.write(chunk)
+                    read += len(chunk)
+                    if task:
+                        task.report_progress(
+                            cls.DECODE_PROGRESS * read / size, "Decoding image"
+                        )
+        except BaseException:
+            try:
+                loader.close()
+            except GLib.Error:
+                pass
+            raise
+        loader.close()
+        return cls(loader.get_pixbuf(), task)
+
+    def get_size(self, scale: float) -> Tuple[int, int]:
+        return (int(self.width * scale), int(self.height * scale))
+
+    def _select_level(self, scale: float) -> int:
+        # Use the smallest level that still has at least the requested
+        # resolution, so tiles are only ever scaled down
+        if scale >= 1.0:
+            return 0
+        return min(len(self._sizes) - 1, int(math.floor(-math.log2(scale))))
+
+    def share(self, filename: str) -> SharedLevels:
+        # Copies the mapped levels to `filename` for SharedPyramid
+        self._file.seek(0)
+        with open(filename, "wb") as f:
+            shutil.copyfileobj(self._file, f, self.READ_CHUNK)
+        return SharedLevels(filename, list(self._sizes), list(self._offsets))
+
+    def _tile(self, level: int, tx: int, ty: int) -> cairo.ImageSurface:
+        key = (level, tx, ty)
+        surface = self._tiles.get(key)
+        if surface is not None:
+            self._tiles.move_to_end(key)
+            return surface
+        surface = self._create_tile(level, tx * self.TILE_SIZE, ty * self.TILE_SIZE)
+        self._tiles[key] = surface
+        if len(self._tiles) > self.MAX_CACHED_TILES:
+            self._tiles.popitem(last=False)
+        return surface
+
+    def _create_tile(self, level: int, x: int, y: int) -> cairo.ImageSurface:
+        # Copied out of the mapping, cairo may write to the surface
+        data = np.ascontiguousarray(
+            self._pixels[level][y : y + self.TILE_SIZE, x : x + self.TILE_SIZE]
+        )
+        (h, w) = data.shape
+        return cairo.ImageSurface.create_for_data(
+            memoryview(data), cairo.FORMAT_ARGB32, w, h, w * 4
+        )
+
+    def draw(
+        self,
+        ctx,
+        scale: float,
+        offset_x: float,
+        offset_y: float,
+        stats: Optional[DrawStats] = None,
+    ) -> None:
+        (width, height) = self.get_size(scale)
+        if width <= 0 or height <= 0:
+            return
+        level = self._select_level(scale)
+        (level_width, level_height) = self._sizes[level]
+        # Factor from level pixels to drawing area pixels
+        factor_x = width / level_width
+        factor_y = height / level_height
+
+        (x1, y1, x2, y2) = ctx.clip_extents()
+        tile = self.TILE_SIZE
+        cols = math.ceil(level_width / tile)
+        rows = math.ceil(level_height / tile)
+        tx0 = max(0, int((x1 - offset_x) / factor_x) // tile)
+        ty0 = max(0, int((y1 - offset_y) / factor_y) // tile)
+        tx1 = min(cols - 1, int((x2 - offset_x) / factor_x) // tile)
+        ty1 = min(rows - 1, int((y2 - offset_y) / factor_y) // tile)
+
+        ctx.save()
+        ctx.translate(offset_x, offset_y)
+        ctx.scale(factor_x, factor_y)
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                surface = self._tile(level, tx, ty)
+                ctx.set_source_surface(surface, tx * tile, ty * tile)
+                # Padding avoids visible seams where scaled tiles meet
+                ctx.get_source().set_extend(cairo.EXTEND_PAD)
+                ctx.rectangle(
+                    tx * tile, ty * tile, surface.get_width(), surface.get_height()
+                )
+                ctx.fill()
+        ctx.restore()
+        if stats is not None:
+            tiles = max(0, tx1 - tx0 + 1) * max(0, ty1 - ty0 + 1)
+            stats.primitives += tiles
+            stats.fills += tiles
+            stats.source_changes += tiles
+
+
+# Pyramid mapped read-only from the file written by ImagePyramid.share(). The
+# processes of a tiled export share its pages instead of each decoding the
+# whole image, and only the parts around their tiles are ever read.
+class SharedPyramid(ImagePyramid):
+    def __init__(self, levels: SharedLevels):
+        self._map(levels.filename, levels.sizes, levels.offsets)
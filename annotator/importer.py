@@ -0,0 +1,445 @@
+import argparse
+import csv
+import json
+import os
+import re
+import time
+from array import array
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Final,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+
+from .inpx import DEFAULT_ALIGNMENT, is_binary, read_overlay, write_overlay
+from .overlay import TYPE_CODES, OverlayStore, OverlayType
+
+if TYPE_CHECKING:
+    from .tasks import BackgroundTask
+
+# Bulk import of building points from CSV and GeoJSON files. Records are read
+# in chunks into flat arrays which are appended to an OverlayStore, so memory
+# only grows with the number of elements, never with the size of the file.
+
+# Records per chunk appended to the store and between progress reports
+CHUNK_SIZE: Final = 65536
+
+# Attribute values of common building inventories (e.g. the OpenStreetMap
+# building tag). The names of the overlay types themselves always match.
+DEFAULT_MAPPING: Final[Dict[str, OverlayType]] = {
+    "house": OverlayType.HOUSE,
+    "detached": OverlayType.HOUSE,
+    "semidetached_house": OverlayType.HOUSE,
+    "terrace": OverlayType.HOUSE,
+    "bungalow": OverlayType.HOUSE,
+    "residential": OverlayType.HOUSE,
+    "apartments": OverlayType.APARTMENTS,
+    "dormitory": OverlayType.APARTMENTS,
+    "wholesale": OverlayType.WHOLESALE,
+    "commercial": OverlayType.COMMERCIAL,
+    "retail": OverlayType.COMMERCIAL,
+    "office": OverlayType.COMMERCIAL,
+    "supermarket": OverlayType.COMMERCIAL,
+    "hotel": OverlayType.COMMERCIAL,
+    "institutional": OverlayType.INSTITUTIONAL,
+    "school": OverlayType.INSTITUTIONAL,
+    "university": OverlayType.INSTITUTIONAL,
+    "kindergarten": OverlayType.INSTITUTIONAL,
+    "hospital": OverlayType.INSTITUTIONAL,
+    "public": OverlayType.INSTITUTIONAL,
+    "civic": OverlayType.INSTITUTIONAL,
+    "government": OverlayType.INSTITUTIONAL,
+    "church": OverlayType.INSTITUTIONAL,
+    "industrial": OverlayType.INDUSTRIAL,
+    "warehouse": OverlayType.INDUSTRIAL,
+    "manufacture": OverlayType.INDUSTRIAL,
+    "factory": OverlayType.INDUSTRIAL,
+}
+# Attributes holding the type when none is given, in order of preference
+TYPE_FIELDS: Final = ("type", "overlay_type", "building", "category")
+
+_WHITESPACE: Final = re.compile(r"[\s,]*")
+# Characters a JSON number may continue with
+_NUMBER_TAIL: Final = re.compile(r"[0-9.eE+-]*")
+
+
+class ImportOptions(NamedTuple):
+    # Columns of the coordinates in CSV files
+    x_field: str = "x"
+    y_field: str = "y"
+    # Attribute holding the type, None to use the first of TYPE_FIELDS found
+    type_field: Optional[str] = None
+    # Lower case attribute values to overlay types, DEFAULT_MAPPING if None
+    mapping: Optional[Dict[str, OverlayType]] = None
+    # Type of records whose value is not mapped, None to skip them
+    default: Optional[OverlayType] = OverlayType.OTHER
+
+
+class ImportResult(NamedTuple):
+    store: OverlayStore
+    skipped: int
+
+
+class _Chunks:
+    # Collects records and hands them on as arrays every CHUNK_SIZE records
+    def __init__(
+        self,
+        options: ImportOptions,
+        store: OverlayStore,
+        transform: Optional[Callable[[np.ndarray], np.ndarray]],
+    ):
+        mapping = options.mapping if options.mapping is not None else DEFAULT_MAPPING
+        self._codes: Dict[str, int] = {
+            t.value.lower(): TYPE_CODES[t] for t in OverlayType
+        }
+        self._codes.update({k.lower(): TYPE_CODES[t] for (k, t) in mapping.items()})
+        self._default = TYPE_CODES[options.default] if options.default else -1
+        self._store = store
+        self._transform = transform
+        self._xs = array("d")
+        self._ys = array("d")
+        self._types = array("B")
+        self.skipped = 0
+
+    def add(self, x: float, y: float, value: Any) -> None:
+        code = self._codes.get(str(value).strip().lower(), self._default)
+        if code < 0 or not (np.isfinite(x) and np.isfinite(y)):
+            self.skipped += 1
+            return
+        self._xs.append(x)
+        self._ys.append(y)
+        self._types.append(code)
+        if len(self._xs) >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._xs:
+            return
+        xs = np.frombuffer(self._xs, dtype=np.float64)
+        ys = np.frombuffer(self._ys, dtype=np.float64)
+        if self._transform:
+            points = self._transform(np.stack((xs, ys), axis=1))
+            (xs, ys) = (points[:, 0], points[:, 1])
+        self._store.extend(xs, ys, np.frombuffer(self._types, dtype=np.uint8))
+        self._xs = array("d")
+        self._ys = array("d")
+        self._types = array("B")
+
+
+def _progress(task: Optional["BackgroundTask"], done: int, size: int) -> None:
+    if task:
+        task.check_cancelled()
+        task.report_progress(done / size, "Importing buildings")
+
+
+def _read_csv(
+    filename: str,
+    options: ImportOptions,
+    chunks: _Chunks,
+    task: Optional["BackgroundTask"],
+) -> None:
+    size = max(1, os.path.getsize(filename))
+    read = 0
+
+    def lines(f) -> Iterator[str]:
+        nonlocal read
+        for line in f:
+            read += len(line)
+            yield line.decode("utf-8-sig" if read == len(line) else "utf-8")
+
+    with open(filename, "rb") as f:
+        reader = csv.reader(lines(f))
+        header = [name.strip() for name in next(reader, [])]
+        try:
+            x = header.index(options.x_field)
+            y = header.index(options.y_field)
+        except ValueError:
+            raise ValueError(
+                f"{filename} has no columns {options.x_field} and {options.y_field}!"
+            )
+        type_field = options.type_field or next(
+            (name for name in TYPE_FIELDS if name in header), None
+        )
+        kind = header.index(type_field) if type_field in header else -1
+        for (count, row) in enumerate(reader):
+            if count % CHUNK_SIZE == 0:
+                _progress(task, read, size)
+            try:
+                chunks.add(float(row[x]), float(row[y]), row[kind] if kind >= 0 else "")
+            except (ValueError, IndexError):
+                chunks.skipped += 1
+
+
+class _JsonStream:
+    # Decodes one JSON value after another from a file read in blocks, used
+    # to walk through the features of a GeoJSON file without loading it
+    BLOCK_SIZE: Final = 1 << 20
+
+    def __init__(self, f):
+        self._f = f
+        self._buffer = ""
+        self._pos = 0
+        self._decoder = json.JSONDecoder()
+        self.read = 0
+
+    def _fill(self) -> bool:
+        block = self._f.read(self.BLOCK_SIZE)
+        if not block:
+            return False
+        self.read += len(block)
+        self._buffer = self._buffer[self._pos :] + block
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        # Next character that is not whitespace or a separating comma, empty
+        # at the end of the file
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()  # type: ignore
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Invalid GeoJSON, expected {char}!")
+        self._pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                (value, end) = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next block,
+            # also after a prefix that already decodes, like 1e of 1e5
+            if (
+                isinstance(value, (int, float))
+                and _NUMBER_TAIL.match(self._buffer, end).end()  # type: ignore
+                == len(self._buffer)
+                and self._fill()
+            ):
+                continue
+            self._pos = end
+            return value
+
+
+def _centroid(geometry: Any) -> Optional[Tuple[float, float]]:
+    # Representative point of a GeoJSON geometry: the point itself, the mean
+    # of multiple points or the area centroid of the outer polygon rings
+    if not isinstance(geometry, dict):
+        return None
+    kind = geometry.get("type")
+    coordinates = geometry.get("coordinates")
+    if kind == "Point":
+        return (float(coordinates[0]), float(coordinates[1]))
+    if kind == "MultiPoint" and coordinates:
+        (x, y) = np.asarray(coordinates, dtype=np.float64)[:, :2].mean(axis=0)
+        return (float(x), float(y))
+    if kind == "Polygon" and coordinates:
+        rings = [coordinates[0]]
+    elif kind == "MultiPolygon" and coordinates:
+        rings = [polygon[0] for polygon in coordinates if polygon]
+    else:
+        return None
+    (area, cx, cy) = (0.0, 0.0, 0.0)
+    for ring in rings:
+        points = np.asarray(ring, dtype=np.float64)[:, :2]
+        (x1, y1) = points.T
+        (x2, y2) = np.roll(points, -1, axis=0).T
+        cross = x1 * y2 - x2 * y1
+        if cross.sum() < 0:
+            # Parts may wind either way, all count as positive area
+            cross = -cross
+        area += cross.sum()
+        cx += ((x1 + x2) * cross).sum()
+        cy += ((y1 + y2) * cross).sum()
+    if area == 0.0:
+        # Degenerate rings fall back to the mean of their points
+        (x, y) = np.concatenate([np.asarray(r)[:, :2] for r in rings]).mean(axis=0)
+        return (float(x), float(y))
+    return (cx / (3 * area), cy / (3 * area))
+
+
+def _features(stream: _JsonStream) -> Iterator[Any]:
+    # A FeatureCollection streams its "features" array, other members are
+    # decoded and skipped. A plain array of features is accepted as well.
+    char = stream.peek()
+    if char == "[":
+        stream.expect("[")
+    elif char == "{":
+        stream.expect("{")
+        while stream.peek() not in ("}", ""):
+            key = stream.value()
+            stream.expect(":")
+            if key == "features":
+                stream.expect("[")
+                break
+            stream.value()
+        else:
+            return
+    else:
+        raise ValueError("Invalid GeoJSON, expected a FeatureCollection!")
+    while stream.peek() not in ("]", ""):
+        yield stream.value()
+
+
+def _read_geojson(
+    filename: str,
+    options: ImportOptions,
+    chunks: _Chunks,
+    task: Optional["BackgroundTask"],
+) -> None:
+    size = max(1, os.path.getsize(filename))
+    with open(filename, "r", encoding="utf-8-sig") as f:
+        stream = _JsonStream(f)
+        for (count, feature) in enumerate(_features(stream)):
+            if count % CHUNK_SIZE == 0:
+                _progress(task, stream.read, size)
+            if not isinstance(feature, dict):
+                chunks.skipped += 1
+                continue
+            properties = feature.get("properties") or {}
+            if not isinstance(properties, dict):
+                chunks.skipped += 1
+                continue
+            type_field = options.type_field or next(
+                (name for name in TYPE_FIELDS if name in properties), None
+            )
+            try:
+                point = _centroid(feature.get("geometry"))
+            except (TypeError, ValueError, IndexError):
+                point = None
+            if point is None:
+                chunks.skipped += 1
+                continue
+            chunks.add(point[0], point[1], properties.get(type_field, ""))
+
+
+def read_points(
+    filename: str,
+    options: ImportOptions = ImportOptions(),
+    transform: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+    task: Optional["BackgroundTask"] = None,
+) -> ImportResult:
+    # `transform` maps chunks of (n, 2) input points to network coordinates,
+    # None if the file already is in network coordinates
+    store = OverlayStore()
+    chunks = _Chunks(options, store, transform)
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in (".geojson", ".json"):
+        _read_geojson(filename, options, chunks, task)
+    else:
+        _read_csv(filename, options, chunks, task)
+    chunks.flush()
+    return ImportResult(store, chunks.skipped)
+
+
+def _mapping(value: str) -> Tuple[str, OverlayType]:
+    (name, _, overlay_type) = value.partition("=")
+    try:
+        return (name.lower(), OverlayType(overlay_type))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"expected VALUE=TYPE with TYPE one of "
+            f"{', '.join(t.value for t in OverlayType)}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m annotator.importer",
+        description="Import building points from a CSV or GeoJSON file into an "
+        "INPX overlay.",
+    )
+    parser.add_argument("source", help="CSV, GeoJSON or JSON file")
+    parser.add_argument("overlay", help="INPX file, extended if it exists")
+    parser.add_argument("--x-field", default="x", help="CSV column of x")
+    parser.add_argument("--y-field", default="y", help="CSV column of y")
+    parser.add_argument(
+        "--type-field",
+        help=f"attribute holding the type (default: first of {', '.join(TYPE_FIELDS)})",
+    )
+    parser.add_argument(
+        "--map",
+        type=_mapping,
+        action="append",
+        default=[],
+        metavar="VALUE=TYPE",
+        help="map an attribute value to an overlay type, e.g. detached=House",
+    )
+    parser.add_argument(
+        "--default",
+        type=OverlayType,
+        default=OverlayType.OTHER,
+        help="type of unmapped values",
+    )
+    parser.add_argument(
+        "--skip-unmapped", action="store_true", help="skip unmapped values instead"
+    )
+    parser.add_argument(
+        "--inp",
+        help="network of the overlay, the points are then read as screen "
+        "coordinates at zoom 1 and converted to network coordinates",
+    )
+    args = parser.parse_args()
+
+    transform = None
+    if args.inp:
+        from .network import Network
+
+        net = Network()
+        if not net.load_network(args.inp):
+            parser.error(f"{args.inp}: Inappropriate size of network!")
+        transform = net.screen_to_net
+
+    options = ImportOptions(
+        args.x_field,
+        args.y_field,
+        args.type_field,
+        {**DEFAULT_MAPPING, **dict(args.map)},
+        None if args.skip_unmapped else args.default,
+    )
+    start = time.perf_counter()
+    (imported, skipped) = read_points(args.source, options, transform)
+    elapsed = time.perf_counter() - start
+
+    alignment = dict(DEFAULT_ALIGNMENT)
+    store = OverlayStore()
+    binary = False
+    if os.path.exists(args.overlay):
+        # An existing overlay keeps its format
+        binary = is_binary(args.overlay)
+        (alignment, existing) = read_overlay(args.overlay)
+        store = existing or store
+    store.extend(imported.xs, imported.ys, imported.types)
+    write_overlay(args.overlay, alignment, store, binary)
+    # The saved overlay has to load in the editor
+    (_, saved) = read_overlay(args.overlay)
+    if saved is None or len(saved) != len(store):
+        raise Exception(f"{args.overlay} could not be read back after the import!")
+    counts: List[str] = [
+        f"{count} {t.value}" for (t, count) in imported.count_by_type().items() if count
+    ]
+    print(
+        f"{len(imported)} elements imported in {elapsed:.2f} s "
+        f"({', '.join(counts) or 'none'}), {skipped} records skipped, "
+        f"{len(store)} elements in {args.overlay}"
+    )
+
+
+if __name__ == "__main__":
+    main()
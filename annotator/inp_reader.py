@@ -0,0 +1,143 @@
+import os
+from array import array
+from typing import TYPE_CHECKING, Dict, Final, List, Optional
+
+import numpy as np
+
+from .geometry import LinkKind, NetworkGeometry, NodeKind
+
+if TYPE_CHECKING:
+    from .tasks import BackgroundTask
+
+_NODE_SECTIONS: Final = {
+    b"[JUNCTIONS]": NodeKind.JUNCTION,
+    b"[RESERVOIRS]": NodeKind.RESERVOIR,
+    b"[TANKS]": NodeKind.TANK,
+}
+_LINK_SECTIONS: Final = {
+    b"[PIPES]": LinkKind.PIPE,
+    b"[PUMPS]": LinkKind.PUMP,
+    b"[VALVES]": LinkKind.VALVE,
+}
+# Lines read between two progress reports / cancellation checks
+_PROGRESS_LINES: Final = 65536
+
+
+def _name(token: bytes) -> str:
+    return token.decode("utf-8", "replace")
+
+
+def _resolve(node_index: Dict[str, int], name: str, link: str) -> int:
+    index = node_index.get(name)
+    if index is None:
+        raise ValueError(f"Link {link} refers to unknown node {name}!")
+    return index
+
+
+# Streaming reader for the parts of an EPANET INP file needed to display a
+# network: nodes, links, coordinates and vertices. Every other section is
+# skipped without being parsed.
+def read_geometry(
+    filename: str, task: Optional["BackgroundTask"] = None
+) -> NetworkGeometry:
+    size = max(1, os.path.getsize(filename))
+    node_index: Dict[str, int] = {}
+    node_names: List[str] = []
+    node_kinds = array("B")
+    link_names: List[str] = []
+    link_kinds = array("B")
+    link_ends: List[str] = []
+    coord_names: List[str] = []
+    coords = array("d")
+    vertex_names: List[str] = []
+    vertices = array("d")
+
+    section = b""
+    read = 0
+    with open(filename, "rb") as f:
+        for (count, line) in enumerate(f):
+            read += len(line)
+            if task and count % _PROGRESS_LINES == 0:
+                task.check_cancelled()
+                task.report_progress(0.9 * read / size, "Reading INP file")
+            comment = line.find(b";")
+            if comment >= 0:
+                line = line[:comment]
+            tokens = line.split()
+            if not tokens:
+                continue
+            if tokens[0].startswith(b"["):
+                section = tokens[0].upper()
+                continue
+
+            if section in _NODE_SECTIONS:
+                name = _name(tokens[0])
+                node_index[name] = len(node_names)
+                node_names.append(name)
+                node_kinds.append(_NODE_SECTIONS[section])
+            elif section in _LINK_SECTIONS and len(tokens) >= 3:
+                link_names.append(_name(tokens[0]))
+                link_kinds.append(_LINK_SECTIONS[section])
+                link_ends.append(_name(tokens[1]))
+                link_ends.append(_name(tokens[2]))
+            elif section == b"[COORDINATES]" and len(tokens) >= 3:
+                coord_names.append(_name(tokens[0]))
+                coords.append(float(tokens[1]))
+                coords.append(float(tokens[2]))
+            elif section == b"[VERTICES]" and len(tokens) >= 3:
+                vertex_names.append(_name(tokens[0]))
+                vertices.append(float(tokens[1]))
+                vertices.append(float(tokens[2]))
+
+    if task:
+        task.check_cancelled()
+        task.report_progress(0.9, "Resolving network topology")
+
+    # Sections may come in any order, so names are only resolved once the
+    # whole file has been read. Nodes without coordinates end up at (0, 0).
+    node_coords = np.zeros((len(node_names), 2), dtype=np.float64)
+    coord_xy = np.frombuffer(coords, dtype=np.float64).reshape(-1, 2)
+    coord_nodes = np.fromiter(
+        (node_index.get(name, -1) for name in coord_names),
+        dtype=np.intp,
+        count=len(coord_names),
+    )
+    known = coord_nodes >= 0
+    node_coords[coord_nodes[known]] = coord_xy[known]
+
+    link_nodes = np.fromiter(
+        (
+            _resolve(node_index, name, link_names[i // 2])
+            for (i, name) in enumerate(link_ends)
+        ),
+        dtype=np.intp,
+        count=len(link_ends),
+    ).reshape(-1, 2)
+
+    link_index = {name: i for (i, name) in enumerate(link_names)}
+    vertex_links = np.fromiter(
+        (link_index.get(name, -1) for name in vertex_names),
+        dtype=np.intp,
+        count=len(vertex_names),
+    )
+    vertex_xy = np.frombuffer(vertices, dtype=np.float64).reshape(-1, 2)
+    known = vertex_links >= 0
+    vertex_links = vertex_links[known]
+    # A stable sort keeps the vertices of every link in file order
+    order = np.argsort(vertex_links, kind="stable")
+    vertex_offsets = np.zeros(len(link_names) + 1, dtype=np.intp)
+    np.cumsum(
+        np.bincount(vertex_links, minlength=len(link_names)),
+        out=vertex_offsets[1:],
+    )
+
+    return NetworkGeometry(
+        node_names,
+        np.frombuffer(node_kinds, dtype=np.uint8),
+        node_coords,
+        link_names,
+        np.frombuffer(link_kinds, dtype=np.uint8),
+        link_nodes,
+        vertex_offsets,
+        vertex_xy[known][order],
+    )
@@ -0,0 +1,167 @@
+import argparse
+import json
+import struct
+from typing import Dict, Final, Optional, Tuple
+
+import numpy as np
+
+from .atomic import write_atomic
+from .overlay import OverlayStore
+
+# Placement of the background image and the network relative to each other,
+# stored with every overlay
+ALIGNMENT_KEYS: Final = (
+    "offset_img_x",
+    "offset_img_y",
+    "scale_img",
+    "offset_net_x",
+    "offset_net_y",
+    "scale_net",
+)
+Alignment = Dict[str, float]
+# Values of keys missing from an overlay
+DEFAULT_ALIGNMENT: Final[Alignment] = {
+    "offset_img_x": 0.0,
+    "offset_img_y": 0.0,
+    "scale_img": 1.0,
+    "offset_net_x": 0.0,
+    "offset_net_y": 0.0,
+    "scale_net": 1.0,
+}
+
+_MAGIC: Final = b"INPX"
+VERSION: Final = 1
+# magic, format version, element count, alignment values
+_HEADER: Final = struct.Struct("<4sIQ6d")
+_ALIGNMENT: Final = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _layout(count: int) -> Tuple[int, int, int, int]:
+    # Offsets of the x, y and type arrays and the total file size
+    xs = _align(_HEADER.size)
+    ys = _align(xs + 8 * count)
+    types = _align(ys + 8 * count)
+    return (xs, ys, types, types + count)
+
+
+def complete_alignment(alignment: Alignment) -> Alignment:
+    # All keys, with defaults for the missing ones. Scales of zero or below
+    # cannot be drawn and are rejected.
+    complete = {**DEFAULT_ALIGNMENT, **alignment}
+    for key in ("scale_img", "scale_net"):
+        if not complete[key] > 0.0:
+            raise Exception(f"Invalid {key} {complete[key]}!")
+    return complete
+
+
+def is_binary(filename: str) -> bool:
+    with open(filename, "rb") as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+
+def read_overlay(filename: str) -> Tuple[Alignment, Optional[OverlayStore]]:
+    # The store is None for JSON files without an element list
+    if is_binary(filename):
+        return read_binary(filename)
+    return read_json(filename)
+
+
+def read_json(filename: str) -> Tuple[Alignment, Optional[OverlayStore]]:
+    with open(filename, "r", encoding="utf-8") as f:
+        content = json.load(f)
+    if not isinstance(content, dict):
+        raise Exception("Invalid file format!")
+    alignment = {key: float(content[key]) for key in ALIGNMENT_KEYS if key in content}
+    complete_alignment(alignment)
+    store = None
+    if "elements" in content and isinstance(content["elements"], list):
+        store = OverlayStore.from_json(content["elements"])
+    return (alignment, store)
+
+
+def read_binary(filename: str) -> Tuple[Alignment, OverlayStore]:
+    # The arrays are mapped copy-on-write: nothing is read up front, edits
+    # stay private to the process and the file can be replaced while mapped.
+    data = np.memmap(filename, dtype=np.uint8, mode="c")
+    if len(data) < _HEADER.size:
+        raise Exception("Invalid file format!")
+    (magic, version, count, *values) = _HEADER.unpack(bytes(data[: _HEADER.size]))
+    if magic != _MAGIC:
+        raise Exception("Invalid file format!")
+    if version != VERSION:
+        raise Exception(f"Unsupported INPX version {version}!")
+    (xs, ys, types, size) = _layout(count)
+    if len(data) < size:
+        raise Exception("Truncated INPX file!")
+    store = OverlayStore.from_arrays(
+        data[xs : xs + 8 * count].view(np.float64),
+        data[ys : ys + 8 * count].view(np.float64),
+        data[types : types + count],
+    )
+    return (complete_alignment(dict(zip(ALIGNMENT_KEYS, values))), store)
+
+
+def write_overlay(
+    filename: str, alignment: Alignment, store: OverlayStore, binary: bool = False
+) -> None:
+    # Written to a temporary file first, the file being replaced may still be
+    # mapped by the store that is saved
+    alignment = complete_alignment(alignment)
+    if binary:
+        write_atomic(filename, lambda f: _write_binary(f, alignment, store))
+    else:
+        write_atomic(filename, lambda f: _write_json(f, alignment, store))
+
+
+def _write_json(f, alignment: Alignment, store: OverlayStore) -> None:
+    content = {key: alignment[key] for key in ALIGNMENT_KEYS if key in alignment}
+    content["elements"] = store.to_json()
+    f.write(json.dumps(content, ensure_ascii=False).encode("utf-8"))
+
+
+def _write_binary(f, alignment: Alignment, store: OverlayStore) -> None:
+    count = len(store)
+    (xs, ys, types, _) = _layout(count)
+    f.write(
+        _HEADER.pack(
+            _MAGIC,
+            VERSION,
+            count,
+            *(float(alignment[key]) for key in ALIGNMENT_KEYS),
+        )
+    )
+    for (offset, array) in ((xs, store.xs), (ys, store.ys), (types, store.types)):
+        f.seek(offset)
+        f.write(np.ascontiguousarray(array).tobytes())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m annotator.inpx",
+        description="Convert overlay files between the JSON and binary INPX formats.",
+    )
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--json", action="store_true", help="write JSON")
+    group.add_argument("--binary", action="store_true", help="write binary")
+    args = parser.parse_args()
+
+    source_binary = is_binary(args.source)
+    # Without an explicit choice the other format is written
+    binary = args.binary or (not args.json and not source_binary)
+    (alignment, store) = read_overlay(args.source)
+    write_overlay(args.destination, alignment, store or OverlayStore(), binary)
+    print(
+        f"{args.source} ({'binary' if source_binary else 'JSON'}) -> "
+        f"{args.destination} ({'binary' if binary else 'JSON'}), "
+        f"{len(store or ())} elements"
+    )
+
+
+if __name__ == "__main__":
+    main()
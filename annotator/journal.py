@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, Final, List, Optional, Tuple
+
+import numpy as np
+
+from .geometry_cache import cache_root
+from .inpx import Alignment, read_overlay, write_overlay
+from .network import Network
+from .overlay import OverlayStore
+
+# Edits are stored as JSON objects. Every action carries what is needed to
+# apply it as well as to revert it, so undoing appends the inverse action to
+# the journal and recovery only ever replays forwards.
+Action = Dict[str, Any]
+
+
+def insert_action(elements: List[Tuple[int, float, float, int]]) -> Action:
+    # Elements are (id, x, y, type code), inserted in list order
+    return {"op": "insert", "elements": [list(e) for e in elements]}
+
+
+def remove_action(elements: List[Tuple[int, float, float, int]]) -> Action:
+    # Elements are (id, x, y, type code), removed in list order
+    return {"op": "remove", "elements": [list(e) for e in elements]}
+
+
+def place_action(
+    ids: np.ndarray,
+    old_xs: np.ndarray,
+    old_ys: np.ndarray,
+    xs: np.ndarray,
+    ys: np.ndarray,
+) -> Action:
+    return {
+        "op": "place",
+        "ids": ids.tolist(),
+        "old_xs": old_xs.tolist(),
+        "old_ys": old_ys.tolist(),
+        "xs": xs.tolist(),
+        "ys": ys.tolist(),
+    }
+
+
+def align_action(old: Alignment, new: Alignment) -> Action:
+    return {"op": "align", "old": old, "new": new}
+
+
+def inverse(action: Action) -> Action:
+    op = action["op"]
+    if op == "insert":
+        return {"op": "remove", "elements": action["elements"][::-1]}
+    if op == "remove":
+        return {"op": "insert", "elements": action["elements"][::-1]}
+    if op == "place":
+        return {
+            **action,
+            "old_xs": action["xs"],
+            "old_ys": action["ys"],
+            "xs": action["old_xs"],
+            "ys": action["old_ys"],
+        }
+    if op == "align":
+        return {"op": "align", "old": action["new"], "new": action["old"]}
+    raise ValueError(f"Unknown journal action {op}!")
+
+
+def apply(
+    net: Network, action: Action, set_alignment: Callable[[Alignment], None]
+) -> None:
+    op = action["op"]
+    if op == "insert":
+        for (element, x, y, code) in action["elements"]:
+            net.insert_element(element, x, y, code)
+    elif op == "remove":
+        for (element, _, _, _) in action["elements"]:
+            net.remove_element(element)
+    elif op == "place":
+        net.place_elements(
+            np.array(action["ids"], dtype=np.int64),
+            np.array(action["xs"], dtype=np.float64),
+            np.array(action["ys"], dtype=np.float64),
+        )
+    elif op == "align":
+        set_alignment(action["new"])
+    else:
+        raise ValueError(f"Unknown journal action {op}!")
+
+
+def session_path(inp_filename: str) -> str:
+    # Where the journal of an overlay that was never saved is kept
+    name = hashlib.blake2b(
+        os.path.abspath(inp_filename).encode("utf-8"), digest_size=16
+    ).hexdigest()
+    return os.path.join(cache_root(), "sessions", name + ".inpx")
+
+
+def _file_key(filename: str) -> Dict[str, int]:
+    stat = os.stat(filename)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+# Append-only log of the edits made to the overlay saved as `path`. The first
+# line describes the state the edits apply to: the alignment and a base
+# overlay file, which is either `path` itself, an autosave snapshot or none
+# for an empty overlay. Every following line is one action. Once the log
+# outgrows the base it is compacted by writing a new snapshot.
+class Journal:
+    VERSION: Final = 1
+    COMPACT_BYTES: Final = 4 << 20
+
+    def __init__(self, path: str):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.autosave_path = path + ".autosave"
+        self._file = None
+        self._bytes = 0
+        self._base_bytes = 0
+
+    def _read(self) -> Tuple[Dict[str, Any], List[Action]]:
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        if not lines:
+            raise ValueError("Empty journal!")
+        header = json.loads(lines[0])
+        if header.get("version") != self.VERSION:
+            raise ValueError("Unsupported journal version!")
+        actions = []
+        for line in lines[1:]:
+            try:
+                actions.append(json.loads(line))
+            except ValueError:
+                # A crash while appending leaves a partial last line
+                break
+        return (header, actions)
+
+    def pending(self) -> bool:
+        # Whether the journal holds edits that were never saved
+        try:
+            (header, actions) = self._read()
+        except (OSError, ValueError):
+            return False
+        return bool(actions) or header.get("base") == self.autosave_path
+
+    def recover(self) -> Tuple[Alignment, OverlayStore, List[Action]]:
+        (header, actions) = self._read()
+        base = header.get("base")
+        store = OverlayStore()
+        if base is not None:
+            if _file_key(base) != header.get("key"):
+                raise Exception(f"{base} has changed since the journal was written!")
+            (_, loaded) = read_overlay(base)
+            store = loaded or store
+        return (header["alignment"], store, actions)
+
+    def start(self, alignment: Alignment, base: Optional[str]) -> None:
+        self.close()
+        if base != self.autosave_path and os.path.exists(self.autosave_path):
+            os.remove(self.autosave_path)
+        header = {
+            "version": self.VERSION,
+            "base": base,
+            "key": _file_key(base) if base is not None else None,
+            "alignment": alignment,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        self._file = open(self.journal_path, "w", encoding="utf-8")
+        self._file.write(json.dumps(header) + "\n")
+        self._file.flush()
+        self._bytes = 0
+        self._base_bytes = os.path.getsize(base) if base is not None else 0
+
+    def append(self, action: Action) -> None:
+        if self._file is None:
+            return
+        line = json.dumps(action) + "\n"
+        # Flushed, but not synced: this protects against the application
+        # crashing, not the whole system
+        self._file.write(line)
+        self._file.flush()
+        self._bytes += len(line)
+
+    def needs_compaction(self) -> bool:
+        return self._bytes > max(self.COMPACT_BYTES, self._base_bytes)
+
+    def compact(self, alignment: Alignment, store: OverlayStore) -> None:
+        write_overlay(self.autosave_path, alignment, store, True)
+        self.start(alignment, self.autosave_path)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self) -> None:
+        self.close()
+        for path in (self.journal_path, self.autosave_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# Undo and redo stacks of the actions applied to a network's overlay and the
+# alignment. Every action is also appended to the journal, if there is one.
+class EditHistory:
+    MAX_UNDO: Final = 1000
+
+    def __init__(
+        self,
+        net: Network,
+        get_alignment: Callable[[], Alignment],
+        set_alignment: Callable[[Alignment], None],
+    ):
+        self._net = net
+        self._get_alignment = get_alignment
+        self._set_alignment = set_alignment
+        self._undo: List[Action] = []
+        self._redo: List[Action] = []
+        self.journal: Optional[Journal] = None
+        # Called when writing the journal fails, journaling stops afterwards
+        self.on_journal_error: Optional[Callable[[Exception], None]] = None
+
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def push(self, action: Action) -> None:
+        # Records an action that has already been applied
+        self._undo.append(action)
+        del self._undo[: -self.MAX_UNDO]
+        self._redo.clear()
+        self._log(action)
+
+    def undo(self) -> bool:
+        if not self._undo:
+            return False
+        action = self._undo.pop()
+        undone = inverse(action)
+        apply(self._net, undone, self._set_alignment)
+        self._redo.append(action)
+        self._log(undone)
+        return True
+
+    def redo(self) -> bool:
+        if not self._redo:
+            return False
+        action = self._redo.pop()
+        apply(self._net, action, self._set_alignment)
+        self._undo.append(action)
+        self._log(action)
+        return True
+
+    def replay(self, actions: List[Action]) -> None:
+        for action in actions:
+            apply(self._net, action, self._set_alignment)
+
+    def clear(self) -> None:
+        self._undo.clear()
+        self._redo.clear()
+
+    def _log(self, action: Action) -> None:
+        if self.journal is None:
+            return
+        try:
+            self.journal.append(action)
+            if self.journal.needs_compaction():
+                self.journal.compact(self._get_alignment(), self._net.elements)
+        except OSError as e:
+            self.journal.close()
+            self.journal = None
+            if self.on_journal_error:
+                self.on_journal_error(e)
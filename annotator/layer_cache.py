@@ -0,0 +1,218 @@
+import math
+import time
+from typing import Callable, Final, Hashable, Iterator, NamedTuple, Optional, Tuple
+
+import cairo
+
+# x, y, width, height in drawing area coordinates
+Rect = Tuple[int, int, int, int]
+
+
+def make_rect(x: float, y: float, width: float, height: float) -> Rect:
+    left = math.floor(x)
+    top = math.floor(y)
+    return (left, top, math.ceil(x + width) - left, math.ceil(y + height) - top)
+
+
+def clip_rect(ctx) -> Rect:
+    (x1, y1, x2, y2) = ctx.clip_extents()
+    return make_rect(x1, y1, x2 - x1, y2 - y1)
+
+
+def intersect(a: Rect, b: Rect) -> Optional[Rect]:
+    x = max(a[0], b[0])
+    y = max(a[1], b[1])
+    w = min(a[0] + a[2], b[0] + b[2]) - x
+    h = min(a[1] + a[3], b[1] + b[3]) - y
+    if w <= 0 or h <= 0:
+        return None
+    return (x, y, w, h)
+
+
+def contains(outer: Rect, inner: Rect) -> bool:
+    return (
+        inner[0] >= outer[0]
+        and inner[1] >= outer[1]
+        and inner[0] + inner[2] <= outer[0] + outer[2]
+        and inner[1] + inner[3] <= outer[1] + outer[3]
+    )
+
+
+# Rendering of a layer in progress, drawn into its own surface so that the
+# finished one stays usable until it is replaced
+class _Job(NamedTuple):
+    key: Hashable
+    rect: Rect
+    surface: cairo.ImageSurface
+    steps: Iterator[None]
+
+
+# Offscreen surface holding the last rendering of a single layer. It is reused
+# as long as the key passed to paint() stays the same and the surface covers
+# the region being drawn, so exposing the window or editing another layer only
+# costs a blit.
+class LayerCache:
+    # Layers bigger than this are cached around the visible region only
+    MAX_PIXELS: Final = 4096 * 4096
+    MAX_SIDE: Final = 16384
+
+    def __init__(self):
+        self._surface: Optional[cairo.ImageSurface] = None
+        self._key: Optional[Hashable] = None
+        self._rect: Rect = (0, 0, 0, 0)
+        self._job: Optional[_Job] = None
+
+    def invalidate(self) -> None:
+        self._surface = None
+        self._key = None
+        self._job = None
+
+    def cancel(self) -> None:
+        self._job = None
+
+    def pending(self) -> bool:
+        return self._job is not None
+
+    def paint(
+        self,
+        ctx,
+        key: Hashable,
+        bounds: Rect,
+        render: Callable[[cairo.Context], None],
+    ) -> None:
+        clip = clip_rect(ctx)
+        visible = intersect(clip, bounds)
+        if visible is None:
+            return
+        if (
+            self._surface is None
+            or key != self._key
+            or not contains(self._rect, visible)
+        ):
+            self._rect = self._cache_rect(bounds, clip)
+            self._surface = self._render(self._rect, render)
+            self._key = key
+        ctx.set_source_surface(self._surface, self._rect[0], self._rect[1])
+        ctx.paint()
+
+    def paint_progressive(
+        self,
+        ctx,
+        key: Tuple[float, float, float],
+        bounds: Rect,
+        steps: Callable[[cairo.Context], Iterator[None]],
+        preview: Optional[Callable[[cairo.Context], None]] = None,
+    ) -> bool:
+        # Like paint(), but instead of rendering the layer right away a job is
+        # started that step() advances. Until it is done, the last rendering
+        # moved and scaled to `key`, or else `preview`, stands in for it.
+        # Returns True while the job is unfinished.
+        clip = clip_rect(ctx)
+        visible = intersect(clip, bounds)
+        if visible is None:
+            return self._job is not None
+        if (
+            self._surface is not None
+            and key == self._key
+            and contains(self._rect, visible)
+        ):
+            ctx.set_source_surface(self._surface, self._rect[0], self._rect[1])
+            ctx.paint()
+            return False
+        job = self._job
+        # A job for another view is abandoned
+        if job is None or key != job.key or not contains(job.rect, visible):
+            rect = self._cache_rect(bounds, clip)
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, rect[2], rect[3])
+            self._job = _Job(
+                key, rect, surface, steps(self._context(surface, rect, rect))
+            )
+        if not self.paint_transformed(ctx, key) and preview is not None:
+            preview(ctx)
+        return True
+
+    def step(self, deadline: float) -> bool:
+        # Advances the job until time.perf_counter() passes `deadline`, but by
+        # at least one step. Returns True while it is unfinished.
+        job = self._job
+        if job is None:
+            return False
+        try:
+            next(job.steps)
+            while time.perf_counter() < deadline:
+                next(job.steps)
+        except StopIteration:
+            job.surface.flush()
+            self._surface = job.surface
+            self._key = job.key
+            self._rect = job.rect
+            self._job = None
+            return False
+        return True
+
+    def paint_transformed(self, ctx, key: Tuple[float, float, float]) -> bool:
+        # Paints the last rendering moved and scaled as if it had been
+        # rendered for `key`. Keys are (scale, offset_x, offset_y) of a layer
+        # drawn at offset + scale * position. Returns False if there is none.
+        if self._surface is None or self._key is None:
+            return False
+        (scale, offset_x, offset_y) = self._key  # type: ignore
+        factor = key[0] / scale
+        ctx.save()
+        ctx.translate(key[1] - offset_x * factor, key[2] - offset_y * factor)
+        ctx.scale(factor, factor)
+        ctx.set_source_surface(self._surface, self._rect[0], self._rect[1])
+        ctx.get_source().set_filter(cairo.FILTER_FAST)
+        ctx.paint()
+        ctx.restore()
+        return True
+
+    def update(
+        self, key: Hashable, rect: Rect, render: Callable[[cairo.Context], None]
+    ) -> None:
+        # Re-renders only `rect` of the cached surface after a local change. A
+        # job started before the change would finish with stale contents.
+        self._job = None
+        if self._surface is None or key != self._key:
+            return
+        area = intersect(rect, self._rect)
+        if area is None:
+            return
+        ctx = self._context(self._surface, self._rect, area)
+        ctx.set_operator(cairo.OPERATOR_CLEAR)
+        ctx.paint()
+        ctx.set_operator(cairo.OPERATOR_OVER)
+        render(ctx)
+        self._surface.flush()
+
+    def _cache_rect(self, bounds: Rect, clip: Rect) -> Rect:
+        (_, _, w, h) = bounds
+        if w * h <= self.MAX_PIXELS and w <= self.MAX_SIDE and h <= self.MAX_SIDE:
+            return bounds
+        # Keep half a viewport of margin around the visible region so that
+        # small scroll steps are still served from the cache.
+        margin_x = clip[2] // 2
+        margin_y = clip[3] // 2
+        around_clip = (
+            clip[0] - margin_x,
+            clip[1] - margin_y,
+            clip[2] + 2 * margin_x,
+            clip[3] + 2 * margin_y,
+        )
+        return intersect(around_clip, bounds) or clip
+
+    def _render(
+        self, rect: Rect, render: Callable[[cairo.Context], None]
+    ) -> cairo.ImageSurface:
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, rect[2], rect[3])
+        render(self._context(surface, rect, rect))
+        surface.flush()
+        return surface
+
+    @staticmethod
+    def _context(surface: cairo.ImageSurface, origin: Rect, clip: Rect):
+        ctx = cairo.Context(surface)
+        ctx.translate(-origin[0], -origin[1])
+        ctx.rectangle(clip[0], clip[1], clip[2], clip[3])
+        ctx.clip()
+        return ctx
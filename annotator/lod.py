@@ -0,0 +1,126 @@
+from typing import Any, Dict, Final, List, Tuple
+
+import numpy as np
+
+from .spatial import GridIndex, point_boxes, segment_boxes
+
+
+# Network geometry at one resolution. Level 0 holds every node and pipe, the
+# coarser levels hold one node per grid cell of `cell` network units and only
+# the pipes connecting different cells.
+class DetailLevel:
+    def __init__(self, cell: float, node_coords: np.ndarray, pipe_nodes: np.ndarray):
+        self.cell = cell
+        self.node_coords = node_coords
+        self.pipe_nodes = pipe_nodes
+        self.node_index = GridIndex(point_boxes(node_coords))
+        self.pipe_index = GridIndex(
+            segment_boxes(node_coords[pipe_nodes[:, 0]], node_coords[pipe_nodes[:, 1]])
+        )
+
+    def export(
+        self, prefix: str, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]
+    ) -> None:
+        arrays[prefix + "node_coords"] = self.node_coords
+        arrays[prefix + "pipe_nodes"] = self.pipe_nodes
+        meta[prefix + "cell"] = self.cell
+        self.node_index.export(prefix + "node_index.", arrays, meta)
+        self.pipe_index.export(prefix + "pipe_index.", arrays, meta)
+
+    @classmethod
+    def restore(
+        cls, prefix: str, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]
+    ) -> "DetailLevel":
+        level = cls.__new__(cls)
+        level.cell = meta[prefix + "cell"]
+        level.node_coords = arrays[prefix + "node_coords"]
+        level.pipe_nodes = arrays[prefix + "pipe_nodes"]
+        level.node_index = GridIndex.restore(prefix + "node_index.", arrays, meta)
+        level.pipe_index = GridIndex.restore(prefix + "pipe_index.", arrays, meta)
+        return level
+
+
+def _sorted_unique(values: np.ndarray) -> np.ndarray:
+    values = np.sort(values)
+    keep = np.ones(len(values), dtype=bool)
+    np.not_equal(values[1:], values[:-1], out=keep[1:])
+    return values[keep]
+
+
+def _coarsen(
+    node_coords: np.ndarray,
+    node_weights: np.ndarray,
+    pipe_nodes: np.ndarray,
+    origin: np.ndarray,
+    cell: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    cells = np.floor((node_coords - origin) / cell).astype(np.int64)
+    keys = cells[:, 1] * (int(cells[:, 0].max()) + 1) + cells[:, 0]
+    (_, bins) = np.unique(keys, return_inverse=True)
+    bins = bins.reshape(-1)
+    weights = np.bincount(bins, weights=node_weights)
+    coords = np.empty((len(weights), 2), dtype=np.float64)
+    coords[:, 0] = np.bincount(bins, weights=node_coords[:, 0] * node_weights)
+    coords[:, 1] = np.bincount(bins, weights=node_coords[:, 1] * node_weights)
+    coords /= weights[:, np.newaxis]
+
+    # Pipes inside a single cell vanish, parallel pipes between two cells are
+    # merged into one
+    count = len(weights)
+    ends = np.sort(bins[pipe_nodes], axis=1).astype(np.int64)
+    ends = ends[ends[:, 0] != ends[:, 1]]
+    pairs = _sorted_unique(ends[:, 0] * count + ends[:, 1])
+    pipes = np.stack((pairs // count, pairs % count), axis=1).astype(np.intp)
+    return (coords, weights, pipes)
+
+
+class LevelsOfDetail:
+    # Coarsest and finest cell size as a fraction of the network width
+    COARSEST: Final = 1 / 16
+    FINEST: Final = 1 / 4096
+    # A level is only kept if it drops at least this share of the primitives
+    # of the previous one
+    MIN_REDUCTION: Final = 0.1
+
+    def __init__(self, node_coords: np.ndarray, pipe_nodes: np.ndarray, width: float):
+        self.levels: List[DetailLevel] = [DetailLevel(0.0, node_coords, pipe_nodes)]
+        if len(node_coords) == 0 or width <= 0.0:
+            return
+        origin = node_coords.min(axis=0)
+        cell = width * self.FINEST
+        # Cells double in size from level to level, so every level can be
+        # derived from the previous one with its nodes weighted by the number
+        # of original nodes they stand for.
+        (coords, weights, pipes) = (node_coords, np.ones(len(node_coords)), pipe_nodes)
+        while cell <= width * self.COARSEST:
+            (coords, weights, pipes) = _coarsen(coords, weights, pipes, origin, cell)
+            finest = self.levels[-1]
+            previous = len(finest.node_coords) + len(finest.pipe_nodes)
+            if len(coords) + len(pipes) <= previous * (1.0 - self.MIN_REDUCTION):
+                self.levels.append(DetailLevel(cell, coords, pipes))
+            cell *= 2.0
+
+    def export(self, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> None:
+        meta["lod.levels"] = len(self.levels)
+        for (i, level) in enumerate(self.levels):
+            level.export(f"lod.{i}.", arrays, meta)
+
+    @classmethod
+    def restore(
+        cls, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]
+    ) -> "LevelsOfDetail":
+        lod = cls.__new__(cls)
+        lod.levels = [
+            DetailLevel.restore(f"lod.{i}.", arrays, meta)
+            for i in range(int(meta["lod.levels"]))
+        ]
+        return lod
+
+    def select(self, max_cell: float) -> DetailLevel:
+        # Pick the coarsest level whose cells are not bigger than `max_cell`
+        selected = self.levels[0]
+        for level in self.levels[1:]:
+            if level.cell > max_cell:
+                break
+            selected = level
+        return selected
@@ -0,0 +1,85 @@
+import argparse
+import gc
+import tracemalloc
+from typing import Callable, List, Optional, Tuple
+
+from .geometry_cache import GeometryCache
+from .network import Network
+
+# Memory held by a loaded network in the ways it can be kept around:
+# with the WNTR model parsed, with the full geometry, and with only the arrays
+# needed for drawing left after Network.release_model(). Allocations are
+# counted with tracemalloc, which also sees numpy's array buffers. Arrays
+# mapped from the geometry cache are backed by the file and not counted.
+
+
+def measure(load: Callable[[], object]) -> Tuple[int, int]:
+    # Bytes still allocated by what `load` returned, and the peak while it ran
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = load()
+        gc.collect()
+        (current, peak) = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return (current, peak)
+
+
+def _load(filename: str, cache: Optional[GeometryCache], mode: str) -> Network:
+    net = Network()
+    if not net.load_network(filename, cache=cache):
+        raise ValueError(f"{filename}: inappropriate size of network")
+    if mode == "model":
+        # The property parses the WNTR model on first access
+        _ = net.wn
+    elif mode == "released":
+        net.release_model()
+    return net
+
+
+def report(filename: str, cache: Optional[GeometryCache] = None) -> List[str]:
+    modes = [("Geometry", "geometry"), ("Geometry only", "released")]
+    try:
+        # Imported beforehand, so its modules are not counted for the model
+        import wntr  # type: ignore
+
+        modes.insert(0, ("WNTR model", "model"))
+    except ImportError:
+        pass
+    net = _load(filename, cache, "geometry")
+    geometry = net.geometry
+    lines = [
+        f"{filename}: {len(geometry.node_names)} nodes, "  # type: ignore
+        f"{len(geometry.link_names)} links"  # type: ignore
+    ]
+    del net, geometry
+    for (label, mode) in modes:
+        (current, peak) = measure(lambda: _load(filename, cache, mode))
+        lines.append(
+            f"  {label:<14} {current / 2**20:9.1f} MB  (peak {peak / 2**20:.1f} MB)"
+        )
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m annotator.memory_report",
+        description="Compare the memory held by networks with the WNTR model, "
+        "with the full geometry and with only the geometry needed for drawing.",
+    )
+    parser.add_argument("inp", nargs="+")
+    parser.add_argument(
+        "--cache",
+        metavar="DIRECTORY",
+        help="load the geometry through a geometry cache in this directory",
+    )
+    args = parser.parse_args()
+    cache = GeometryCache(args.cache) if args.cache else None
+    for filename in args.inp:
+        print("\n".join(report(filename, cache)))
+
+
+if __name__ == "__main__":
+    main()
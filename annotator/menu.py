@@ -1,10 +1,18 @@
 import gi  # type: ignore
 
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk  # type: ignore
+from typing import Final, List, Tuple
 
+from gi.repository import Gdk, Gtk  # type: ignore
+
+from .assignment import AssignmentMode
 from .drawing_area import DrawingArea, Layer
-from .network import OverlayType
+from .overlay import OverlayType
+
+
+# Formats offered when saving an overlay
+FORMAT_JSON: Final = "JSON"
+FORMAT_BINARY: Final = "Binary"
 
 
 class MainMenu(Gtk.VBox):
@@ -12,6 +20,11 @@ class MainMenu(Gtk.VBox):
         super().__init__(orientation=Gtk.Orientation.HORIZONTAL)
         self.window = window
         self.drawing_area = drawing_area
+        self.drawing_area.connect("network-loaded", self.on_network_loaded)
+        self.drawing_area.connect("history-changed", self.on_history_changed)
+        self.drawing_area.connect("zoom-changed", self.on_zoom_changed)
+        accel_group = Gtk.AccelGroup()
+        self.window.add_accel_group(accel_group)
 
         filemenu = Gtk.Menu()
         menuitem = Gtk.MenuItem("File")
@@ -31,6 +44,14 @@ class MainMenu(Gtk.VBox):
         self.load_overlay.connect("activate", self.on_load_overlay)
         self.load_overlay.set_sensitive(False)
 
+        self.import_buildings = Gtk.MenuItem("Import Buildings")
+        self.import_buildings.connect("activate", self.on_import_buildings)
+        self.import_buildings.set_sensitive(False)
+
+        self.export_counts = Gtk.MenuItem("Export Junction Counts")
+        self.export_counts.connect("activate", self.on_export_counts)
+        self.export_counts.set_sensitive(False)
+
         exit = Gtk.MenuItem("Exit")
         exit.connect("activate", Gtk.main_quit)
 
@@ -39,19 +60,93 @@ class MainMenu(Gtk.VBox):
         filemenu.append(Gtk.SeparatorMenuItem())
         filemenu.append(self.save_overlay)
         filemenu.append(self.load_overlay)
+        filemenu.append(self.import_buildings)
+        filemenu.append(self.export_counts)
         filemenu.append(Gtk.SeparatorMenuItem())
         filemenu.append(exit)
 
+        editmenu = Gtk.Menu()
+        edit_menuitem = Gtk.MenuItem("Edit")
+        edit_menuitem.set_submenu(editmenu)
+
+        self.undo_menu = Gtk.MenuItem("Undo")
+        self.undo_menu.connect("activate", self.on_undo)
+        self.undo_menu.add_accelerator(
+            "activate",
+            accel_group,
+            Gdk.KEY_z,
+            Gdk.ModifierType.CONTROL_MASK,
+            Gtk.AccelFlags.VISIBLE,
+        )
+        self.undo_menu.set_sensitive(False)
+
+        self.redo_menu = Gtk.MenuItem("Redo")
+        self.redo_menu.connect("activate", self.on_redo)
+        self.redo_menu.add_accelerator(
+            "activate",
+            accel_group,
+            Gdk.KEY_y,
+            Gdk.ModifierType.CONTROL_MASK,
+            Gtk.AccelFlags.VISIBLE,
+        )
+        self.redo_menu.add_accelerator(
+            "activate",
+            accel_group,
+            Gdk.KEY_z,
+            Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK,
+            0,
+        )
+        self.redo_menu.set_sensitive(False)
+
+        editmenu.append(self.undo_menu)
+        editmenu.append(self.redo_menu)
+
+        viewmenu = Gtk.Menu()
+        view_menuitem = Gtk.MenuItem("View")
+        view_menuitem.set_submenu(viewmenu)
+
+        batched_menu = Gtk.CheckMenuItem("Batched Rendering")
+        batched_menu.set_active(self.drawing_area.batched_rendering)
+        batched_menu.connect("toggled", self.on_batched_toggled)
+
+        progressive_menu = Gtk.CheckMenuItem("Progressive Rendering")
+        progressive_menu.set_active(self.drawing_area.progressive_rendering)
+        progressive_menu.connect("toggled", self.on_progressive_toggled)
+
+        draw_stats_menu = Gtk.MenuItem("Draw Statistics")
+        draw_stats_menu.connect("activate", self.on_draw_statistics)
+
+        profiler_menu = Gtk.CheckMenuItem("Render Profiler")
+        profiler_menu.set_active(self.drawing_area.profiling)
+        profiler_menu.connect("toggled", self.on_profiler_toggled)
+
+        save_trace_menu = Gtk.MenuItem("Save Render Trace")
+        save_trace_menu.connect("activate", self.on_save_trace)
+
+        viewmenu.append(batched_menu)
+        viewmenu.append(progressive_menu)
+        viewmenu.append(draw_stats_menu)
+        viewmenu.append(Gtk.SeparatorMenuItem())
+        viewmenu.append(profiler_menu)
+        viewmenu.append(save_trace_menu)
+
         menubar = Gtk.MenuBar()
         menubar.append(menuitem)
+        menubar.append(edit_menuitem)
+        menubar.append(view_menuitem)
 
         adjustment = Gtk.Adjustment(
-            upper=20.0, lower=0.0, step_increment=0.05, page_increment=0.5
+            upper=DrawingArea.MAX_ZOOM,
+            lower=DrawingArea.MIN_ZOOM,
+            step_increment=0.05,
+            page_increment=0.5,
         )
         self.spinbutton = Gtk.SpinButton()
         self.spinbutton.configure(adjustment, 0.05, 3)
         self.spinbutton.set_value(self.drawing_area.ratio_image)
-        self.spinbutton.connect("value-changed", self.on_value_changed)
+        self._zoom_handler = self.spinbutton.connect(
+            "value-changed", self.on_value_changed
+        )
         self._set_margin_top_bottom(self.spinbutton)
 
         self.combo_overlay = Gtk.ComboBoxText()
@@ -88,21 +183,52 @@ class MainMenu(Gtk.VBox):
         self.pack_start(lbl_zoom, False, False, 5)
         self.pack_start(self.spinbutton, False, False, 5)
 
+    @staticmethod
+    def _choice(label: str, values: List[str]) -> Tuple[Gtk.Box, Gtk.ComboBoxText]:
+        # Labelled drop-down for the extra widget of a file dialog, the first
+        # value is selected
+        combo = Gtk.ComboBoxText()
+        for value in values:
+            combo.append_text(value)
+        combo.set_active(0)
+        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        box.pack_start(Gtk.Label(label=label), False, False, 0)
+        box.pack_start(combo, False, False, 0)
+        box.show_all()
+        return (box, combo)
+
     def _set_margin_top_bottom(self, widget: Gtk.Widget):
         widget.set_margin_top(3)
         widget.set_margin_bottom(3)
 
     def on_layer_changed(self, combo):
         self.drawing_area.current_layer = Layer(combo.get_active_text())
-        if self.drawing_area.current_layer == Layer.BACKGROUND:
-            self.spinbutton.set_value(self.drawing_area.ratio_image)
-            self.combo_overlay.set_sensitive(False)
-        elif self.drawing_area.current_layer == Layer.NETWORK:
-            self.spinbutton.set_value(self.drawing_area.ratio_network)
-            self.combo_overlay.set_sensitive(False)
+        self.on_zoom_changed(self.drawing_area)
+        self.combo_overlay.set_sensitive(
+            self.drawing_area.current_layer == Layer.OVERLAY
+        )
+
+    def on_undo(self, widget):
+        self.drawing_area.undo()
+
+    def on_redo(self, widget):
+        self.drawing_area.redo()
+
+    def on_history_changed(self, drawing_area):
+        self.undo_menu.set_sensitive(drawing_area.can_undo())
+        self.redo_menu.set_sensitive(drawing_area.can_redo())
+        # Undoing may have changed the zoom of the current layer
+        self.on_zoom_changed(drawing_area)
+
+    def on_zoom_changed(self, drawing_area):
+        # Only shows the zoom, the spin button rounds it and would otherwise
+        # apply the rounded value as a new zoom
+        self.spinbutton.handler_block(self._zoom_handler)
+        if drawing_area.current_layer == Layer.BACKGROUND:
+            self.spinbutton.set_value(drawing_area.ratio_image)
         else:
-            self.spinbutton.set_value(self.drawing_area.ratio_network)
-            self.combo_overlay.set_sensitive(True)
+            self.spinbutton.set_value(drawing_area.ratio_network)
+        self.spinbutton.handler_unblock(self._zoom_handler)
 
     def on_overlay_changed(self, combo):
         self.drawing_area.overlay_type = OverlayType(combo.get_active_text())
@@ -110,6 +236,51 @@ class MainMenu(Gtk.VBox):
     def on_value_changed(self, scroll):
         self.drawing_area.on_zoom(self.spinbutton.get_value())
 
+    def on_batched_toggled(self, menuitem):
+        self.drawing_area.batched_rendering = menuitem.get_active()
+
+    def on_progressive_toggled(self, menuitem):
+        self.drawing_area.progressive_rendering = menuitem.get_active()
+
+    def on_draw_statistics(self, widget):
+        dialog = Gtk.MessageDialog(
+            transient_for=self.window,
+            message_type=Gtk.MessageType.INFO,
+            buttons=Gtk.ButtonsType.OK,
+            text="Draw Statistics",
+        )
+        dialog.format_secondary_text(self.drawing_area.draw_statistics())
+        dialog.run()
+        dialog.destroy()
+
+    def on_profiler_toggled(self, menuitem):
+        self.drawing_area.profiling = menuitem.get_active()
+
+    def on_save_trace(self, widget):
+        dialog = Gtk.FileChooserDialog(
+            title="Save file", parent=self.window, action=Gtk.FileChooserAction.SAVE
+        )
+        dialog.add_buttons(
+            Gtk.STOCK_CANCEL,
+            Gtk.ResponseType.CANCEL,
+            Gtk.STOCK_OK,
+            Gtk.ResponseType.OK,
+        )
+
+        # Opened with chrome://tracing or ui.perfetto.dev
+        filter_trace = Gtk.FileFilter()
+        filter_trace.set_name("Trace file (JSON)")
+        filter_trace.add_pattern("*.json")
+        dialog.add_filter(filter_trace)
+
+        response = dialog.run()
+        if response == Gtk.ResponseType.OK:
+            filename = dialog.get_filename()
+            if not filename.lower().endswith(".json"):
+                filename += ".json"
+            self.drawing_area.save_render_trace(filename)
+        dialog.destroy()
+
     def _create_load_file_dialog(self):
         dialog = Gtk.FileChooserDialog(
             title="Choose file", parent=self.window, action=Gtk.FileChooserAction.OPEN
@@ -135,9 +306,11 @@ class MainMenu(Gtk.VBox):
             self.drawing_area.load_inp_from_file(dialog.get_filename())
         dialog.destroy()
 
-        if self.drawing_area.net_loaded():
-            self.load_overlay.set_sensitive(True)
-            self.save_overlay.set_sensitive(True)
+    def on_network_loaded(self, drawing_area):
+        self.load_overlay.set_sensitive(True)
+        self.save_overlay.set_sensitive(True)
+        self.import_buildings.set_sensitive(True)
+        self.export_counts.set_sensitive(True)
 
     def on_load_bg(self, widget):
         dialog = self._create_load_file_dialog()
@@ -178,12 +351,68 @@ class MainMenu(Gtk.VBox):
         filter_inpx.add_pattern("*.inpx")
         dialog.add_filter(filter_inpx)
 
+        # JSON stays the default, older versions of the annotator only read
+        # that. Binary files load and save much faster when large.
+        (box, combo) = self._choice("Format:", [FORMAT_JSON, FORMAT_BINARY])
+        dialog.set_extra_widget(box)
+
         response = dialog.run()
         if response == Gtk.ResponseType.OK:
             filename = dialog.get_filename()
             if not filename.lower().endswith(".inpx"):
                 filename += ".inpx"
-            self.drawing_area.save_overlay_to_file(filename)
+            self.drawing_area.save_overlay_to_file(
+                filename, combo.get_active_text() == FORMAT_BINARY
+            )
+        dialog.destroy()
+
+    def on_import_buildings(self, widget):
+        dialog = self._create_load_file_dialog()
+
+        filter_points = Gtk.FileFilter()
+        filter_points.set_name("CSV/GeoJSON")
+        for pattern in ("*.csv", "*.geojson", "*.json"):
+            filter_points.add_pattern(pattern)
+        dialog.add_filter(filter_points)
+
+        # Without it the points are expected in network coordinates
+        screen = Gtk.CheckButton(label="Points are in screen pixels at zoom 1")
+        dialog.set_extra_widget(screen)
+
+        response = dialog.run()
+        if response == Gtk.ResponseType.OK:
+            self.drawing_area.import_buildings(
+                dialog.get_filename(), screen.get_active()
+            )
+        dialog.destroy()
+
+    def on_export_counts(self, widget):
+        dialog = Gtk.FileChooserDialog(
+            title="Save file", parent=self.window, action=Gtk.FileChooserAction.SAVE
+        )
+        dialog.add_buttons(
+            Gtk.STOCK_CANCEL,
+            Gtk.ResponseType.CANCEL,
+            Gtk.STOCK_OK,
+            Gtk.ResponseType.OK,
+        )
+
+        filter_csv = Gtk.FileFilter()
+        filter_csv.set_name("CSV file")
+        filter_csv.add_pattern("*.csv")
+        dialog.add_filter(filter_csv)
+
+        (box, combo) = self._choice("Assign elements to:", list(AssignmentMode))
+        dialog.set_extra_widget(box)
+
+        response = dialog.run()
+        if response == Gtk.ResponseType.OK:
+            filename = dialog.get_filename()
+            if not filename.lower().endswith(".csv"):
+                filename += ".csv"
+            self.drawing_area.export_junction_counts(
+                filename, AssignmentMode(combo.get_active_text())
+            )
         dialog.destroy()
 
     def on_load_overlay(self, widget):
@@ -1,72 +1,174 @@
 import math
-from enum import Enum, unique
-from typing import Final, List, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, Final, Iterator, List, Optional, Tuple
 
-import wntr  # type: ignore
+import numpy as np
 
+from .draw_stats import DrawStats
+from .geometry import NetworkGeometry
+from .geometry_cache import GeometryCache
+from .inp_reader import read_geometry
+from .lod import LevelsOfDetail
+from .overlay import OVERLAY_TYPES, TYPE_CODES, OverlayStore, OverlayType
+from .spatial import BBox, PointIndex
 
-@unique
-class OverlayType(str, Enum):
-    HOUSE = "House"
-    APARTMENTS = "Apartments"
-    WHOLESALE = "Wholesale"
-    COMMERCIAL = "Commercial"
-    INSTITUTIONAL = "Institutional"
-    INDUSTRIAL = "Industrial"
-    OTHER = "Other"
+if TYPE_CHECKING:
+    import wntr  # type: ignore
 
+    from .tasks import BackgroundTask
+
+
+OVERLAY_COLORS: Final[Dict[OverlayType, Tuple[float, float, float]]] = {
+    t: (0.0, 0.7, 0.0) if t == OverlayType.HOUSE else (0.7, 0.0, 0.0)
+    for t in OverlayType
+}
+# Distinct overlay colours and the palette entry of every type code, so
+# elements can be grouped by colour with array operations
+_PALETTE: Final = sorted(set(OVERLAY_COLORS.values()))
+_PALETTE_INDEX: Final = np.array(
+    [_PALETTE.index(OVERLAY_COLORS[t]) for t in OVERLAY_TYPES], dtype=np.intp
+)
 
-class OverlayElement:
-    def __init__(
-        self, x: float, y: float, overlay_type: OverlayType = OverlayType.HOUSE
-    ):
-        self.x = x
-        self.y = y
-        self.type = overlay_type
+
+def _fill_circles(ctx, points: np.ndarray, radius: float, batched: bool) -> int:
+    if batched:
+        for (x, y) in points.tolist():
+            ctx.move_to(x + radius, y)
+            ctx.arc(x, y, radius, 0, 2 * math.pi)
+        ctx.fill()
+        return 1
+    for (x, y) in points.tolist():
+        ctx.arc(x, y, radius, 0, 2 * math.pi)
+        ctx.fill()
+    return len(points)
+
+
+def _stroke_segments(ctx, segments: np.ndarray, batched: bool) -> int:
+    if batched:
+        for ((x1, y1), (x2, y2)) in segments.tolist():
+            ctx.move_to(x1, y1)
+            ctx.line_to(x2, y2)
+        ctx.stroke()
+        return 1
+    for ((x1, y1), (x2, y2)) in segments.tolist():
+        ctx.move_to(x1, y1)
+        ctx.line_to(x2, y2)
+        ctx.stroke()
+    return len(segments)
 
 
 class Network:
     SIZE_FACTOR: Final = 1000
+    # Nodes closer than this many pixels are drawn as one when zoomed out
+    LOD_CELL_PIXELS: Final = 3
+    ELEMENT_RADIUS: Final = 5
+    SELECTION_RADIUS: Final = 8
+    # The overlay index splits the longer side of the network into this many
+    # cells
+    INDEX_CELLS: Final = 1024
 
     def __init__(
         self,
         *args,
         **kwargs,
     ):
-        self.wn: Optional[wntr.network.model.WaterNetworkModel] = None
+        self._filename: Optional[str] = None
+        self._wn: Optional["wntr.network.model.WaterNetworkModel"] = None
+        self._geometry: Optional[NetworkGeometry] = None
+        self._cache: Optional[GeometryCache] = None
         self._net_offset_x: float = 0.0
         self._net_offset_y: float = 0.0
         self._net_height: float = 0.0
         self._net_width: float = 0.0
-        self.elements: List[OverlayElement] = []
-
-    def load_network(self, filename: str) -> bool:
-        self.wn = wntr.network.WaterNetworkModel(filename)
-
-        first_node = True
-        for _, node in self.wn.nodes():
-            (x, y) = node.coordinates
-            if first_node:
-                self._net_offset_x = x
-                self._net_offset_y = y
-                self._net_width = x
-                self._net_height = y
-                first_node = False
-            if x < self._net_offset_x:
-                self._net_offset_x = x
-            if y < self._net_offset_y:
-                self._net_offset_y = y
-            if x > self._net_width:
-                self._net_width = x
-            if y > self._net_height:
-                self._net_height = y
-
-        self._net_width = self._net_width - self._net_offset_x
-        self._net_height = self._net_height - self._net_offset_y
+        self._node_coords: np.ndarray = np.empty((0, 2), dtype=np.float64)
+        self._pipe_nodes: np.ndarray = np.empty((0, 2), dtype=np.intp)
+        self._lod = LevelsOfDetail(self._node_coords, self._pipe_nodes, 0.0)
+        self._elements = OverlayStore()
+        self._element_index: Optional[PointIndex] = None
+        # Emit one path per style instead of one per primitive
+        self.batched: bool = True
+
+    def load_network(
+        self,
+        filename: str,
+        task: Optional["BackgroundTask"] = None,
+        cache: Optional[GeometryCache] = None,
+    ) -> bool:
+        self._filename = filename
+        self._wn = None
+        self._cache = cache
+        cached = cache.load(filename) if cache else None
+        if cached:
+            (self._geometry, self._lod) = cached
+        else:
+            self._geometry = read_geometry(filename, task)
+        self._node_coords = self._geometry.node_coords
+
+        if len(self._node_coords) == 0:
+            return False
+        (min_x, min_y, max_x, max_y) = self._geometry.bounds
+        self._net_offset_x = min_x
+        self._net_offset_y = min_y
+        self._net_width = max_x - min_x
+        self._net_height = max_y - min_y
+
+        if cached:
+            self._pipe_nodes = self._lod.levels[0].pipe_nodes
+        else:
+            if task:
+                task.check_cancelled()
+                task.report_progress(0.95, "Building detail levels")
+            self._pipe_nodes = self._geometry.pipe_nodes
+            self._lod = LevelsOfDetail(
+                self._node_coords,
+                self._pipe_nodes,
+                max(self._net_width, self._net_height),
+            )
+            if cache:
+                try:
+                    cache.store(filename, self._geometry, self._lod)
+                except OSError:
+                    # The cache only speeds up loading, failing to fill it
+                    # must not fail the load itself
+                    pass
         if self._net_height > 0.0 and self._net_width > 0.0:
             return True
         return False
 
+    @property
+    def filename(self) -> Optional[str]:
+        return self._filename
+
+    @property
+    def wn(self) -> Optional["wntr.network.model.WaterNetworkModel"]:
+        # Display and annotation only need the geometry, the full hydraulic
+        # model is parsed the first time something asks for it. Importing
+        # WNTR pulls in pandas, networkx, scipy and matplotlib, so even the
+        # import is deferred until then.
+        if self._wn is None and self._filename is not None:
+            import wntr  # type: ignore
+
+            self._wn = wntr.network.WaterNetworkModel(self._filename)
+        return self._wn
+
+    @property
+    def geometry(self) -> Optional[NetworkGeometry]:
+        # Names, kinds and vertices of all nodes and links. They are read
+        # again from the file, or the geometry cache, after release_model().
+        if self._geometry is None and self._filename is not None:
+            cached = self._cache.load(self._filename) if self._cache else None
+            if cached:
+                self._geometry = cached[0]
+            else:
+                self._geometry = read_geometry(self._filename)
+        return self._geometry
+
+    def release_model(self) -> None:
+        # Keeps only the arrays needed for drawing, hit testing and the
+        # coordinate transforms. The WNTR model and the full geometry are
+        # loaded again when they are asked for.
+        self._wn = None
+        self._geometry = None
+
     def get_dimensions(
         self, scale: float, offset_x: int, offset_y: int
     ) -> Tuple[int, int]:
@@ -76,48 +178,355 @@ class Network:
         )
         return (width, height)
 
+    def _transform(
+        self, scale: float, offset_x: float, offset_y: float
+    ) -> Tuple[float, float, float]:
+        # The net -> screen mapping is uniform in both axes with a flipped Y
+        # axis, so it reduces to screen = (net_x * k + b_x, b_y - net_y * k).
+        k = self.SIZE_FACTOR / self._net_width * scale
+        b_x = offset_x - self._net_offset_x * k
+        b_y = offset_y + (self._net_offset_y + self._net_height) * k
+        return (k, b_x, b_y)
+
+    def _net_to_screen(
+        self, points: np.ndarray, scale: float, offset_x: float, offset_y: float
+    ) -> np.ndarray:
+        (k, b_x, b_y) = self._transform(scale, offset_x, offset_y)
+        screen = np.empty(points.shape, dtype=np.float64)
+        np.multiply(points[..., 0], k, out=screen[..., 0])
+        screen[..., 0] += b_x
+        np.multiply(points[..., 1], -k, out=screen[..., 1])
+        screen[..., 1] += b_y
+        return screen
+
+    def _screen_to_net(
+        self, points: np.ndarray, scale: float, offset_x: float, offset_y: float
+    ) -> np.ndarray:
+        (k, b_x, b_y) = self._transform(scale, offset_x, offset_y)
+        net = np.empty(points.shape, dtype=np.float64)
+        net[..., 0] = (points[..., 0] - b_x) / k
+        net[..., 1] = (b_y - points[..., 1]) / k
+        return net
+
+    def _visible_bbox(
+        self, ctx, scale: float, offset_x: float, offset_y: float, margin: float
+    ) -> BBox:
+        (x1, y1, x2, y2) = ctx.clip_extents()
+        corners = self._screen_to_net(
+            np.array([[x1 - margin, y1 - margin], [x2 + margin, y2 + margin]]),
+            scale,
+            offset_x,
+            offset_y,
+        )
+        (min_x, min_y) = corners.min(axis=0).tolist()
+        (max_x, max_y) = corners.max(axis=0).tolist()
+        return (min_x, min_y, max_x, max_y)
+
     def _from_net_coords(self, net_x: float, net_y: float) -> Tuple[int, int]:
-        x = (net_x - self._net_offset_x) / self._net_width
-        y = (net_y - self._net_offset_y) / self._net_height
-        dim_y = self.SIZE_FACTOR * self._net_height / self._net_width
-        return (int(x * self.SIZE_FACTOR), int(dim_y - y * dim_y))
+        (x, y) = self._net_to_screen(np.array([net_x, net_y]), 1.0, 0, 0)
+        return (int(x), int(y))
 
     def _to_net_coords(self, x: int, y: int) -> Tuple[float, float]:
-        net_x = (x / self.SIZE_FACTOR) * self._net_width + self._net_offset_x
-        dim_y = self.SIZE_FACTOR * self._net_height / self._net_width
-        net_y = ((dim_y - y) / dim_y) * self._net_height + self._net_offset_y
-        return (net_x, net_y)
+        (net_x, net_y) = self._screen_to_net(np.array([x, y]), 1.0, 0, 0)
+        return (float(net_x), float(net_y))
+
+    def screen_to_net(self, points: np.ndarray) -> np.ndarray:
+        # _to_net_coords for an (n, 2) array of points
+        return self._screen_to_net(points, 1.0, 0, 0)
 
-    def add_overlay_element(self, x: int, y: int, overlay_type: OverlayType) -> None:
+    @property
+    def elements(self) -> OverlayStore:
+        return self._elements
+
+    @elements.setter
+    def elements(self, value: OverlayStore) -> None:
+        self._elements = value
+        self._element_index = None
+
+    def _index(self) -> PointIndex:
+        # Built on the first query; edits go to its delta part, which is
+        # merged back once it grows too big
+        xs = self._elements.xs
+        ys = self._elements.ys
+        if self._element_index is None:
+            cell = max(self._net_width, self._net_height) / self.INDEX_CELLS
+            self._element_index = PointIndex(cell, xs, ys)
+        elif self._element_index.needs_rebuild(len(self._elements)):
+            self._element_index.rebuild(xs, ys)
+        return self._element_index
+
+    def add_overlay_element(self, x: int, y: int, overlay_type: OverlayType) -> int:
         (net_x, net_y) = self._to_net_coords(x, y)
-        self.elements.append(OverlayElement(net_x, net_y, overlay_type))
+        element = len(self._elements)
+        self.insert_element(element, net_x, net_y, TYPE_CODES[overlay_type])
+        return element
 
-    def draw(self, ctx, scale: float, offset_x: int, offset_y: int) -> None:
+    def element_positions(
+        self, ids: np.ndarray, scale: float, offset_x: float, offset_y: float
+    ) -> np.ndarray:
+        return self._net_to_screen(
+            np.stack((self._elements.xs[ids], self._elements.ys[ids]), axis=1),
+            scale,
+            offset_x,
+            offset_y,
+        )
+
+    def find_elements(
+        self,
+        rect: Tuple[float, float, float, float],
+        scale: float,
+        offset_x: int,
+        offset_y: int,
+    ) -> np.ndarray:
+        # Elements whose centre lies in the screen rectangle (x1, y1, x2, y2)
+        corners = self._screen_to_net(
+            np.array([rect[:2], rect[2:]], dtype=np.float64), scale, offset_x, offset_y
+        )
+        (min_x, min_y) = corners.min(axis=0).tolist()
+        (max_x, max_y) = corners.max(axis=0).tolist()
+        return self._index().query(
+            (min_x, min_y, max_x, max_y), self._elements.xs, self._elements.ys
+        )
+
+    def hit_test(
+        self, x: float, y: float, scale: float, offset_x: int, offset_y: int
+    ) -> int:
+        # Topmost element drawn under the screen point, -1 if there is none
+        r = self.ELEMENT_RADIUS
+        ids = self.find_elements(
+            (x - r, y - r, x + r, y + r), scale, offset_x, offset_y
+        )
+        if len(ids) == 0:
+            return -1
+        points = self.element_positions(ids, scale, offset_x, offset_y)
+        distances = np.hypot(points[:, 0] - x, points[:, 1] - y)
+        hits = ids[distances <= r]
+        return int(hits.max()) if len(hits) else -1
+
+    def move_elements(
+        self, ids: np.ndarray, dx: float, dy: float, scale: float
+    ) -> None:
+        # dx, dy are in screen pixels
+        (k, _, _) = self._transform(scale, 0, 0)
+        self.place_elements(
+            ids, self._elements.xs[ids] + dx / k, self._elements.ys[ids] - dy / k
+        )
+
+    def place_elements(self, ids: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> None:
+        index = self._element_index
+        if index is not None and len(ids) > PointIndex.MIN_REBUILD:
+            self._element_index = index = None
+        if index is not None:
+            for (i, old_x, old_y, x, y) in zip(
+                ids.tolist(),
+                self._elements.xs[ids].tolist(),
+                self._elements.ys[ids].tolist(),
+                xs.tolist(),
+                ys.tolist(),
+            ):
+                index.remove(i, old_x, old_y)
+                index.insert(i, x, y)
+        self._elements.set_points(ids, xs, ys)
+
+    def remove_elements(self, ids: np.ndarray) -> List[Tuple[int, float, float, int]]:
+        # Every removal moves the last element into the freed slot, so the
+        # ids are processed from the highest down. Returns the removed
+        # elements in removal order.
+        return [
+            (i, *self.remove_element(i))
+            for i in sorted(set(ids.tolist()), reverse=True)
+        ]
+
+    def remove_element(self, element: int) -> Tuple[float, float, int]:
+        store = self._elements
+        index = self._element_index
+        last = len(store) - 1
+        if index is not None:
+            index.remove(element, store.xs[element], store.ys[element])
+            if element != last:
+                index.relabel(last, element, store.xs[last], store.ys[last])
+        return store.swap_remove(element)
+
+    def extend_elements(
+        self, xs: np.ndarray, ys: np.ndarray, codes: np.ndarray
+    ) -> None:
+        index = self._element_index
+        if index is not None and len(xs) > PointIndex.MIN_REBUILD:
+            self._element_index = index = None
+        first = len(self._elements)
+        self._elements.extend(xs, ys, codes)
+        if index is not None:
+            for (i, (x, y)) in enumerate(zip(xs.tolist(), ys.tolist()), first):
+                index.insert(i, x, y)
+
+    def insert_element(self, element: int, x: float, y: float, code: int) -> None:
+        # Exact inverse of remove_element(element)
+        store = self._elements
+        index = self._element_index
+        last = len(store)
+        if index is not None and element != last:
+            index.relabel(element, last, store.xs[element], store.ys[element])
+        store.swap_insert(element, x, y, code)
+        if index is not None:
+            index.insert(element, x, y)
+
+    def draw(
+        self,
+        ctx,
+        scale: float,
+        offset_x: int,
+        offset_y: int,
+        stats: Optional[DrawStats] = None,
+    ) -> None:
+        self.draw_network(ctx, scale, offset_x, offset_y, stats)
+        self.draw_overlay(ctx, scale, offset_x, offset_y, stats)
+
+    def draw_network(
+        self,
+        ctx,
+        scale: float,
+        offset_x: int,
+        offset_y: int,
+        stats: Optional[DrawStats] = None,
+        cell_pixels: float = LOD_CELL_PIXELS,
+    ) -> None:
+        # A larger `cell_pixels` draws a coarser level of detail
+        for _ in self.network_steps(
+            ctx, scale, offset_x, offset_y, stats, cell_pixels=cell_pixels
+        ):
+            pass
+
+    def network_steps(
+        self,
+        ctx,
+        scale: float,
+        offset_x: int,
+        offset_y: int,
+        stats: Optional[DrawStats] = None,
+        chunk: int = 0,
+        cell_pixels: float = LOD_CELL_PIXELS,
+    ) -> Iterator[None]:
+        # Draws the network in pieces of `chunk` primitives (0 for all at
+        # once) and pauses after every piece
         ctx.set_source_rgb(0.0, 0.0, 0.7)
         ctx.set_line_width(0.5)
 
-        for _, node in self.wn.nodes():  # type: ignore
-            (x, y) = self._from_net_coords(node.coordinates[0], node.coordinates[1])
-            ctx.arc(x * scale + offset_x, y * scale + offset_y, 5, 0, 2 * math.pi)
-            ctx.fill()
+        (k, _, _) = self._transform(scale, offset_x, offset_y)
+        level = self._lod.select(cell_pixels / k)
+        # Only primitives touching the clip region are emitted
+        visible = self._visible_bbox(ctx, scale, offset_x, offset_y, 6)
 
-        for _, pipe in self.wn.pipes():  # type: ignore
-            (x1, y1) = self._from_net_coords(
-                pipe.start_node.coordinates[0], pipe.start_node.coordinates[1]
-            )
-            (x2, y2) = self._from_net_coords(
-                pipe.end_node.coordinates[0], pipe.end_node.coordinates[1]
-            )
-            ctx.move_to(x1 * scale + offset_x, y1 * scale + offset_y)
-            ctx.line_to(x2 * scale + offset_x, y2 * scale + offset_y)
-            ctx.stroke()
+        nodes = level.node_coords[level.node_index.query(visible)]
+        points = self._net_to_screen(nodes, scale, offset_x, offset_y)
+        step = chunk or max(1, len(points))
+        for i in range(0, len(points), step):
+            fills = _fill_circles(ctx, points[i : i + step], 5, self.batched)
+            if stats is not None:
+                stats.fills += fills
+            yield
 
-        for e in self.elements:
-            if e.type == OverlayType.HOUSE:
-                ctx.set_source_rgb(0.0, 0.7, 0.0)
-            else:
-                ctx.set_source_rgb(0.7, 0.0, 0.0)
+        pipes = level.pipe_nodes[level.pipe_index.query(visible)]
+        segments = self._net_to_screen(
+            level.node_coords[pipes], scale, offset_x, offset_y
+        )
+        step = chunk or max(1, len(segments))
+        for i in range(0, len(segments), step):
+            strokes = _stroke_segments(ctx, segments[i : i + step], self.batched)
+            if stats is not None:
+                stats.strokes += strokes
+            yield
+
+        if stats is not None:
+            stats.primitives += len(points) + len(segments)
+            stats.source_changes += 1
+
+    def draw_overlay(
+        self,
+        ctx,
+        scale: float,
+        offset_x: int,
+        offset_y: int,
+        stats: Optional[DrawStats] = None,
+    ) -> None:
+        for _ in self.overlay_steps(ctx, scale, offset_x, offset_y, stats):
+            pass
 
-            (x, y) = self._from_net_coords(e.x, e.y)
-            ctx.arc(x * scale + offset_x, y * scale + offset_y, 5, 0, 2 * math.pi)
-            ctx.fill()
+    def overlay_steps(
+        self,
+        ctx,
+        scale: float,
+        offset_x: int,
+        offset_y: int,
+        stats: Optional[DrawStats] = None,
+        chunk: int = 0,
+    ) -> Iterator[None]:
+        # Draws the overlay in pieces of `chunk` elements (0 for all at once)
+        # and pauses after every piece
+        if not self.elements:
+            return
+        visible = self._visible_bbox(ctx, scale, offset_x, offset_y, 6)
+        # Small clip regions, as left by incremental repaints, only cost an
+        # index lookup. Sorting keeps the elements in drawing order.
+        inside = np.sort(
+            self._index().query(visible, self._elements.xs, self._elements.ys)
+        )
+        points = self.element_positions(inside, scale, offset_x, offset_y)
+        colors = _PALETTE_INDEX[self.elements.types[inside]]
+        step = chunk or max(1, len(points))
+
+        fills = source_changes = 0
+        if self.batched:
+            for color in np.unique(colors).tolist():
+                ctx.set_source_rgb(*_PALETTE[color])
+                same = points[colors == color]
+                for i in range(0, len(same), step):
+                    fills += _fill_circles(
+                        ctx, same[i : i + step], self.ELEMENT_RADIUS, True
+                    )
+                    yield
+            source_changes = len(np.unique(colors))
+        else:
+            for i in range(0, len(points), step):
+                for (color, (x, y)) in zip(
+                    colors[i : i + step].tolist(), points[i : i + step].tolist()
+                ):
+                    ctx.set_source_rgb(*_PALETTE[color])
+                    ctx.arc(x, y, self.ELEMENT_RADIUS, 0, 2 * math.pi)
+                    ctx.fill()
+                yield
+            fills = source_changes = len(points)
+
+        if stats is not None:
+            stats.primitives += len(points)
+            stats.fills += fills
+            stats.source_changes += source_changes
+
+    def draw_selection(
+        self,
+        ctx,
+        ids: np.ndarray,
+        scale: float,
+        offset_x: int,
+        offset_y: int,
+        dx: float = 0.0,
+        dy: float = 0.0,
+    ) -> None:
+        # Rings around the selected elements, shifted by dx, dy pixels while
+        # they are being dragged
+        if len(ids) == 0:
+            return
+        points = self.element_positions(ids, scale, offset_x + dx, offset_y + dy)
+        (x1, y1, x2, y2) = ctx.clip_extents()
+        r = self.SELECTION_RADIUS
+        inside = (
+            (points[:, 0] >= x1 - r)
+            & (points[:, 0] <= x2 + r)
+            & (points[:, 1] >= y1 - r)
+            & (points[:, 1] <= y2 + r)
+        )
+        ctx.set_source_rgb(1.0, 0.6, 0.0)
+        ctx.set_line_width(2)
+        for (x, y) in points[inside].tolist():
+            ctx.move_to(x + r, y)
+            ctx.arc(x, y, r, 0, 2 * math.pi)
+        ctx.stroke()
@@ -0,0 +1,186 @@
+from enum import Enum, unique
+from typing import Any, Dict, Final, Iterator, List, Tuple
+
+import numpy as np
+
+
+@unique
+class OverlayType(str, Enum):
+    HOUSE = "House"
+    APARTMENTS = "Apartments"
+    WHOLESALE = "Wholesale"
+    COMMERCIAL = "Commercial"
+    INSTITUTIONAL = "Institutional"
+    INDUSTRIAL = "Industrial"
+    OTHER = "Other"
+
+
+# Overlay types are stored as their position in OverlayType
+OVERLAY_TYPES: Final[List[OverlayType]] = list(OverlayType)
+TYPE_CODES: Final[Dict[OverlayType, int]] = {
+    t: code for (code, t) in enumerate(OVERLAY_TYPES)
+}
+
+
+class OverlayElement:
+    def __init__(
+        self, x: float, y: float, overlay_type: OverlayType = OverlayType.HOUSE
+    ):
+        self.x = x
+        self.y = y
+        self.type = overlay_type
+
+
+# Columnar storage of overlay elements: x/y coordinates in network units and
+# a one byte type code per element. The arrays grow geometrically, so
+# appending is amortized O(1).
+class OverlayStore:
+    INITIAL_CAPACITY: Final = 1024
+
+    def __init__(self):
+        self._x = np.empty(self.INITIAL_CAPACITY, dtype=np.float64)
+        self._y = np.empty(self.INITIAL_CAPACITY, dtype=np.float64)
+        self._types = np.empty(self.INITIAL_CAPACITY, dtype=np.uint8)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[OverlayElement]:
+        for i in range(self._size):
+            yield self[i]
+
+    def __getitem__(self, index: int) -> OverlayElement:
+        if not -self._size <= index < self._size:
+            raise IndexError("overlay element index out of range")
+        index %= self._size
+        return OverlayElement(
+            float(self._x[index]),
+            float(self._y[index]),
+            OVERLAY_TYPES[self._types[index]],
+        )
+
+    @property
+    def xs(self) -> np.ndarray:
+        return self._x[: self._size]
+
+    @property
+    def ys(self) -> np.ndarray:
+        return self._y[: self._size]
+
+    @property
+    def types(self) -> np.ndarray:
+        return self._types[: self._size]
+
+    def points(self) -> np.ndarray:
+        return np.stack((self.xs, self.ys), axis=1)
+
+    def _reserve(self, count: int) -> None:
+        capacity = len(self._x)
+        if count <= capacity:
+            return
+        capacity = max(count, 2 * capacity)
+        for name in ("_x", "_y", "_types"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[: self._size] = old[: self._size]
+            setattr(self, name, new)
+
+    def append(self, x: float, y: float, overlay_type: OverlayType) -> int:
+        index = self._size
+        self._reserve(index + 1)
+        self._x[index] = x
+        self._y[index] = y
+        self._types[index] = TYPE_CODES[overlay_type]
+        self._size += 1
+        return index
+
+    def extend(self, xs: np.ndarray, ys: np.ndarray, codes: np.ndarray) -> None:
+        count = len(xs)
+        self._reserve(self._size + count)
+        end = self._size + count
+        self._x[self._size : end] = xs
+        self._y[self._size : end] = ys
+        self._types[self._size : end] = codes
+        self._size = end
+
+    def swap_remove(self, index: int) -> Tuple[float, float, int]:
+        # Removes an element in O(1) by moving the last element into its slot
+        removed = (
+            float(self._x[index]),
+            float(self._y[index]),
+            int(self._types[index]),
+        )
+        last = self._size - 1
+        self._x[index] = self._x[last]
+        self._y[index] = self._y[last]
+        self._types[index] = self._types[last]
+        self._size = last
+        return removed
+
+    def swap_insert(self, index: int, x: float, y: float, code: int) -> None:
+        # Exact inverse of swap_remove(index)
+        self._reserve(self._size + 1)
+        last = self._size
+        self._x[last] = self._x[index]
+        self._y[last] = self._y[index]
+        self._types[last] = self._types[index]
+        self._x[index] = x
+        self._y[index] = y
+        self._types[index] = code
+        self._size += 1
+
+    def set_points(self, ids: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> None:
+        self._x[ids] = xs
+        self._y[ids] = ys
+
+    def clear(self) -> None:
+        self._size = 0
+
+    def select(self, overlay_type: OverlayType) -> np.ndarray:
+        return np.flatnonzero(self.types == TYPE_CODES[overlay_type])
+
+    def count_by_type(self) -> Dict[OverlayType, int]:
+        counts = np.bincount(self.types, minlength=len(OVERLAY_TYPES))
+        return {t: int(counts[code]) for (code, t) in enumerate(OVERLAY_TYPES)}
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        names = [t.value for t in OVERLAY_TYPES]
+        return [
+            {"x": x, "y": y, "type": names[code]}
+            for (x, y, code) in zip(
+                self.xs.tolist(), self.ys.tolist(), self.types.tolist()
+            )
+        ]
+
+    @classmethod
+    def from_arrays(
+        cls, xs: np.ndarray, ys: np.ndarray, types: np.ndarray
+    ) -> "OverlayStore":
+        # Uses the arrays as they are, e.g. memory mapped from a file. They
+        # are only copied once the store has to grow.
+        store = cls()
+        store._x = xs
+        store._y = ys
+        store._types = types
+        store._size = len(xs)
+        return store
+
+    @classmethod
+    def from_json(cls, elements: List[Any]) -> "OverlayStore":
+        valid = [
+            e
+            for e in elements
+            if isinstance(e, dict) and "x" in e and "y" in e and "type" in e
+        ]
+        store = cls()
+        store.extend(
+            np.fromiter((float(e["x"]) for e in valid), np.float64, len(valid)),
+            np.fromiter((float(e["y"]) for e in valid), np.float64, len(valid)),
+            np.fromiter(
+                (TYPE_CODES[OverlayType(e["type"])] for e in valid),
+                np.uint8,
+                len(valid),
+            ),
+        )
+        return store
@@ -0,0 +1,63 @@
+import struct
+import zlib
+from typing import BinaryIO, Final, Optional
+
+import numpy as np
+
+_SIGNATURE: Final = b"\x89PNG\r\n\x1a\n"
+
+
+# Writes an 8 bit RGB PNG row by row. The compressed data is emitted as a
+# series of IDAT chunks, so the image never has to be in memory as a whole.
+class PngWriter:
+    # Compressed bytes collected before an IDAT chunk is written
+    CHUNK_SIZE: Final = 1 << 20
+
+    def __init__(
+        self,
+        f: BinaryIO,
+        width: int,
+        height: int,
+        dpi: Optional[float] = None,
+        level: int = 6,
+    ):
+        self._f = f
+        self.width = width
+        self.height = height
+        self._rows = 0
+        self._compressor = zlib.compressobj(level)
+        self._pending = bytearray()
+        f.write(_SIGNATURE)
+        # 8 bits per channel, truecolour, no interlacing
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        if dpi:
+            per_metre = round(dpi / 0.0254)
+            self._chunk(b"pHYs", struct.pack(">IIB", per_metre, per_metre, 1))
+
+    def _chunk(self, kind: bytes, data: bytes) -> None:
+        self._f.write(struct.pack(">I", len(data)))
+        self._f.write(kind)
+        self._f.write(data)
+        self._f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def write_rows(self, rows: np.ndarray) -> None:
+        # rows: uint8 array of shape (n, width, 3)
+        (count, width, _) = rows.shape
+        if width != self.width or self._rows + count > self.height:
+            raise ValueError("Rows do not fit the image!")
+        # Every row starts with its filter type, 0 means unfiltered
+        filtered = np.zeros((count, 1 + 3 * width), dtype=np.uint8)
+        filtered[:, 1:] = rows.reshape(count, 3 * width)
+        self._pending += self._compressor.compress(filtered.tobytes())
+        self._rows += count
+        if len(self._pending) >= self.CHUNK_SIZE:
+            self._chunk(b"IDAT", bytes(self._pending))
+            self._pending.clear()
+
+    def close(self) -> None:
+        if self._rows != self.height:
+            raise ValueError(f"Only {self._rows} of {self.height} rows were written!")
+        self._pending += self._compressor.flush()
+        self._chunk(b"IDAT", bytes(self._pending))
+        self._pending.clear()
+        self._chunk(b"IEND", b"")
@@ -0,0 +1,149 @@
+import json
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Final, List, Optional, Tuple
+
+from .draw_stats import DrawStats
+from .layer_cache import Rect
+
+# Instrumentation of the drawing area's draw handler. Every frame is split
+# into one span per layer with the time spent on it and the primitives it
+# emitted; a layer served from its cache shows up as a span without draw
+# calls. While disabled, begin_layer() returns None and the layers are drawn
+# without statistics, so the only cost left is a few attribute lookups.
+
+
+class RenderProfiler:
+    # Frame times kept for the averages shown in the HUD
+    FRAME_HISTORY: Final = 120
+    # Trace events kept in memory, the oldest are dropped first
+    MAX_EVENTS: Final = 200_000
+    HUD_FONT_SIZE: Final = 12
+
+    def __init__(self):
+        self.enabled: bool = False
+        self._in_frame: bool = False
+        self._origin = time.perf_counter()
+        self._frame_start: float = 0.0
+        self._last_frame_start: Optional[float] = None
+        self._layer_start: float = 0.0
+        # Duration of the draw handler and time since the previous frame
+        self._frames: Deque[Tuple[float, float]] = deque(maxlen=self.FRAME_HISTORY)
+        # Layer name -> seconds and statistics of the last frame
+        self._layers: Dict[str, Tuple[float, DrawStats]] = {}
+        self._events: Deque[Dict[str, Any]] = deque(maxlen=self.MAX_EVENTS)
+
+    def reset(self) -> None:
+        self._in_frame = False
+        self._last_frame_start = None
+        self._frames.clear()
+        self._layers.clear()
+        self._events.clear()
+
+    def begin_frame(self) -> None:
+        if not self.enabled:
+            return
+        self._in_frame = True
+        self._frame_start = time.perf_counter()
+        self._layers = {}
+
+    def end_frame(self, clip: Rect) -> None:
+        if not self._in_frame:
+            return
+        self._in_frame = False
+        end = time.perf_counter()
+        interval = 0.0
+        if self._last_frame_start is not None:
+            interval = self._frame_start - self._last_frame_start
+        self._last_frame_start = self._frame_start
+        self._frames.append((end - self._frame_start, interval))
+        self._event("frame", self._frame_start, end, {"clip": list(clip)})
+
+    def begin_layer(self) -> Optional[DrawStats]:
+        # Statistics to pass to the layer's draw function, None outside of a
+        # profiled frame
+        if not self._in_frame:
+            return None
+        self._layer_start = time.perf_counter()
+        return DrawStats()
+
+    def end_layer(self, name: str, stats: Optional[DrawStats]) -> None:
+        if stats is None:
+            return
+        end = time.perf_counter()
+        stats.seconds = end - self._layer_start
+        self._layers[name] = (stats.seconds, stats)
+        self._event(
+            name,
+            self._layer_start,
+            end,
+            {
+                "primitives": stats.primitives,
+                "fills": stats.fills,
+                "strokes": stats.strokes,
+                "source_changes": stats.source_changes,
+            },
+        )
+
+    def _event(self, name: str, start: float, end: float, args: Dict) -> None:
+        # Complete event of the Chrome trace format, times in microseconds
+        self._events.append(
+            {
+                "name": name,
+                "cat": "render",
+                "ph": "X",
+                "ts": (start - self._origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": 0,
+                "args": args,
+            }
+        )
+
+    def summary(self) -> List[str]:
+        if not self._frames:
+            return ["No frames recorded"]
+        times = [t for (t, _) in self._frames]
+        intervals = [i for (_, i) in self._frames if i > 0]
+        lines = [
+            f"Frame {times[-1] * 1000:.1f} ms, "
+            f"avg {sum(times) / len(times) * 1000:.1f} ms, "
+            f"max {max(times) * 1000:.1f} ms"
+        ]
+        if intervals:
+            lines.append(f"{len(intervals) / sum(intervals):.1f} frames/s")
+        for (name, (seconds, stats)) in self._layers.items():
+            drawn = (
+                f"{stats.primitives} primitives, {stats.draw_calls} draw calls"
+                if stats.draw_calls
+                else "cached"
+            )
+            lines.append(f"{name}: {seconds * 1000:.1f} ms, {drawn}")
+        return lines
+
+    def draw_hud(self, ctx, x: float, y: float) -> None:
+        # Text box in the top left corner of the visible region at x, y
+        lines = self.summary()
+        ctx.save()
+        ctx.select_font_face("monospace")
+        ctx.set_font_size(self.HUD_FONT_SIZE)
+        line_height = self.HUD_FONT_SIZE * 1.4
+        width = max(ctx.text_extents(line)[4] for line in lines)
+        ctx.rectangle(x + 4, y + 4, width + 12, line_height * len(lines) + 8)
+        ctx.set_source_rgba(0.0, 0.0, 0.0, 0.7)
+        ctx.fill()
+        ctx.set_source_rgb(1.0, 1.0, 1.0)
+        for (i, line) in enumerate(lines):
+            ctx.move_to(x + 10, y + 8 + line_height * (i + 1) - 4)
+            ctx.show_text(line)
+        ctx.restore()
+
+    def hud_rect(self, x: int, y: int) -> Rect:
+        # Generous bound of the HUD box, repainted to keep it current
+        lines = 2 + max(3, len(self._layers))
+        return (x, y, 480, int(self.HUD_FONT_SIZE * 1.4 * lines) + 16)
+
+    def save_trace(self, filename: str) -> None:
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": list(self._events), "displayTimeUnit": "ms"}, f)
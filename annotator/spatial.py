@@ -0,0 +1,291 @@
+import math
+from typing import Any, Dict, Final, List, Tuple
+
+import numpy as np
+
+# min_x, min_y, max_x, max_y
+BBox = Tuple[float, float, float, float]
+
+
+def point_boxes(points: np.ndarray) -> np.ndarray:
+    return np.hstack((points, points))
+
+
+def segment_boxes(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    return np.hstack((np.minimum(starts, ends), np.maximum(starts, ends)))
+
+
+# Static uniform grid over axis aligned bounding boxes. Every cell stores the
+# items overlapping it in one flat array (cells are laid out row by row), so a
+# query only touches one contiguous slice per grid row.
+class GridIndex:
+    ITEMS_PER_CELL: Final = 8
+    # Items spanning more cells than this (e.g. very long pipes) are not
+    # registered per cell but checked on every query instead
+    MAX_ITEM_CELLS: Final = 64
+
+    def __init__(self, boxes: np.ndarray):
+        self._boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        count = len(self._boxes)
+        if count == 0:
+            self._origin = (0.0, 0.0)
+            self._extent = (0.0, 0.0, 0.0, 0.0)
+            self._cell = 1.0
+            self._cols = 1
+            self._rows = 1
+            self._starts = np.zeros(2, dtype=np.intp)
+            self._items = np.empty(0, dtype=np.intp)
+            self._large = np.empty(0, dtype=np.intp)
+            return
+
+        min_x = float(self._boxes[:, 0].min())
+        min_y = float(self._boxes[:, 1].min())
+        extent_x = float(self._boxes[:, 2].max()) - min_x
+        extent_y = float(self._boxes[:, 3].max()) - min_y
+        cells = max(1, count // self.ITEMS_PER_CELL)
+        if extent_x > 0.0 and extent_y > 0.0:
+            cell = math.sqrt(extent_x * extent_y / cells)
+        else:
+            cell = max(extent_x, extent_y) / cells
+        if cell <= 0.0:
+            cell = 1.0
+        self._origin = (min_x, min_y)
+        self._extent = (min_x, min_y, min_x + extent_x, min_y + extent_y)
+        self._cell = cell
+        self._cols = int(extent_x / cell) + 1
+        self._rows = int(extent_y / cell) + 1
+
+        (cx0, cy0, cx1, cy1) = self._cell_range(self._boxes)
+        widths = cx1 - cx0 + 1
+        spans = widths * (cy1 - cy0 + 1)
+        ids = np.arange(count, dtype=np.intp)
+        large = spans > self.MAX_ITEM_CELLS
+        self._large = ids[large]
+
+        small = ~large
+        ids = ids[small]
+        spans = spans[small]
+        total = int(spans.sum())
+        # Expand every item into one entry per covered cell
+        first = np.repeat(np.cumsum(spans) - spans, spans)
+        k = np.arange(total, dtype=np.intp) - first
+        w = np.repeat(widths[small], spans)
+        keys = (np.repeat(cy0[small], spans) + k // w) * self._cols + (
+            np.repeat(cx0[small], spans) + k % w
+        )
+        order = np.argsort(keys, kind="stable")
+        self._items = np.repeat(ids, spans)[order]
+        self._starts = np.zeros(self._cols * self._rows + 1, dtype=np.intp)
+        np.cumsum(
+            np.bincount(keys, minlength=self._cols * self._rows),
+            out=self._starts[1:],
+        )
+
+    def __len__(self) -> int:
+        return len(self._boxes)
+
+    def export(
+        self, prefix: str, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]
+    ) -> None:
+        arrays[prefix + "boxes"] = self._boxes
+        arrays[prefix + "starts"] = self._starts
+        arrays[prefix + "items"] = self._items
+        arrays[prefix + "large"] = self._large
+        meta[prefix + "grid"] = [
+            *self._origin,
+            *self._extent,
+            self._cell,
+            self._cols,
+            self._rows,
+        ]
+
+    @classmethod
+    def restore(
+        cls, prefix: str, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]
+    ) -> "GridIndex":
+        index = cls.__new__(cls)
+        index._boxes = arrays[prefix + "boxes"]
+        index._starts = arrays[prefix + "starts"]
+        index._items = arrays[prefix + "items"]
+        index._large = arrays[prefix + "large"]
+        grid = meta[prefix + "grid"]
+        index._origin = (grid[0], grid[1])
+        index._extent = (grid[2], grid[3], grid[4], grid[5])
+        index._cell = grid[6]
+        index._cols = int(grid[7])
+        index._rows = int(grid[8])
+        return index
+
+    def _cell_range(
+        self, boxes: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        (origin_x, origin_y) = self._origin
+
+        def cell(values: np.ndarray, origin: float, limit: int) -> np.ndarray:
+            index = np.floor((values - origin) / self._cell)
+            return np.clip(index, 0, limit - 1).astype(np.intp)
+
+        return (
+            cell(boxes[..., 0], origin_x, self._cols),
+            cell(boxes[..., 1], origin_y, self._rows),
+            cell(boxes[..., 2], origin_x, self._cols),
+            cell(boxes[..., 3], origin_y, self._rows),
+        )
+
+    def query(self, bbox: BBox) -> np.ndarray:
+        (min_x, min_y, max_x, max_y) = bbox
+        boxes = self._boxes
+        if len(boxes) == 0:
+            return np.empty(0, dtype=np.intp)
+        (ext_min_x, ext_min_y, ext_max_x, ext_max_y) = self._extent
+        if (
+            min_x <= ext_min_x
+            and min_y <= ext_min_y
+            and max_x >= ext_max_x
+            and max_y >= ext_max_y
+        ):
+            return np.arange(len(boxes), dtype=np.intp)
+
+        (cx0, cy0, cx1, cy1) = (
+            int(v) for v in self._cell_range(np.array(bbox, dtype=np.float64))
+        )
+        parts = [self._large]
+        for row in range(cy0, cy1 + 1):
+            first = row * self._cols
+            parts.append(
+                self._items[self._starts[first + cx0] : self._starts[first + cx1 + 1]]
+            )
+        candidates = np.concatenate(parts)
+        if len(candidates) > len(boxes) // 16:
+            # Deduplicating with a mask is cheaper than sorting big results
+            mask = np.zeros(len(boxes), dtype=bool)
+            mask[candidates] = True
+            candidates = np.flatnonzero(mask)
+        else:
+            candidates = np.unique(candidates)
+        found = boxes[candidates]
+        hit = (
+            (found[:, 0] <= max_x)
+            & (found[:, 2] >= min_x)
+            & (found[:, 1] <= max_y)
+            & (found[:, 3] >= min_y)
+        )
+        return candidates[hit]
+
+
+# Dynamic uniform grid over points identified by consecutive ids. Most points
+# live in a static part sorted by cell key; points inserted since the last
+# rebuild live in a per-cell dictionary and removed points leave a tombstone.
+# The static part is rebuilt once the dynamic part grows too large, which
+# keeps inserts and removals O(1) amortized.
+class PointIndex:
+    # Cell coordinates are packed into one int64 key
+    _STRIDE: Final = 1 << 31
+    _OFFSET: Final = 1 << 30
+    MIN_REBUILD: Final = 4096
+    # Queries spanning more cells than this scan all points instead
+    MAX_QUERY_CELLS: Final = 1 << 16
+
+    def __init__(self, cell: float, xs: np.ndarray, ys: np.ndarray):
+        self._cell = cell if cell > 0.0 else 1.0
+        self._keys = np.empty(0, dtype=np.int64)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._where = np.empty(0, dtype=np.int64)
+        self._delta: Dict[int, List[int]] = {}
+        self._delta_count = 0
+        self.rebuild(xs, ys)
+
+    def _cell_of(self, x: float, y: float) -> Tuple[int, int]:
+        return (math.floor(x / self._cell), math.floor(y / self._cell))
+
+    def _key(self, cx: int, cy: int) -> int:
+        return (cy + self._OFFSET) * self._STRIDE + cx + self._OFFSET
+
+    def rebuild(self, xs: np.ndarray, ys: np.ndarray) -> None:
+        cx = np.floor(xs / self._cell).astype(np.int64)
+        cy = np.floor(ys / self._cell).astype(np.int64)
+        keys = (cy + self._OFFSET) * self._STRIDE + cx + self._OFFSET
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._ids = order.astype(np.int64)
+        self._where = np.empty(max(len(xs), 16), dtype=np.int64)
+        self._where[order] = np.arange(len(order), dtype=np.int64)
+        self._where[len(xs) :] = -1
+        self._delta = {}
+        self._delta_count = 0
+
+    def _ensure_where(self, point_id: int) -> None:
+        if point_id >= len(self._where):
+            grown = np.full(max(point_id + 1, 2 * len(self._where)), -1, np.int64)
+            grown[: len(self._where)] = self._where
+            self._where = grown
+
+    def insert(self, point_id: int, x: float, y: float) -> None:
+        self._ensure_where(point_id)
+        self._where[point_id] = -1
+        self._delta.setdefault(self._key(*self._cell_of(x, y)), []).append(point_id)
+        self._delta_count += 1
+
+    def remove(self, point_id: int, x: float, y: float) -> None:
+        self._replace(point_id, -1, x, y)
+
+    def relabel(self, old_id: int, new_id: int, x: float, y: float) -> None:
+        self._replace(old_id, new_id, x, y)
+
+    def _replace(self, old_id: int, new_id: int, x: float, y: float) -> None:
+        position = int(self._where[old_id])
+        self._where[old_id] = -1
+        if new_id >= 0:
+            self._ensure_where(new_id)
+        if position >= 0:
+            self._ids[position] = new_id
+            if new_id >= 0:
+                self._where[new_id] = position
+            return
+        key = self._key(*self._cell_of(x, y))
+        ids = self._delta[key]
+        ids.remove(old_id)
+        if new_id >= 0:
+            ids.append(new_id)
+            self._where[new_id] = -1
+        else:
+            self._delta_count -= 1
+            if not ids:
+                del self._delta[key]
+
+    def needs_rebuild(self, count: int) -> bool:
+        return self._delta_count > max(self.MIN_REBUILD, count // 16)
+
+    def query(self, bbox: BBox, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        (min_x, min_y, max_x, max_y) = bbox
+        (cx0, cy0) = self._cell_of(min_x, min_y)
+        (cx1, cy1) = self._cell_of(max_x, max_y)
+        cells = (cx1 - cx0 + 1) * (cy1 - cy0 + 1)
+        if cells > self.MAX_QUERY_CELLS:
+            candidates = np.arange(len(xs), dtype=np.int64)
+        else:
+            parts = []
+            for cy in range(cy0, cy1 + 1):
+                first = np.searchsorted(self._keys, self._key(cx0, cy), "left")
+                last = np.searchsorted(self._keys, self._key(cx1, cy), "right")
+                parts.append(self._ids[first:last])
+            if self._delta:
+                if cells <= len(self._delta):
+                    for cy in range(cy0, cy1 + 1):
+                        for cx in range(cx0, cx1 + 1):
+                            ids = self._delta.get(self._key(cx, cy))
+                            if ids:
+                                parts.append(np.array(ids, dtype=np.int64))
+                else:
+                    low = self._key(cx0, cy0)
+                    high = self._key(cx1, cy1)
+                    for (key, ids) in self._delta.items():
+                        if low <= key <= high:
+                            cx = key % self._STRIDE - self._OFFSET
+                            if cx0 <= cx <= cx1:
+                                parts.append(np.array(ids, dtype=np.int64))
+            candidates = np.concatenate(parts) if parts else np.empty(0, np.int64)
+            candidates = candidates[candidates >= 0]
+        x = xs[candidates]
+        y = ys[candidates]
+        return candidates[(x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)]
@@ -0,0 +1,71 @@
+import builtins
+import sys
+import time
+from typing import Dict, List, Tuple
+
+# Keep this module free of heavy imports, it is loaded before anything else
+# when measuring the startup time.
+
+
+class StartupTimer:
+    def __init__(self):
+        self._start = time.perf_counter()
+        # Top level package -> time spent importing it, excluding the time
+        # spent in other packages it imported
+        self.imports: Dict[str, float] = {}
+        self.marks: List[Tuple[str, float]] = []
+        self._children: List[float] = []
+
+    def install(self) -> None:
+        original = builtins.__import__
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            package = name.partition(".")[0]
+            if level != 0 or package in sys.modules:
+                return original(name, globals, locals, fromlist, level)
+            self._children.append(0.0)
+            begin = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                elapsed = time.perf_counter() - begin
+                nested = self._children.pop()
+                self.imports[package] = self.imports.get(package, 0.0) + (
+                    elapsed - nested
+                )
+                if self._children:
+                    self._children[-1] += elapsed
+
+        builtins.__import__ = timed_import
+
+    def mark(self, label: str) -> None:
+        self.marks.append((label, time.perf_counter() - self._start))
+
+    def watch_first_frame(self, window) -> None:
+        # The report is printed once the window has been drawn for the first
+        # time, which is what the user perceives as the end of the startup.
+        from gi.repository import GLib  # type: ignore
+
+        def on_draw(widget, ctx):
+            widget.disconnect(handler)
+            GLib.idle_add(on_first_frame)
+            return False
+
+        def on_first_frame():
+            self.mark("first frame")
+            print(self.report(), file=sys.stderr)
+            return False
+
+        handler = window.connect_after("draw", on_draw)
+
+    def report(self, limit: int = 15) -> str:
+        lines = ["Startup timing", "  Imports (self time):"]
+        slowest = sorted(self.imports.items(), key=lambda item: -item[1])
+        for (package, seconds) in slowest[:limit]:
+            lines.append(f"    {seconds * 1000:9.1f} ms  {package}")
+        total = sum(self.imports.values())
+        lines.append(f"    {total * 1000:9.1f} ms  total")
+        lines.append("  Milestones:")
+        for (label, seconds) in self.marks:
+            lines.append(f"    {seconds * 1000:9.1f} ms  {label}")
+        return "\n".join(lines)
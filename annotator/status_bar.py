@@ -0,0 +1,73 @@
+from typing import Optional
+
+import gi  # type: ignore
+
+gi.require_version("Gtk", "3.0")
+from gi.repository import GLib, Gtk  # type: ignore
+
+from .tasks import BackgroundTask
+
+
+class StatusBar(Gtk.Box):
+    def __init__(self):
+        super().__init__(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
+        self.set_no_show_all(True)
+        self._task: Optional[BackgroundTask] = None
+        self._pulse_source: Optional[int] = None
+
+        self._label = Gtk.Label()
+        self._label.set_margin_left(10)
+        self._progress = Gtk.ProgressBar()
+        self._progress.set_valign(Gtk.Align.CENTER)
+        self._cancel = Gtk.Button(label="Cancel")
+        self._cancel.connect("clicked", self.on_cancel)
+        self._cancel.set_margin_top(3)
+        self._cancel.set_margin_bottom(3)
+
+        self.pack_start(self._label, False, False, 0)
+        self.pack_start(self._progress, True, True, 0)
+        self.pack_start(self._cancel, False, False, 5)
+
+    def track(self, task: BackgroundTask, text: str) -> None:
+        self._stop_pulse()
+        self._task = task
+        task.on_progress = lambda fraction, detail: self._on_progress(
+            task, fraction, detail
+        )
+        task.on_finished = self._on_finished
+        self._label.set_text(text)
+        self._progress.set_fraction(0.0)
+        self._progress.set_show_text(False)
+        self.show_all()
+
+    def _on_progress(self, task: BackgroundTask, fraction: float, text: str) -> None:
+        if task is not self._task:
+            return
+        # A negative fraction marks a step of unknown length
+        if fraction < 0.0:
+            if self._pulse_source is None:
+                self._pulse_source = GLib.timeout_add(100, self._pulse)
+        else:
+            self._stop_pulse()
+            self._progress.set_fraction(min(1.0, fraction))
+        self._progress.set_text(text)
+        self._progress.set_show_text(bool(text))
+
+    def _on_finished(self, task: BackgroundTask) -> None:
+        if task is self._task:
+            self._task = None
+            self._stop_pulse()
+            self.hide()
+
+    def _pulse(self) -> bool:
+        self._progress.pulse()
+        return True
+
+    def _stop_pulse(self) -> None:
+        if self._pulse_source is not None:
+            GLib.source_remove(self._pulse_source)
+            self._pulse_source = None
+
+    def on_cancel(self, button) -> None:
+        if self._task:
+            self._task.cancel()
@@ -0,0 +1,81 @@
+import threading
+import time
+from typing import Any, Callable, Final, Optional
+
+from gi.repository import GLib  # type: ignore
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+# Runs `work` in a worker thread. Progress, the result and errors are handed
+# back to the GTK main loop through GLib.idle_add; nothing is delivered once
+# the task has been cancelled.
+class BackgroundTask:
+    # Minimum delay between two progress updates posted to the main loop
+    PROGRESS_INTERVAL: Final = 0.05
+
+    def __init__(
+        self,
+        work: Callable[["BackgroundTask"], Any],
+        on_done: Callable[[Any], None],
+        on_error: Callable[[Exception], None],
+    ):
+        self._work = work
+        self._on_done = on_done
+        self._on_error = on_error
+        self.on_progress: Optional[Callable[[float, str], None]] = None
+        self.on_finished: Optional[Callable[["BackgroundTask"], None]] = None
+        self._cancelled = threading.Event()
+        self._last_progress = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def cancel(self) -> None:
+        if not self._cancelled.is_set():
+            self._cancelled.set()
+            GLib.idle_add(self._deliver_finished)
+
+    def check_cancelled(self) -> None:
+        if self._cancelled.is_set():
+            raise TaskCancelled()
+
+    def report_progress(self, fraction: float, text: str = "") -> None:
+        now = time.monotonic()
+        if now - self._last_progress < self.PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        GLib.idle_add(self._deliver_progress, fraction, text)
+
+    def _run(self) -> None:
+        try:
+            result = self._work(self)
+        except TaskCancelled:
+            return
+        except Exception as e:
+            GLib.idle_add(self._deliver, self._on_error, e)
+            return
+        GLib.idle_add(self._deliver, self._on_done, result)
+
+    def _deliver_progress(self, fraction: float, text: str) -> bool:
+        if not self.cancelled and self.on_progress:
+            self.on_progress(fraction, text)
+        return False
+
+    def _deliver(self, callback: Callable[[Any], None], value: Any) -> bool:
+        if not self.cancelled:
+            self._deliver_finished()
+            callback(value)
+        return False
+
+    def _deliver_finished(self) -> bool:
+        if self.on_finished:
+            self.on_finished(self)
+        return False
@@ -5,6 +5,7 @@ from gi.repository import Gtk  # type: ignore
 
 from .drawing_area import DrawingArea
 from .menu import MainMenu
+from .status_bar import StatusBar
 
 
 class MainWindow(Gtk.Window):
@@ -18,13 +19,15 @@ class MainWindow(Gtk.Window):
         self.box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         self.add(self.box)
 
-        drawing_area = DrawingArea(self)
+        status_bar = StatusBar()
+        drawing_area = DrawingArea(self, status_bar)
         main_menu = MainMenu(self, drawing_area)
         separator = Gtk.Separator(orientation=Gtk.Orientation.VERTICAL)
 
         self.box.pack_start(main_menu, False, False, 0)
         self.box.pack_start(separator, False, False, 0)
         self.box.pack_start(drawing_area, True, True, 0)
+        self.box.pack_start(status_bar, False, False, 0)
 
     def main(self):
         self.show_all()
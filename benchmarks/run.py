@@ -0,0 +1,292 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Final, List, Optional, Tuple
+
+import numpy as np
+
+from annotator.geometry_cache import GeometryCache
+from annotator.inp_reader import read_geometry
+from annotator.inpx import read_overlay, write_overlay
+from annotator.network import Network
+
+from .synthetic import make_overlay, write_inp
+
+DEFAULT_SIZES: Final = [1_000, 10_000, 100_000, 1_000_000]
+THRESHOLDS: Final = os.path.join(os.path.dirname(__file__), "thresholds.json")
+# JSON overlays are only timed up to this many elements, beyond that they
+# take minutes
+JSON_LIMIT: Final = 100_000
+# Stored thresholds leave this much headroom over the measured times
+THRESHOLD_HEADROOM: Final = 2.0
+HIT_TESTS: Final = 1000
+# Only timed when pycairo, and GdkPixbuf for the image, can be imported
+DRAW_STAGES: Final = (
+    "draw_network_full",
+    "draw_network_zoomed",
+    "draw_overlay_full",
+    "draw_overlay_zoomed",
+)
+IMAGE_STAGES: Final = ("image_pyramid_build",)
+VIEWPORT: Final = (1000, 800)
+
+# stage -> size -> seconds
+Results = Dict[str, Dict[str, float]]
+
+
+def _time(run: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _draw_stages(net: Network, repeat: int) -> Dict[str, float]:
+    try:
+        import cairo
+    except ImportError:
+        return {}
+
+    def draw(layer: Callable, scale: float, zoomed: bool) -> Callable[[], None]:
+        def run() -> None:
+            (width, height) = VIEWPORT
+            if not zoomed:
+                (width, height) = net.get_dimensions(scale, 0, 0)
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+            ctx = cairo.Context(surface)
+            if zoomed:
+                # Viewport in the middle of the network
+                (full_width, full_height) = net.get_dimensions(scale, 0, 0)
+                ctx.translate(-(full_width - width) / 2, -(full_height - height) / 2)
+            layer(ctx, scale, 0, 0)
+            surface.flush()
+
+        return run
+
+    return {
+        "draw_network_full": _time(draw(net.draw_network, 1.0, False), repeat),
+        "draw_network_zoomed": _time(draw(net.draw_network, 16.0, True), repeat),
+        "draw_overlay_full": _time(draw(net.draw_overlay, 1.0, False), repeat),
+        "draw_overlay_zoomed": _time(draw(net.draw_overlay, 16.0, True), repeat),
+    }
+
+
+def _image_stages(repeat: int) -> Dict[str, float]:
+    # The background image does not depend on the network size, it is timed
+    # once with a 8192 x 8192 pixel image
+    try:
+        import gi  # type: ignore
+
+        gi.require_version("GdkPixbuf", "2.0")
+        from gi.repository import GdkPixbuf  # type: ignore
+
+        from annotator.image_pyramid import ImagePyramid
+    except (ImportError, ValueError):
+        return {}
+    pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8, 8192, 8192)
+    pixbuf.fill(0x336699FF)
+    return {"image_pyramid_build": _time(lambda: ImagePyramid(pixbuf), repeat)}
+
+
+def run_size(size: int, directory: str, repeat: int) -> Dict[str, float]:
+    inp = os.path.join(directory, f"net-{size}.inp")
+    (width, height) = write_inp(inp, size)
+    results: Dict[str, float] = {}
+
+    results["inp_read"] = _time(lambda: read_geometry(inp), repeat)
+    results["load_network"] = _time(lambda: Network().load_network(inp), repeat)
+    cache = GeometryCache(os.path.join(directory, "cache"))
+    Network().load_network(inp, cache=cache)
+    results["load_network_cached"] = _time(
+        lambda: Network().load_network(inp, cache=cache), repeat
+    )
+
+    net = Network()
+    net.load_network(inp, cache=cache)
+    net.elements = make_overlay(size, width, height)
+    results.update(_draw_stages(net, repeat))
+
+    rng = np.random.default_rng(1)
+    (screen_width, screen_height) = net.get_dimensions(1.0, 0, 0)
+    points = rng.uniform(0, 1, (HIT_TESTS, 2)) * (screen_width, screen_height)
+
+    def build_index() -> None:
+        # Assigning the elements drops the index, the next query rebuilds it
+        net.elements = net.elements
+        net.hit_test(0, 0, 1.0, 0, 0)
+
+    results["element_index_build"] = _time(build_index, repeat)
+    results["hit_test_x1000"] = _time(
+        lambda: [net.hit_test(x, y, 1.0, 0, 0) for (x, y) in points.tolist()], repeat
+    )
+
+    overlay = os.path.join(directory, f"overlay-{size}.inpx")
+    results["overlay_save_binary"] = _time(
+        lambda: write_overlay(overlay, {}, net.elements, True), repeat
+    )
+    results["overlay_load_binary"] = _time(
+        lambda: _touch(read_overlay(overlay)[1]), repeat
+    )
+    if size <= JSON_LIMIT:
+        overlay_json = os.path.join(directory, f"overlay-{size}.json.inpx")
+        results["overlay_save_json"] = _time(
+            lambda: write_overlay(overlay_json, {}, net.elements, False), repeat
+        )
+        results["overlay_load_json"] = _time(lambda: read_overlay(overlay_json), repeat)
+    return results
+
+
+def _touch(store) -> None:
+    # Memory mapped arrays are only read when accessed, so a load includes
+    # one pass over the data as the renderer would do
+    float(store.xs.sum() + store.ys.sum())
+
+
+def compare(
+    results: Results, limits: Results, factor: float = 1.0
+) -> Tuple[List[str], List[str]]:
+    # Messages for every result slower than factor * limit, and for every
+    # result without a limit to compare it with
+    regressions = []
+    unchecked = []
+    for (stage, sizes) in results.items():
+        for (size, seconds) in sizes.items():
+            limit = limits.get(stage, {}).get(size)
+            if limit is None:
+                unchecked.append(f"{stage} [{size}]: {seconds * 1000:.1f} ms")
+            elif seconds > limit * factor:
+                regressions.append(
+                    f"{stage} [{size}]: {seconds * 1000:.1f} ms, "
+                    f"limit {limit * factor * 1000:.1f} ms"
+                )
+    return (regressions, unchecked)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run",
+        description="Time loading, drawing and saving synthetic networks and "
+        "overlays of increasing size.",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="numbers of nodes and overlay elements",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    parser.add_argument(
+        "-o", "--output", default="benchmark-results.json", help="results file"
+    )
+    parser.add_argument(
+        "--thresholds", default=THRESHOLDS, help="stored upper limits per stage"
+    )
+    parser.add_argument(
+        "--write-thresholds",
+        action="store_true",
+        help=f"store the results times {THRESHOLD_HEADROOM} as the new limits",
+    )
+    parser.add_argument(
+        "--compare", help="results file of an earlier run, e.g. the last commit"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="slowdown relative to --compare that counts as a regression",
+    )
+    parser.add_argument(
+        "--require-limits",
+        action="store_true",
+        help="fail if a result has no limit to compare it with, or a stage "
+        "could not be timed",
+    )
+    args = parser.parse_args()
+
+    results: Results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            print(f"{size} nodes / elements", file=sys.stderr)
+            for (stage, seconds) in run_size(size, directory, args.repeat).items():
+                results.setdefault(stage, {})[str(size)] = seconds
+                print(f"  {stage:24} {seconds * 1000:10.1f} ms", file=sys.stderr)
+        for (stage, seconds) in _image_stages(args.repeat).items():
+            results.setdefault(stage, {})["image"] = seconds
+            print(f"  {stage:24} {seconds * 1000:10.1f} ms", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "commit": _commit(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    regressions: List[str] = []
+    unchecked: List[str] = []
+    skipped = [s for s in DRAW_STAGES + IMAGE_STAGES if s not in results]
+    if args.write_thresholds:
+        # Stages skipped on this machine keep their stored limits
+        limits: Results = {}
+        if os.path.exists(args.thresholds):
+            with open(args.thresholds, "r", encoding="utf-8") as f:
+                limits = json.load(f)
+        for (stage, sizes) in results.items():
+            limits.setdefault(stage, {}).update(
+                (size, seconds * THRESHOLD_HEADROOM)
+                for (size, seconds) in sizes.items()
+            )
+        with open(args.thresholds, "w", encoding="utf-8") as f:
+            json.dump(limits, f, indent=2, sort_keys=True)
+            f.write("\n")
+    elif os.path.exists(args.thresholds):
+        with open(args.thresholds, "r", encoding="utf-8") as f:
+            (slower, missing) = compare(results, json.load(f))
+        regressions += slower
+        unchecked += [f"{m}, no limit in {args.thresholds}" for m in missing]
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)["results"]
+        (slower, missing) = compare(results, previous, 1.0 + args.tolerance)
+        regressions += slower
+        unchecked += [f"{m}, not in {args.compare}" for m in missing]
+
+    for stage in skipped:
+        print(f"SKIPPED {stage}: pycairo or GdkPixbuf is missing", file=sys.stderr)
+    for message in unchecked:
+        print(f"UNCHECKED {message}", file=sys.stderr)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    failed = regressions or (args.require_limits and (unchecked or skipped))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
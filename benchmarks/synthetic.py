@@ -0,0 +1,70 @@
+import math
+from typing import Final, Tuple
+
+import numpy as np
+
+from annotator.overlay import OVERLAY_TYPES, OverlayStore
+
+# Spacing of the generated street grid in network units
+GRID_SPACING: Final = 100.0
+
+
+def grid_shape(nodes: int) -> Tuple[int, int]:
+    columns = max(2, math.ceil(math.sqrt(nodes)))
+    return (columns, max(1, math.ceil(nodes / columns)))
+
+
+def write_inp(filename: str, nodes: int, seed: int = 0) -> Tuple[float, float]:
+    # Writes a network of `nodes` junctions on a jittered grid, connected to
+    # their right and lower neighbours and fed by one reservoir. Every tenth
+    # pipe has a vertex. Returns the width and height of the network.
+    rng = np.random.default_rng(seed)
+    (columns, rows) = grid_shape(nodes)
+    index = np.arange(nodes)
+    xs = (index % columns) * GRID_SPACING
+    ys = (index // columns) * GRID_SPACING
+    xs = xs + rng.uniform(-0.3, 0.3, nodes) * GRID_SPACING
+    ys = ys + rng.uniform(-0.3, 0.3, nodes) * GRID_SPACING
+
+    right = index[(index % columns < columns - 1) & (index + 1 < nodes)]
+    down = index[index + columns < nodes]
+    starts = np.concatenate((right, down))
+    ends = np.concatenate((right + 1, down + columns))
+
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(f"[TITLE]\nSynthetic grid network with {nodes} junctions\n\n")
+        f.write("[JUNCTIONS]\n;ID  Elevation  Demand\n")
+        for i in range(nodes):
+            f.write(f" J{i}  {10 + i % 7}  {0.1 * (i % 5):.1f}\n")
+        f.write("\n[RESERVOIRS]\n;ID  Head\n R0  120\n")
+        f.write(
+            "\n[PIPES]\n;ID  Node1  Node2  Length  Diameter  Roughness  MinorLoss  Status\n"
+        )
+        f.write(" P0  R0  J0  100  300  100  0  Open\n")
+        for (p, (a, b)) in enumerate(zip(starts.tolist(), ends.tolist()), 1):
+            f.write(f" P{p}  J{a}  J{b}  100  150  100  0  Open\n")
+        f.write("\n[OPTIONS]\n Units  LPS\n Headloss  H-W\n")
+        f.write("\n[COORDINATES]\n;Node  X-Coord  Y-Coord\n")
+        f.write(f" R0  {xs[0] - GRID_SPACING:.2f}  {ys[0]:.2f}\n")
+        for (i, (x, y)) in enumerate(zip(xs.tolist(), ys.tolist())):
+            f.write(f" J{i}  {x:.2f}  {y:.2f}\n")
+        f.write("\n[VERTICES]\n;Link  X-Coord  Y-Coord\n")
+        for p in range(1, len(starts) + 1, 10):
+            (a, b) = (starts[p - 1], ends[p - 1])
+            f.write(
+                f" P{p}  {(xs[a] + xs[b]) / 2 + 5:.2f}  {(ys[a] + ys[b]) / 2 + 5:.2f}\n"
+            )
+        f.write("\n[END]\n")
+    return (columns * GRID_SPACING, rows * GRID_SPACING)
+
+
+def make_overlay(elements: int, width: float, height: float, seed: int = 0):
+    # Elements spread uniformly over the network extent with random types
+    rng = np.random.default_rng(seed)
+    store = OverlayStore()
+    store.extend(
+        rng.uniform(0.0, width, elements),
+        rng.uniform(0.0, height, elements),
+        rng.integers(0, len(OVERLAY_TYPES), elements).astype(np.uint8),
+    )
+    return store
@@ -1,5 +1,20 @@
-from annotator.window import MainWindow
+import sys
+
+from annotator.startup import StartupTimer
 
 if __name__ == "__main__":
+    # Prints an import time breakdown and the time to the first frame
+    timer = None
+    if "--startup-timing" in sys.argv[1:]:
+        timer = StartupTimer()
+        timer.install()
+
+    from annotator.window import MainWindow
+
+    if timer:
+        timer.mark("modules imported")
     window = MainWindow()
+    if timer:
+        timer.mark("main window created")
+        timer.watch_first_frame(window)
     window.main()
@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from annotator.headless import FORMATS, RenderJob, render_batch, render_tiled
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Render networks with their overlay and background image "
+        "to PNG, PDF or SVG files without opening a window."
+    )
+    parser.add_argument("inp", nargs="?", help="INP file of a single job")
+    parser.add_argument("-o", "--output", help=f"output file ({', '.join(FORMATS)})")
+    parser.add_argument("--overlay", help="INPX file with the annotations")
+    parser.add_argument("--background", help="background image")
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="zoom factor of all layers"
+    )
+    parser.add_argument(
+        "--batch",
+        help="JSON file with a list of jobs, objects with the keys inp, output "
+        "and optionally overlay, background and scale",
+    )
+    parser.add_argument(
+        "--tiled",
+        action="store_true",
+        help="render PNG files tile by tile, for exports too large for memory",
+    )
+    parser.add_argument(
+        "--tile-size", type=int, default=1024, help="tile size in pixels"
+    )
+    parser.add_argument(
+        "--dpi",
+        type=float,
+        help="print resolution, scales the layers by DPI / 96 and is stored "
+        "in PNG files",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes (default: number of CPUs)",
+    )
+    args = parser.parse_args()
+    if not args.batch and not (args.inp and args.output):
+        parser.error("either INP and --output or --batch is required")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    jobs = []
+    if args.batch:
+        with open(args.batch, "r", encoding="utf-8") as f:
+            jobs = [RenderJob.from_dict(job) for job in json.load(f)]
+    if args.inp:
+        jobs.append(
+            RenderJob(args.inp, args.output, args.overlay, args.background, args.scale)
+        )
+    if args.dpi:
+        jobs = [job._replace(scale=job.scale * args.dpi / 96) for job in jobs]
+
+    def tiled_jobs():
+        # Every job uses the whole pool for its tiles
+        for job in jobs:
+            try:
+                yield (
+                    job,
+                    render_tiled(job, args.tile_size, args.jobs, args.dpi),
+                    None,
+                )
+            except Exception as e:
+                yield (job, None, e)
+
+    start = time.perf_counter()
+    failed = 0
+    pixels = 0
+    results = (
+        tiled_jobs() if args.tiled else render_batch(jobs, max(1, args.jobs), args.dpi)
+    )
+    for (job, result, error) in results:
+        if result is None:
+            failed += 1
+            print(f"FAILED {job.output}: {error}", file=sys.stderr)
+            continue
+        pixels += result.width * result.height
+        print(
+            f"{job.output}: {result.width}x{result.height}, "
+            f"{result.elements} elements, {result.seconds:.2f} s"
+        )
+    elapsed = time.perf_counter() - start
+    done = len(jobs) - failed
+    print(
+        f"{done} of {len(jobs)} jobs in {elapsed:.2f} s with {args.jobs} workers: "
+        f"{done / elapsed:.2f} jobs/s, {pixels / elapsed / 1e6:.1f} Mpx/s"
+    )
+    sys.exit(1 if failed else 0)
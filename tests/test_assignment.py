@@ -0,0 +1,258 @@
+import numpy as np
+import pytest
+
+from annotator import assignment
+from annotator.assignment import (
+    nearest_junctions,
+    nearest_pipe_junctions,
+    write_demands,
+)
+from annotator.geometry import LinkKind, NetworkGeometry, NodeKind
+from annotator.inp_reader import read_geometry
+from annotator.overlay import OVERLAY_TYPES, TYPE_CODES, OverlayType
+
+
+def _network(rng, nodes: int, pipes: int) -> NetworkGeometry:
+    # Mostly junctions with a few tanks and reservoirs, pipes with up to
+    # three vertices and some pumps and valves, which are never assigned to
+    kinds = rng.choice(
+        [NodeKind.JUNCTION, NodeKind.TANK, NodeKind.RESERVOIR],
+        nodes,
+        p=[0.8, 0.1, 0.1],
+    ).astype(np.uint8)
+    coords = rng.uniform(0, 1000, (nodes, 2))
+    links = pipes + pipes // 10
+    ends = np.stack([rng.choice(nodes, 2, replace=False) for _ in range(links)])
+    link_kinds = np.full(links, LinkKind.PIPE, dtype=np.uint8)
+    link_kinds[pipes:] = rng.choice([LinkKind.PUMP, LinkKind.VALVE], links - pipes)
+    rng.shuffle(link_kinds)
+    vertices = rng.choice(4, links, p=[0.5, 0.2, 0.2, 0.1])
+    offsets = np.concatenate(([0], np.cumsum(vertices)))
+    # Vertices spread around the straight line between the pipe ends
+    along = rng.uniform(0, 1, offsets[-1])
+    a = coords[np.repeat(ends[:, 0], vertices)]
+    b = coords[np.repeat(ends[:, 1], vertices)]
+    vertex_coords = a + along[:, None] * (b - a) + rng.normal(0, 20, (len(a), 2))
+    return NetworkGeometry(
+        [f"N{i}" for i in range(nodes)],
+        kinds,
+        coords,
+        [f"L{i}" for i in range(links)],
+        link_kinds,
+        ends,
+        offsets,
+        vertex_coords,
+    )
+
+
+def _points(rng, geometry: NetworkGeometry, count: int) -> np.ndarray:
+    # Random points, points close to nodes and vertices, and the nodes
+    # themselves, where several pipes are equally near
+    near = np.concatenate((geometry.node_coords, geometry.vertex_coords))
+    return np.concatenate(
+        (
+            rng.uniform(-100, 1100, (count, 2)),
+            near[rng.integers(0, len(near), count)] + rng.normal(0, 1, (count, 2)),
+            geometry.node_coords[: count // 4],
+        )
+    )
+
+
+def _brute_junctions(geometry: NetworkGeometry, points: np.ndarray) -> np.ndarray:
+    junctions = np.flatnonzero(geometry.node_kinds == NodeKind.JUNCTION)
+    coords = geometry.node_coords[junctions]
+    distances = np.hypot(*(points[:, None, :] - coords[None, :, :]).transpose(2, 0, 1))
+    return junctions[distances.argmin(axis=1)]
+
+
+def _polyline(geometry: NetworkGeometry, link: int) -> np.ndarray:
+    (start, end) = geometry.link_nodes[link]
+    vertices = geometry.vertex_coords[
+        geometry.vertex_offsets[link] : geometry.vertex_offsets[link + 1]
+    ]
+    return np.concatenate(
+        ([geometry.node_coords[start]], vertices, [geometry.node_coords[end]])
+    )
+
+
+def _brute_pipe_junctions(geometry: NetworkGeometry, points: np.ndarray):
+    # Every junction that an equally near pipe gives, as pipes meeting at a
+    # node are all at the same distance from it
+    pipes = np.flatnonzero(geometry.link_kinds == LinkKind.PIPE)
+    lines = [_polyline(geometry, link) for link in pipes]
+    a = np.concatenate([line[:-1] for line in lines])
+    b = np.concatenate([line[1:] for line in lines])
+    d = b - a
+    lengths = np.hypot(*d.T)
+    segments = [len(line) - 1 for line in lines]
+    segment_pipe = np.repeat(pipes, segments)
+    per_pipe = np.split(lengths, np.cumsum(segments)[:-1])
+    before = np.concatenate([np.cumsum(piece) - piece for piece in per_pipe])
+    pipe_length = dict(zip(pipes.tolist(), (piece.sum() for piece in per_pipe)))
+
+    # Points by segments
+    t = ((points[:, None, :] - a) * d).sum(axis=2) / np.where(
+        lengths > 0.0, lengths**2, 1.0
+    )
+    np.clip(t, 0.0, 1.0, out=t)
+    offsets = points[:, None, :] - a - t[:, :, None] * d
+    distances = np.hypot(offsets[:, :, 0], offsets[:, :, 1])
+    junction = geometry.node_kinds == NodeKind.JUNCTION
+    expected = []
+    for (row, ts) in zip(distances, t):
+        nearest = row.min()
+        options = set()
+        for segment in np.flatnonzero(row <= nearest + 1e-9 * (1 + nearest)).tolist():
+            link = int(segment_pipe[segment])
+            along = before[segment] + ts[segment] * lengths[segment]
+            ends = geometry.link_nodes[link]
+            (near, far) = ends if along * 2 <= pipe_length[link] else ends[::-1]
+            options.add(
+                int(near) if junction[near] else int(far) if junction[far] else -1
+            )
+        expected.append(options)
+    return expected
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_nearest_junctions_match_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    geometry = _network(rng, 300, 400)
+    points = _points(rng, geometry, 400)
+    np.testing.assert_array_equal(
+        nearest_junctions(geometry, points), _brute_junctions(geometry, points)
+    )
+
+
+# With a single candidate nearly every element needs the radius search
+@pytest.mark.parametrize("candidates", [1, assignment._CANDIDATES])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_nearest_pipe_junctions_match_brute_force(monkeypatch, seed, candidates):
+    monkeypatch.setattr(assignment, "_CANDIDATES", candidates)
+    rng = np.random.default_rng(seed)
+    geometry = _network(rng, 200, 300)
+    points = _points(rng, geometry, 200)
+    result = nearest_pipe_junctions(geometry, points)
+    for (i, options) in enumerate(_brute_pipe_junctions(geometry, points)):
+        assert result[i] in options, f"point {i} at {points[i]}"
+
+
+def test_nearest_pipe_junctions_with_few_samples():
+    # Fewer samples than candidates, one pipe ending at a tank and one
+    # between a tank and a reservoir
+    geometry = NetworkGeometry(
+        ["J1", "J2", "T1", "R1"],
+        [NodeKind.JUNCTION, NodeKind.JUNCTION, NodeKind.TANK, NodeKind.RESERVOIR],
+        [[0.0, 0.0], [10.0, 0.0], [20.0, 0.0], [20.0, 10.0]],
+        ["P1", "P2", "P3", "U1"],
+        [LinkKind.PIPE, LinkKind.PIPE, LinkKind.PIPE, LinkKind.PUMP],
+        [[0, 1], [2, 1], [2, 3], [0, 3]],
+        [0, 0, 1, 1, 1],
+        [[15.0, -5.0]],
+    )
+    points = np.array([[1.0, 1.0], [9.0, -1.0], [19.0, -1.0], [21.0, 5.0], [5, 9]])
+    np.testing.assert_array_equal(
+        nearest_pipe_junctions(geometry, points), [0, 1, 1, -1, 0]
+    )
+
+
+def test_nothing_to_assign_to():
+    geometry = NetworkGeometry(
+        ["T1", "R1"],
+        [NodeKind.TANK, NodeKind.RESERVOIR],
+        [[0.0, 0.0], [1.0, 1.0]],
+        ["U1"],
+        [LinkKind.PUMP],
+        [[0, 1]],
+    )
+    points = np.array([[0.5, 0.5], [2.0, 2.0]])
+    np.testing.assert_array_equal(nearest_junctions(geometry, points), [-1, -1])
+    np.testing.assert_array_equal(nearest_pipe_junctions(geometry, points), [-1, -1])
+    assert len(nearest_pipe_junctions(geometry, np.empty((0, 2)))) == 0
+
+
+INP = """[JUNCTIONS]
+;ID  Elev  Demand  Pattern
+ J1  10  1.5  P1 ; first
+ J2  12  2.0
+ J3  11  0.5
+
+[RESERVOIRS]
+ R1  100
+
+[PIPES]
+ P1  R1  J1  100  200  100  0  Open
+ P2  J1  J2  100  200  100  0  Open
+ P3  J2  J3  100  200  100  0  Open
+
+[DEMANDS]
+ J2  2.0  P2  ;Homes
+ J2  1.0      ;Shops
+
+[COORDINATES]
+ J1  0  0
+ J2  10  0
+ J3  20  0
+ R1  -10  0
+
+[END]
+"""
+
+
+def _sections(text: str):
+    sections = {}
+    name = ""
+    for line in text.splitlines():
+        tokens = line.split(";")[0].split()
+        if tokens and tokens[0].startswith("["):
+            name = tokens[0]
+        elif tokens:
+            sections.setdefault(name, []).append(tokens)
+    return sections
+
+
+def _write(tmp_path, replace: bool):
+    source = tmp_path / "network.inp"
+    source.write_text(INP)
+    destination = tmp_path / "demands.inp"
+    geometry = read_geometry(str(source))
+    counts = np.zeros((len(geometry.node_names), len(OVERLAY_TYPES)), np.int64)
+    for name in ("J1", "J2"):
+        counts[geometry.node_names.index(name), TYPE_CODES[OverlayType.HOUSE]] = 2
+    changed = write_demands(
+        str(source),
+        str(destination),
+        geometry,
+        counts,
+        {OverlayType.HOUSE: 0.25},
+        replace,
+    )
+    return (changed, _sections(destination.read_text()))
+
+
+def test_demands_are_added(tmp_path):
+    (changed, sections) = _write(tmp_path, False)
+    assert changed == 2
+    assert sections["[JUNCTIONS]"] == [
+        ["J1", "10", "2", "P1"],
+        ["J2", "12", "2.0"],
+        ["J3", "11", "0.5"],
+    ]
+    # J2 has demand categories, its base demand in [JUNCTIONS] has no effect
+    assert sections["[DEMANDS]"] == [
+        ["J2", "2.0", "P2"],
+        ["J2", "1.0"],
+        ["J2", "0.5", "P2"],
+    ]
+    assert sections["[COORDINATES]"][0] == ["J1", "0", "0"]
+
+
+def test_demands_are_replaced(tmp_path):
+    (changed, sections) = _write(tmp_path, True)
+    assert changed == 3
+    assert sections["[JUNCTIONS]"] == [
+        ["J1", "10", "0.5", "P1"],
+        ["J2", "12", "2.0"],
+        ["J3", "11", "0"],
+    ]
+    assert sections["[DEMANDS]"] == [["J2", "0.5", "P2"]]
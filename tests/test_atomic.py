@@ -0,0 +1,42 @@
+import os
+import stat
+
+import pytest
+
+from annotator.atomic import write_atomic
+
+
+def _mode(path) -> int:
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_new_file_follows_umask(tmp_path):
+    target = tmp_path / "new.bin"
+    write_atomic(str(target), lambda f: f.write(b"data"))
+    mask = os.umask(0o022)
+    os.umask(mask)
+    assert target.read_bytes() == b"data"
+    assert _mode(target) == 0o666 & ~mask
+
+
+def test_replaced_file_keeps_its_mode(tmp_path):
+    target = tmp_path / "old.bin"
+    target.write_bytes(b"old")
+    os.chmod(target, 0o640)
+    write_atomic(str(target), lambda f: f.write(b"new"))
+    assert target.read_bytes() == b"new"
+    assert _mode(target) == 0o640
+
+
+def test_failed_write_keeps_old_file(tmp_path):
+    target = tmp_path / "old.bin"
+    target.write_bytes(b"old")
+
+    def fail(f) -> None:
+        f.write(b"partial")
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        write_atomic(str(target), fail)
+    assert target.read_bytes() == b"old"
+    assert os.listdir(tmp_path) == ["old.bin"]
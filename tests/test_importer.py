@@ -0,0 +1,204 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+
+from annotator import importer
+from annotator.importer import ImportOptions, read_points
+from annotator.inpx import DEFAULT_ALIGNMENT, read_overlay, write_overlay
+from annotator.overlay import TYPE_CODES, OverlayStore, OverlayType
+
+
+def _feature(geometry, properties=None):
+    return {"type": "Feature", "geometry": geometry, "properties": properties}
+
+
+def _point(x, y, **properties):
+    return _feature({"type": "Point", "coordinates": [x, y]}, properties)
+
+
+def _read(tmp_path, content, options=ImportOptions()):
+    source = tmp_path / "buildings.geojson"
+    source.write_text(content if isinstance(content, str) else json.dumps(content))
+    return read_points(str(source), options)
+
+
+def _collection(*features, **members):
+    return {"type": "FeatureCollection", **members, "features": list(features)}
+
+
+# Blocks of a few bytes split keys, strings, escapes and nested values
+@pytest.mark.parametrize("block_size", [1, 2, 3, 5, 7, 64, 1 << 20])
+def test_tokens_split_across_blocks(tmp_path, monkeypatch, block_size):
+    monkeypatch.setattr(importer._JsonStream, "BLOCK_SIZE", block_size)
+    content = json.dumps(
+        _collection(
+            _point(1.25, -2.5, building="school", name='Café "\\u00e9"'),
+            _point(-1e-3, 12345.678, type="House"),
+            _feature(
+                {"type": "MultiPoint", "coordinates": [[0, 0, 7], [4, 2, 7]]},
+                {"category": "warehouse", "levels": [1, [2, {"a": None}]]},
+            ),
+            name="Buildings é",
+            crs={"type": "name", "properties": {"name": "EPSG:3857"}},
+        ),
+        indent=1,
+    )
+    (store, skipped) = _read(tmp_path, content)
+    assert skipped == 0
+    np.testing.assert_array_equal(store.xs, [1.25, -1e-3, 2.0])
+    np.testing.assert_array_equal(store.ys, [-2.5, 12345.678, 1.0])
+    np.testing.assert_array_equal(
+        store.types,
+        [
+            TYPE_CODES[OverlayType.INSTITUTIONAL],
+            TYPE_CODES[OverlayType.HOUSE],
+            TYPE_CODES[OverlayType.INDUSTRIAL],
+        ],
+    )
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 1 << 20])
+def test_plain_array_and_members_after_features(tmp_path, monkeypatch, block_size):
+    monkeypatch.setattr(importer._JsonStream, "BLOCK_SIZE", block_size)
+    (store, _) = _read(tmp_path, [_point(1, 2), _point(3, 4)])
+    np.testing.assert_array_equal(store.xs, [1, 3])
+    content = json.dumps(_collection(_point(5, 6)))[:-1] + ', "bbox": [0, 0]}'
+    (store, _) = _read(tmp_path, content)
+    np.testing.assert_array_equal(store.xs, [5])
+    (store, _) = _read(tmp_path, {"type": "FeatureCollection"})
+    assert len(store) == 0
+
+
+# L-shaped polygon of area 3, once counter-clockwise and once clockwise
+L_SHAPE = [[0, 0], [2, 0], [2, 1], [1, 1], [1, 2], [0, 2], [0, 0]]
+
+
+@pytest.mark.parametrize("ring", [L_SHAPE, L_SHAPE[::-1]])
+def test_polygon_centroid(tmp_path, ring):
+    # The hole does not move the centroid
+    hole = [[0.2, 0.2], [0.4, 0.2], [0.4, 0.4], [0.2, 0.2]]
+    geometry = {"type": "Polygon", "coordinates": [ring, hole]}
+    (store, _) = _read(tmp_path, _collection(_feature(geometry)))
+    np.testing.assert_allclose(store.points(), [[2.5 / 3, 2.5 / 3]])
+
+
+def test_multipolygon_centroid_is_area_weighted(tmp_path):
+    big = [[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]]
+    small = [[10, 0], [11, 0], [11, 1], [10, 1], [10, 0]]
+    geometry = {"type": "MultiPolygon", "coordinates": [[big], [small], []]}
+    (store, _) = _read(tmp_path, _collection(_feature(geometry)))
+    np.testing.assert_allclose(store.points(), [[2.9, 0.9]])
+
+
+def test_degenerate_polygon_uses_mean_of_points(tmp_path):
+    line = [[0, 0], [2, 2], [4, 4], [0, 0]]
+    geometry = {"type": "Polygon", "coordinates": [line]}
+    (store, _) = _read(tmp_path, _collection(_feature(geometry)))
+    np.testing.assert_allclose(store.points(), [[1.5, 1.5]])
+
+
+def test_malformed_features_are_skipped(tmp_path):
+    features = [
+        _point(1, 2),
+        "not a feature",
+        _feature(None),
+        _feature({"type": "Point", "coordinates": None}),
+        _feature({"type": "Point", "coordinates": ["a", 1]}),
+        _feature({"type": "LineString", "coordinates": [[0, 0], [1, 1]]}),
+        _feature({"type": "MultiPoint", "coordinates": []}),
+        _feature({"type": "Polygon", "coordinates": [[[0, 0], [1]]]}),
+        _point(float("nan"), 1),
+        _point(3, 4),
+    ]
+    content = json.dumps(_collection(*features))
+    (store, skipped) = _read(tmp_path, content)
+    assert skipped == len(features) - 2
+    np.testing.assert_array_equal(store.xs, [1, 3])
+
+
+def test_unmapped_types(tmp_path):
+    features = [_point(0, 0, building="yes"), _point(1, 1, kind="house")]
+    (store, skipped) = _read(tmp_path, _collection(*features))
+    assert skipped == 0
+    assert store.types.tolist() == [TYPE_CODES[OverlayType.OTHER]] * 2
+    options = ImportOptions(type_field="kind", default=None)
+    (store, skipped) = _read(tmp_path, _collection(*features), options)
+    assert skipped == 1
+    assert store.types.tolist() == [TYPE_CODES[OverlayType.HOUSE]]
+
+
+def test_invalid_top_level_value(tmp_path):
+    with pytest.raises(ValueError, match="FeatureCollection"):
+        _read(tmp_path, '"features"')
+
+
+# Numbers outside of features are decoded on their own and may be cut after
+# any character, e.g. between "1e" and "5"
+@pytest.mark.parametrize("block_size", range(1, 24))
+def test_numbers_split_across_blocks(tmp_path, monkeypatch, block_size):
+    monkeypatch.setattr(importer._JsonStream, "BLOCK_SIZE", block_size)
+    content = (
+        '{"count": 1e5, "scale": -0.25E-2, "features": ['
+        + json.dumps(_point(1.5, 2))
+        + '], "total": 12.5e+3}'
+    )
+    (store, skipped) = _read(tmp_path, content)
+    assert skipped == 0
+    np.testing.assert_array_equal(store.points(), [[1.5, 2.0]])
+
+
+@pytest.mark.parametrize("properties", ["house", ["type", "House"], 5, True])
+def test_properties_that_are_not_objects_are_skipped(tmp_path, properties):
+    features = [_point(1, 2), _feature({"type": "Point", "coordinates": [3, 4]})]
+    features[1]["properties"] = properties
+    (store, skipped) = _read(tmp_path, _collection(*features))
+    assert skipped == 1
+    np.testing.assert_array_equal(store.xs, [1])
+
+
+def test_multipolygon_with_clockwise_parts(tmp_path):
+    big = [[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]]
+    small = [[10, 0], [10, 1], [11, 1], [11, 0], [10, 0]]
+    geometry = {"type": "MultiPolygon", "coordinates": [[big], [small]]}
+    (store, _) = _read(tmp_path, _collection(_feature(geometry)))
+    np.testing.assert_allclose(store.points(), [[2.9, 0.9]])
+
+
+def _run(monkeypatch, *args: str) -> None:
+    monkeypatch.setattr(sys, "argv", ["importer", *args])
+    importer.main()
+
+
+def test_cli_creates_loadable_overlay(tmp_path, monkeypatch):
+    source = tmp_path / "buildings.csv"
+    source.write_text("x,y,type\n1.5,2.5,detached\n3,4,school\n,5,house\n")
+    overlay = tmp_path / "overlay.inpx"
+    _run(monkeypatch, str(source), str(overlay))
+
+    (alignment, store) = read_overlay(str(overlay))
+    assert alignment == DEFAULT_ALIGNMENT
+    assert store is not None
+    np.testing.assert_array_equal(store.xs, [1.5, 3.0])
+    np.testing.assert_array_equal(store.ys, [2.5, 4.0])
+    np.testing.assert_array_equal(
+        store.types,
+        [TYPE_CODES[OverlayType.HOUSE], TYPE_CODES[OverlayType.INSTITUTIONAL]],
+    )
+
+
+def test_cli_extends_existing_overlay(tmp_path, monkeypatch):
+    overlay = tmp_path / "overlay.inpx"
+    alignment = {**DEFAULT_ALIGNMENT, "scale_net": 2.5, "offset_img_x": 10.0}
+    existing = OverlayStore()
+    existing.append(7.0, 8.0, OverlayType.OTHER)
+    write_overlay(str(overlay), alignment, existing)
+    source = tmp_path / "buildings.csv"
+    source.write_text("x,y\n1,2\n")
+    _run(monkeypatch, str(source), str(overlay))
+
+    (loaded, store) = read_overlay(str(overlay))
+    assert loaded == alignment
+    assert store is not None
+    np.testing.assert_array_equal(store.xs, [7.0, 1.0])
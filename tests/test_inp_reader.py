@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+
+from annotator.geometry import LinkKind, NetworkGeometry, NodeKind
+from annotator.inp_reader import read_geometry
+
+# Sections in an unusual order, lower case headers, comments, tabs and
+# sections the reader has to skip
+INP = """\
+[TITLE]
+Small network ; with a comment
+
+[vertices]
+;Link  X-Coord  Y-Coord
+P2      15.0    25.0
+V1      31.0    1.0
+P2      17.5    27.5
+Gone    1.0     1.0
+
+[JUNCTIONS]
+;ID  Elev  Demand
+J1    10    1.5 ;first
+J2\t12\t0
+J3    14    2
+
+[RESERVOIRS]
+R1    100
+
+[TANKS]
+T1    50    3    0    10    20    0
+
+[PIPES]
+P1    R1    J1    100    300    100    0    Open
+P2    J1    J2    100    300    100    0    Open ; bends twice
+P3    J2    T1    100    300    100    0    Open
+
+[PUMPS]
+U1    J2    J3    HEAD Curve1
+
+[VALVES]
+V1    J3    T1    300    PRV    40    0
+
+[CURVES]
+Curve1    100    50
+
+[COORDINATES]
+J1    10.0    20.0
+J2    20.0    30.0
+J3    30.0    0.0
+R1    -5.0    20.0
+T1    40.0    -10.0
+Unknown    1.0    1.0
+
+[END]
+"""
+
+
+@pytest.fixture
+def geometry(tmp_path) -> NetworkGeometry:
+    path = tmp_path / "network.inp"
+    path.write_text(INP)
+    return read_geometry(str(path))
+
+
+def test_nodes(geometry):
+    assert geometry.node_names == ["J1", "J2", "J3", "R1", "T1"]
+    np.testing.assert_array_equal(
+        geometry.node_kinds,
+        [NodeKind.JUNCTION] * 3 + [NodeKind.RESERVOIR, NodeKind.TANK],
+    )
+    np.testing.assert_array_equal(
+        geometry.node_coords,
+        [[10.0, 20.0], [20.0, 30.0], [30.0, 0.0], [-5.0, 20.0], [40.0, -10.0]],
+    )
+    assert geometry.bounds == (-5.0, -10.0, 40.0, 30.0)
+
+
+def test_links(geometry):
+    assert geometry.link_names == ["P1", "P2", "P3", "U1", "V1"]
+    np.testing.assert_array_equal(
+        geometry.link_kinds,
+        [LinkKind.PIPE] * 3 + [LinkKind.PUMP, LinkKind.VALVE],
+    )
+    np.testing.assert_array_equal(
+        geometry.link_nodes, [[3, 0], [0, 1], [1, 4], [1, 2], [2, 4]]
+    )
+    np.testing.assert_array_equal(geometry.pipe_nodes, [[3, 0], [0, 1], [1, 4]])
+
+
+def test_vertices(geometry):
+    np.testing.assert_array_equal(geometry.vertex_offsets, [0, 0, 2, 2, 2, 3])
+    # In file order per link; vertices of unknown links are dropped
+    np.testing.assert_array_equal(
+        geometry.vertex_coords, [[15.0, 25.0], [17.5, 27.5], [31.0, 1.0]]
+    )
+
+
+def test_export_restore(geometry):
+    arrays = {}
+    meta = {}
+    geometry.export(arrays, meta)
+    restored = NetworkGeometry.restore(arrays, meta)
+    assert restored.node_names == geometry.node_names
+    assert restored.link_names == geometry.link_names
+    for name in (
+        "node_kinds",
+        "node_coords",
+        "link_kinds",
+        "link_nodes",
+        "vertex_offsets",
+        "vertex_coords",
+    ):
+        np.testing.assert_array_equal(getattr(restored, name), getattr(geometry, name))
+    assert restored.bounds == geometry.bounds
+
+
+def test_missing_coordinates_default_to_origin(tmp_path):
+    path = tmp_path / "network.inp"
+    path.write_text("[JUNCTIONS]\nA 1\nB 2\n[PIPES]\nP A B 1 1 1\n")
+    geometry = read_geometry(str(path))
+    np.testing.assert_array_equal(geometry.node_coords, np.zeros((2, 2)))
+    np.testing.assert_array_equal(geometry.vertex_offsets, [0, 0])
+    assert geometry.vertex_coords.shape == (0, 2)
+
+
+def test_unknown_link_end_is_rejected(tmp_path):
+    path = tmp_path / "network.inp"
+    path.write_text("[JUNCTIONS]\nA 1\n[PUMPS]\nU A Missing HEAD C\n")
+    with pytest.raises(ValueError, match="U refers to unknown node Missing"):
+        read_geometry(str(path))
@@ -0,0 +1,148 @@
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+import pytest
+
+from annotator import inpx
+from annotator.inpx import (
+    DEFAULT_ALIGNMENT,
+    is_binary,
+    read_overlay,
+    write_overlay,
+)
+from annotator.overlay import OVERLAY_TYPES, OverlayStore
+
+ALIGNMENT = {
+    "offset_img_x": -12.5,
+    "offset_img_y": 3.0,
+    "scale_img": 0.25,
+    "offset_net_x": 1e6,
+    "offset_net_y": -7.125,
+    "scale_net": 3.5,
+}
+
+
+def _store(count: int) -> OverlayStore:
+    rng = np.random.default_rng(count)
+    xs = rng.normal(0, 1e6, count)
+    ys = rng.normal(0, 1e-3, count)
+    if count:
+        (xs[0], ys[0]) = (-0.0, 5e-324)
+    return OverlayStore.from_arrays(
+        xs, ys, rng.integers(0, len(OVERLAY_TYPES), count).astype(np.uint8)
+    )
+
+
+def _assert_same(store: OverlayStore, expected: OverlayStore) -> None:
+    assert len(store) == len(expected)
+    np.testing.assert_array_equal(store.xs, expected.xs)
+    np.testing.assert_array_equal(store.ys, expected.ys)
+    np.testing.assert_array_equal(store.types, expected.types)
+
+
+@pytest.mark.parametrize("binary", [False, True])
+@pytest.mark.parametrize("count", [0, 1, 1000])
+def test_round_trip(tmp_path, binary, count):
+    path = str(tmp_path / "overlay.inpx")
+    store = _store(count)
+    write_overlay(path, ALIGNMENT, store, binary)
+
+    assert is_binary(path) == binary
+    (alignment, loaded) = read_overlay(path)
+    assert alignment == ALIGNMENT
+    assert loaded is not None
+    _assert_same(loaded, store)
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_missing_alignment_uses_defaults(tmp_path, binary):
+    path = str(tmp_path / "overlay.inpx")
+    write_overlay(path, {"scale_net": 2.0}, _store(3), binary)
+
+    (alignment, _) = read_overlay(path)
+    assert alignment == {**DEFAULT_ALIGNMENT, "scale_net": 2.0}
+
+
+def test_overwrite_keeps_mapped_store_valid(tmp_path):
+    path = str(tmp_path / "overlay.inpx")
+    write_overlay(path, ALIGNMENT, _store(100), True)
+    (_, mapped) = read_overlay(path)
+    assert mapped is not None
+    expected = OverlayStore.from_arrays(
+        mapped.xs.copy(), mapped.ys.copy(), mapped.types.copy()
+    )
+    # Saving the mapped store over its own file, as the autosave does
+    mapped.append(1.0, 2.0, OVERLAY_TYPES[0])
+    expected.append(1.0, 2.0, OVERLAY_TYPES[0])
+    write_overlay(path, ALIGNMENT, mapped, True)
+
+    (_, loaded) = read_overlay(path)
+    assert loaded is not None
+    _assert_same(loaded, expected)
+
+
+@pytest.mark.parametrize("scale", [0.0, -1.0, float("nan")])
+def test_write_rejects_invalid_scale(tmp_path, scale):
+    path = str(tmp_path / "overlay.inpx")
+    with pytest.raises(Exception, match="scale_img"):
+        write_overlay(path, {**ALIGNMENT, "scale_img": scale}, _store(1))
+    assert not os.path.exists(path)
+
+
+@pytest.mark.parametrize("scale", [0.0, -1.0])
+def test_read_rejects_invalid_scale(tmp_path, scale):
+    path = tmp_path / "overlay.inpx"
+    path.write_text(json.dumps({**ALIGNMENT, "scale_net": scale, "elements": []}))
+    with pytest.raises(Exception, match="scale_net"):
+        read_overlay(str(path))
+
+    # Binary files written before the defaults existed have zero scales
+    with open(path, "wb") as f:
+        inpx._write_binary(f, {**ALIGNMENT, "scale_net": scale}, _store(2))
+    with pytest.raises(Exception, match="scale_net"):
+        read_overlay(str(path))
+
+
+def test_read_rejects_truncated_binary(tmp_path):
+    path = str(tmp_path / "overlay.inpx")
+    write_overlay(path, ALIGNMENT, _store(10), True)
+    os.truncate(path, os.path.getsize(path) - 1)
+    with pytest.raises(Exception, match="Truncated"):
+        read_overlay(path)
+
+
+def test_read_rejects_other_version(tmp_path):
+    path = str(tmp_path / "overlay.inpx")
+    write_overlay(path, ALIGNMENT, _store(1), True)
+    with open(path, "r+b") as f:
+        f.seek(4)
+        f.write(struct.pack("<I", inpx.VERSION + 1))
+    with pytest.raises(Exception, match="version"):
+        read_overlay(path)
+
+
+def test_json_without_elements_has_no_store(tmp_path):
+    path = tmp_path / "overlay.inpx"
+    path.write_text(json.dumps({"scale_img": 2.0}))
+    (alignment, store) = read_overlay(str(path))
+    assert alignment == {"scale_img": 2.0}
+    assert store is None
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_converter_writes_other_format(tmp_path, monkeypatch, binary):
+    source = str(tmp_path / "source.inpx")
+    destination = str(tmp_path / "destination.inpx")
+    store = _store(50)
+    write_overlay(source, ALIGNMENT, store, binary)
+    monkeypatch.setattr(sys, "argv", ["inpx", source, destination])
+    inpx.main()
+
+    assert is_binary(destination) != binary
+    (alignment, loaded) = read_overlay(destination)
+    assert alignment == ALIGNMENT
+    assert loaded is not None
+    _assert_same(loaded, store)
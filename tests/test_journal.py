@@ -0,0 +1,175 @@
+import os
+
+import numpy as np
+import pytest
+
+from annotator.inpx import write_overlay
+from annotator.journal import (
+    EditHistory,
+    Journal,
+    align_action,
+    insert_action,
+    place_action,
+    remove_action,
+)
+from annotator.network import Network
+from annotator.overlay import OverlayStore
+
+ALIGNMENT = {
+    "offset_img_x": 0.0,
+    "offset_img_y": 0.0,
+    "scale_img": 1.0,
+    "offset_net_x": 0.0,
+    "offset_net_y": 0.0,
+    "scale_net": 1.0,
+}
+
+
+class Session:
+    # Network, alignment and edit history as the drawing area keeps them
+    def __init__(self, store: OverlayStore, alignment):
+        self.net = Network()
+        self.net.elements = store
+        self.alignment = dict(alignment)
+        self.history = EditHistory(
+            self.net, lambda: dict(self.alignment), self._set_alignment
+        )
+
+    def _set_alignment(self, alignment) -> None:
+        self.alignment.update(alignment)
+
+
+def _edit(session: Session, rng, steps: int) -> None:
+    net = session.net
+    history = session.history
+    for _ in range(steps):
+        action = rng.integers(6) if len(net.elements) else 0
+        if action == 0:
+            (x, y) = rng.uniform(0, 100, 2).tolist()
+            element = len(net.elements)
+            code = int(rng.integers(3))
+            net.insert_element(element, x, y, code)
+            history.push(insert_action([(element, x, y, code)]))
+        elif action == 1:
+            ids = rng.choice(len(net.elements), min(3, len(net.elements)), False)
+            removed = net.remove_elements(ids)
+            history.push(remove_action(removed))
+        elif action == 2:
+            ids = np.unique(rng.integers(0, len(net.elements), 4))
+            (old_xs, old_ys) = (net.elements.xs[ids], net.elements.ys[ids])
+            xs = old_xs + rng.normal(0, 1, len(ids))
+            ys = old_ys + rng.normal(0, 1, len(ids))
+            net.place_elements(ids, xs, ys)
+            history.push(place_action(ids, old_xs, old_ys, xs, ys))
+        elif action == 3:
+            old = dict(session.alignment)
+            session.alignment["offset_net_x"] += 5.0
+            session.alignment["scale_net"] *= 1.1
+            history.push(align_action(old, dict(session.alignment)))
+        elif action == 4:
+            history.undo()
+        else:
+            history.redo()
+
+
+def _assert_recovered(journal: Journal, session: Session) -> None:
+    (alignment, store, actions) = journal.recover()
+    recovered = Session(store, alignment)
+    recovered.history.replay(actions)
+    live = session.net.elements
+    np.testing.assert_array_equal(recovered.net.elements.xs, live.xs)
+    np.testing.assert_array_equal(recovered.net.elements.ys, live.ys)
+    np.testing.assert_array_equal(recovered.net.elements.types, live.types)
+    assert recovered.alignment == pytest.approx(session.alignment)
+
+
+def _store(rng, count: int) -> OverlayStore:
+    return OverlayStore.from_arrays(
+        rng.uniform(0, 100, count),
+        rng.uniform(0, 100, count),
+        rng.integers(0, 3, count).astype(np.uint8),
+    )
+
+
+@pytest.mark.parametrize("saved", [False, True])
+def test_recovery_matches_live_state(tmp_path, saved):
+    rng = np.random.default_rng(1)
+    path = str(tmp_path / "overlay.inpx")
+    store = _store(rng, 50 if saved else 0)
+    base = None
+    if saved:
+        write_overlay(path, ALIGNMENT, store)
+        base = path
+    session = Session(store, ALIGNMENT)
+    journal = Journal(path)
+    journal.start(dict(session.alignment), base)
+    session.history.journal = journal
+    _edit(session, rng, 300)
+
+    assert journal.pending()
+    _assert_recovered(journal, session)
+
+
+def test_recovery_after_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(Journal, "COMPACT_BYTES", 2000)
+    rng = np.random.default_rng(2)
+    path = str(tmp_path / "overlay.inpx")
+    store = _store(rng, 20)
+    original = (store.xs.copy(), store.ys.copy(), store.types.copy())
+    write_overlay(path, ALIGNMENT, store)
+    session = Session(store, ALIGNMENT)
+    journal = Journal(path)
+    journal.start(dict(session.alignment), path)
+    session.history.journal = journal
+    _edit(session, rng, 400)
+
+    # The edits outgrew the limit several times and now apply to a snapshot
+    (header, _) = journal._read()
+    assert header["base"] == journal.autosave_path
+    assert os.path.exists(journal.autosave_path)
+    _assert_recovered(journal, session)
+    # Undoing back past the snapshot is still journaled
+    while session.history.undo():
+        pass
+    _assert_recovered(journal, session)
+    live = session.net.elements
+    for (array, expected) in zip((live.xs, live.ys, live.types), original):
+        np.testing.assert_array_equal(array, expected)
+    assert session.alignment == pytest.approx(ALIGNMENT)
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    rng = np.random.default_rng(3)
+    path = str(tmp_path / "overlay.inpx")
+    session = Session(OverlayStore(), ALIGNMENT)
+    journal = Journal(path)
+    journal.start(dict(session.alignment), None)
+    session.history.journal = journal
+    _edit(session, rng, 50)
+    journal.close()
+    # A crash while appending the next action
+    with open(journal.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"op": "insert", "elem')
+    _assert_recovered(journal, session)
+
+
+def test_changed_base_is_rejected(tmp_path):
+    rng = np.random.default_rng(4)
+    path = str(tmp_path / "overlay.inpx")
+    write_overlay(path, ALIGNMENT, _store(rng, 5))
+    journal = Journal(path)
+    journal.start(dict(ALIGNMENT), path)
+    journal.close()
+    write_overlay(path, ALIGNMENT, _store(rng, 6))
+    with pytest.raises(Exception):
+        journal.recover()
+
+
+def test_discard_removes_journal_and_snapshot(tmp_path):
+    path = str(tmp_path / "overlay.inpx")
+    journal = Journal(path)
+    journal.compact(dict(ALIGNMENT), OverlayStore())
+    assert journal.pending()
+    journal.discard()
+    assert not journal.pending()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+from annotator.overlay import OverlayStore
+from annotator.spatial import GridIndex, PointIndex, point_boxes, segment_boxes
+
+
+def _store(xs: np.ndarray, ys: np.ndarray) -> OverlayStore:
+    store = OverlayStore()
+    store.extend(xs, ys, np.zeros(len(xs), dtype=np.uint8))
+    return store
+
+
+def _brute_force(store: OverlayStore, bbox) -> np.ndarray:
+    (min_x, min_y, max_x, max_y) = bbox
+    xs = store.xs
+    ys = store.ys
+    return np.flatnonzero((xs >= min_x) & (xs <= max_x) & (ys >= min_y) & (ys <= max_y))
+
+
+def _check(index: PointIndex, store: OverlayStore, rng) -> None:
+    boxes = [(-1e9, -1e9, 1e9, 1e9), (0.0, 0.0, 0.0, 0.0)]
+    for _ in range(40):
+        (x, y) = rng.uniform(-10, 110, 2)
+        (w, h) = rng.uniform(0, 40, 2)
+        boxes.append((x, y, x + w, y + h))
+    for bbox in boxes:
+        found = np.sort(index.query(bbox, store.xs, store.ys))
+        np.testing.assert_array_equal(found, _brute_force(store, bbox))
+
+
+# The edits below mirror how Network keeps the index in step with the store
+
+
+def _remove(index: PointIndex, store: OverlayStore, element: int) -> None:
+    last = len(store) - 1
+    index.remove(element, store.xs[element], store.ys[element])
+    if element != last:
+        index.relabel(last, element, store.xs[last], store.ys[last])
+    store.swap_remove(element)
+
+
+def _swap_insert(index: PointIndex, store: OverlayStore, element, x, y) -> None:
+    last = len(store)
+    if element != last:
+        index.relabel(element, last, store.xs[element], store.ys[element])
+    store.swap_insert(element, x, y, 0)
+    index.insert(element, x, y)
+
+
+def _move(index: PointIndex, store: OverlayStore, element, x, y) -> None:
+    index.remove(element, store.xs[element], store.ys[element])
+    index.insert(element, x, y)
+    store.set_points(np.array([element]), np.array([x]), np.array([y]))
+
+
+@pytest.mark.parametrize("count", [0, 1, 500])
+def test_point_index_matches_brute_force_after_edits(count):
+    rng = np.random.default_rng(count)
+    store = _store(rng.uniform(0, 100, count), rng.uniform(0, 100, count))
+    # Several points per cell, including points on cell borders
+    index = PointIndex(2.5, store.xs, store.ys)
+    _check(index, store, rng)
+
+    for step in range(600):
+        action = rng.integers(4) if len(store) else 0
+        if action == 0:
+            (x, y) = rng.uniform(0, 100, 2)
+            if step % 7 == 0:
+                (x, y) = (float(rng.integers(0, 40)) * 2.5, 50.0)
+            store.extend(np.array([x]), np.array([y]), np.zeros(1, np.uint8))
+            index.insert(len(store) - 1, x, y)
+        elif action == 1:
+            _remove(index, store, int(rng.integers(len(store))))
+        elif action == 2:
+            (x, y) = rng.uniform(0, 100, 2)
+            _swap_insert(index, store, int(rng.integers(len(store) + 1)), x, y)
+        else:
+            (x, y) = rng.uniform(0, 100, 2)
+            _move(index, store, int(rng.integers(len(store))), x, y)
+        if step % 50 == 0:
+            _check(index, store, rng)
+        if step == 300:
+            index.rebuild(store.xs, store.ys)
+    _check(index, store, rng)
+
+
+def test_remove_then_swap_insert_restores_query_results():
+    rng = np.random.default_rng(7)
+    store = _store(rng.uniform(0, 100, 200), rng.uniform(0, 100, 200))
+    index = PointIndex(5.0, store.xs, store.ys)
+    bbox = (20.0, 20.0, 70.0, 70.0)
+    before = np.sort(index.query(bbox, store.xs, store.ys))
+    removed = []
+    for element in (199, 0, 57, 57, 10):
+        removed.append((element, store.xs[element], store.ys[element]))
+        _remove(index, store, element)
+    # Undo in reverse order, as the edit history does
+    for (element, x, y) in reversed(removed):
+        _swap_insert(index, store, element, x, y)
+    np.testing.assert_array_equal(
+        np.sort(index.query(bbox, store.xs, store.ys)), before
+    )
+
+
+def test_needs_rebuild_after_many_inserts():
+    index = PointIndex(1.0, np.empty(0), np.empty(0))
+    for i in range(PointIndex.MIN_REBUILD + 1):
+        index.insert(i, float(i), 0.0)
+    assert index.needs_rebuild(PointIndex.MIN_REBUILD + 1)
+
+
+def test_grid_index_matches_brute_force():
+    rng = np.random.default_rng(3)
+    starts = rng.uniform(0, 1000, (300, 2))
+    ends = starts + rng.normal(0, 30, (300, 2))
+    # A few segments long enough to be checked on every query
+    ends[:5] = rng.uniform(0, 1000, (5, 2))
+    boxes = np.vstack(
+        (segment_boxes(starts, ends), point_boxes(rng.uniform(0, 1000, (300, 2))))
+    )
+    index = GridIndex(boxes)
+    for _ in range(100):
+        (x, y) = rng.uniform(-50, 1000, 2)
+        (w, h) = rng.uniform(0, 200, 2)
+        bbox = (x, y, x + w, y + h)
+        expected = np.flatnonzero(
+            (boxes[:, 0] <= bbox[2])
+            & (boxes[:, 2] >= bbox[0])
+            & (boxes[:, 1] <= bbox[3])
+            & (boxes[:, 3] >= bbox[1])
+        )
+        np.testing.assert_array_equal(np.sort(index.query(bbox)), expected)